@@ -1,12 +1,18 @@
+from .nodes.booru_posts.feed_watcher_node import BooruFeedWatcherNode
 from .nodes.booru_posts.get_aibooru_post_node import AIBooruPostNode
 from .nodes.booru_posts.get_any_post_node import AnyBooruPostAdvanced
 from .nodes.booru_posts.get_danbooru_post_node import DanbooruPostNode
 from .nodes.booru_posts.get_e621_post_node import E621PostNode
 from .nodes.booru_posts.get_gelbooru_post_node import GelbooruPostNode
 from .nodes.booru_posts.old_nodes import GetBooruPost
+from .nodes.booru_posts.post_relations_node import BooruPostSetNode
+from .nodes.booru_posts.random_post_node import RandomBooruPostNode
+from .nodes.booru_posts.save_original_node import SaveBooruOriginalNode
+from .nodes.booru_posts.tag_stats_node import BooruTagStatsNode
 from .nodes.misc.wiki_fetch_node import TagWikiFetch
+from .nodes.tagging.embedding_search_node import TaggerEmbeddingSearchNode
 from .nodes.tagging.pixai_tagger_node import PixAITaggerNode
-from .pyserver import get_tag_wiki_data  # noqa: F401
+from .pyserver import get_tag_wiki_data, tag_image  # noqa: F401
 
 NODE_CLASS_MAPPINGS = {
     "GetBooruPost": GetBooruPost,
@@ -15,9 +21,15 @@ NODE_CLASS_MAPPINGS = {
     "GetDanbooruPost": DanbooruPostNode,
     "GetE621Post": E621PostNode,
     "GetGelbooruPost": GelbooruPostNode,
+    "BTK_RandomBooruPost": RandomBooruPostNode,
+    "BTK_BooruFeedWatcher": BooruFeedWatcherNode,
+    "BTK_BooruTagStats": BooruTagStatsNode,
+    "BTK_BooruPostSet": BooruPostSetNode,
+    "BTK_SaveBooruOriginal": SaveBooruOriginalNode,
     "TagWikiFetch": TagWikiFetch,
     # tagging
     "BTK_PixAITaggerNode": PixAITaggerNode,
+    "BTK_TaggerEmbeddingSearch": TaggerEmbeddingSearchNode,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
@@ -27,9 +39,15 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "GetDanbooruPost": "Get Danbooru Post",
     "GetE621Post": "Get e621/e6ai Post",
     "GetGelbooruPost": "Get Gelbooru Post",
+    "BTK_RandomBooruPost": "Random Booru Post",
+    "BTK_BooruFeedWatcher": "Booru Feed Watcher",
+    "BTK_BooruTagStats": "Booru Tag Stats",
+    "BTK_BooruPostSet": "Booru Pool / Related Posts",
+    "BTK_SaveBooruOriginal": "Save Booru Original File",
     "TagWikiFetch": "[OLD] Tag Wiki Lookup",
     # tagging
     "BTK_PixAITaggerNode": "PixAI Tagger v0.9",
+    "BTK_TaggerEmbeddingSearch": "Tagger Embedding Search",
 }
 
 WEB_DIRECTORY = "./js"
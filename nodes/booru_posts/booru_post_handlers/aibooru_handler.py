@@ -9,6 +9,25 @@ class AIBooruHandler(BooruHandlerBase):
 
     SUPPORTED_DOMAINS = ["aibooru.online", "safe.shargone.com"]
     HANDLER_NAME = "AIBooru"
+    SEARCH_PAGE_LIMIT = 200
+    # danbooru fork, same field selection
+    FIELDS_PARAM = "only"
+    COLLECTION_PATHS = ["pools", "favorite_groups"]
+    API_FIELDS = [
+        "id",
+        "tag_string_general",
+        "tag_string_character",
+        "tag_string_copyright",
+        "tag_string_artist",
+        "tag_string_meta",
+        "tag_string_model",
+        "image_width",
+        "image_height",
+        "file_url",
+        "media_asset[variants]",
+        "parent_id",
+        "has_children",
+    ]
 
     def parse(self, response: Dict, img_size: str) -> Tuple[Dict[str, str], int, int, Optional[str]]:
         """Parse AIBooru API response."""
@@ -9,6 +9,23 @@ class DanbooruHandler(BooruHandlerBase):
     # NOTE: safebooru.donmai.us is NOT safebooru.org
     SUPPORTED_DOMAINS = ["danbooru.donmai.us", "safebooru.donmai.us", "donmai.moe"]
     HANDLER_NAME = "Danbooru"
+    SEARCH_PAGE_LIMIT = 200
+    FIELDS_PARAM = "only"
+    COLLECTION_PATHS = ["pools", "favorite_groups"]
+    API_FIELDS = [
+        "id",
+        "tag_string_general",
+        "tag_string_character",
+        "tag_string_copyright",
+        "tag_string_artist",
+        "tag_string_meta",
+        "image_width",
+        "image_height",
+        "file_url",
+        "media_asset[variants]",
+        "parent_id",
+        "has_children",
+    ]
 
     def parse(self, response: Dict, img_size: str) -> Tuple[Dict[str, str], int, int, Optional[str]]:
         """Parse Danbooru API response."""
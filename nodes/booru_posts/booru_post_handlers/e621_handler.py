@@ -1,4 +1,4 @@
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from ..booru_post_handlers.handler_base import BooruHandlerBase
 
@@ -9,6 +9,32 @@ class E621Handler(BooruHandlerBase):
     # NOTE: for now e6ai seems to have same json keys besides artis > director
     SUPPORTED_DOMAINS = ["e621.net", "e926.net", "e6ai.net"]
     HANDLER_NAME = "e621/e6ai"
+    SEARCH_PAGE_LIMIT = 320
+    # e621 has no field selection parameter, unused keys (description, score, ...) are dropped after decoding
+    API_FIELDS = ["id", "tags", "file", "sample", "preview", "relationships"]
+    # post_sets are e621's user curated sets
+    COLLECTION_PATHS = ["pools", "post_sets"]
+
+    def parse_search(self, response: Dict) -> List[Dict]:
+        # search returns {"posts": [...]}, a single post is {"post": {...}}
+        return [{"post": post} for post in response.get("posts", [])]
+
+    def select_fields(self, data: Dict) -> Dict:
+        # fields are picked inside the {"post": ...} / {"posts": [...]} wrapper
+        if "post" in data:
+            return {"post": super().select_fields(data["post"])}
+        if "posts" in data:
+            return {"posts": super().select_fields(data["posts"])}
+        return data
+
+    def get_post_id(self, post_response: Dict) -> int:
+        return int(post_response["post"]["id"])
+
+    def get_relations(self, post_response: Dict) -> Tuple[Optional[int], Optional[List[int]], bool]:
+        # e621 lists the children, no search needed
+        relationships = post_response["post"].get("relationships") or {}
+        children = [int(c) for c in relationships.get("children") or []]
+        return relationships.get("parent_id"), children, bool(children)
 
     def parse(self, response: Dict, img_size: str) -> Tuple[Dict[str, str], int, int, Optional[str]]:
         """Parse e621/e6ai API response."""
@@ -1,4 +1,5 @@
 from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
 
 from .handler_base import BooruHandlerBase
 
@@ -29,6 +30,11 @@ class GelbooruHandler(BooruHandlerBase):
         elif "safebooru.org" in url and "id=" in url:
             post_id = url.split("id=")[1].split("&")[0]
             return f"https://safebooru.org/index.php?page=dapi&s=post&q=index&id={post_id}&json=1"
+        elif "index.php" in url and "id=" in url and "page=dapi" not in url:
+            # other sites running gelbooru
+            parsed = urlparse(url)
+            post_id = parse_qs(parsed.query).get("id", [""])[0]
+            return f"{parsed.scheme}://{parsed.netloc}{parsed.path}?page=dapi&s=post&q=index&id={post_id}&json=1"
         return url
 
     def parse(self, response: Dict, img_size: str) -> Tuple[Dict[str, str], int, int, Optional[str]]:
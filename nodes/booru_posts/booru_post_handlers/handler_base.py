@@ -1,11 +1,19 @@
+import json
 import logging
 from abc import ABC, abstractmethod
 from typing import Dict, List, Optional, Tuple, Union
-from urllib.parse import urlparse
+from urllib.parse import urlencode, urlparse
 
-from curl_cffi import requests
 from curl_cffi.requests.exceptions import RequestException
 
+try:
+    import orjson
+except ImportError:  # optional, only makes decoding big responses faster
+    orjson = None
+
+from ..http_client import http_client
+from .resilience import HostUnavailableError, breakers, last_good, negative_cache
+
 class BooruHandlerBase(ABC):
     """
     Abstract base class for all booru handlers. Subclasses must define parse() function.
@@ -16,6 +24,15 @@ class BooruHandlerBase(ABC):
     # these are, and should be defined by child classes
     SUPPORTED_DOMAINS: List[str] = []
     HANDLER_NAME: str = ""
+    # posts per search page, 0 = the handler doesn't support tag searches
+    SEARCH_PAGE_LIMIT: int = 0
+    # post keys parse() reads, everything else is dropped from responses (empty keeps all).
+    # "key[sub,keys]" selects nested keys where the API supports it
+    API_FIELDS: List[str] = []
+    # query parameter the API selects fields with (Danbooru: "only"), so the rest isn't even sent
+    FIELDS_PARAM: str = ""
+    # URL path segments of post collections (pools, sets, ...), <site>/<segment>/<id>.json lists their "post_ids"
+    COLLECTION_PATHS: List[str] = []
 
     @classmethod
     def can_handle(cls, url: str) -> bool:
@@ -30,40 +47,153 @@ class BooruHandlerBase(ABC):
         # add .json if not present and remove any extra params, they probably aren't needed
         if ".json" not in url:
             url = url.split("?")[0] + ".json"
-        return url
+        return cls._with_fields(url)
+
+    @classmethod
+    def _with_fields(cls, api_url: str) -> str:
+        """Add the field selection parameter to an API URL."""
+        if not (cls.FIELDS_PARAM and cls.API_FIELDS) or f"{cls.FIELDS_PARAM}=" in api_url:
+            return api_url
+        separator = "&" if "?" in api_url else "?"
+        return api_url + separator + urlencode({cls.FIELDS_PARAM: ",".join(cls.API_FIELDS)})
+
+    @classmethod
+    def get_search_url(
+        cls,
+        site_url: str,
+        tags: str,
+        before_id: Optional[int] = None,
+        limit: int = 0,
+        after_id: Optional[int] = None,
+    ) -> str:
+        """
+        API URL of one page of a tag search, newest posts first. before_id pages backwards from a post ID,
+        after_id forwards (the next `limit` posts above the ID), limit lowers the page size.
+        Danbooru-like by default (posts.json?tags=...&page=b<id> / a<id>), override for other APIs.
+        """
+        if not cls.SEARCH_PAGE_LIMIT:
+            raise NotImplementedError(f"{cls.HANDLER_NAME} doesn't support tag searches")
+        params = {"tags": tags, "limit": min(limit, cls.SEARCH_PAGE_LIMIT) if limit > 0 else cls.SEARCH_PAGE_LIMIT}
+        if before_id is not None:
+            params["page"] = f"b{before_id}"
+        elif after_id is not None:
+            params["page"] = f"a{after_id}"
+        parsed = urlparse(site_url if "://" in site_url else "https://" + site_url)
+        return cls._with_fields(f"{parsed.scheme}://{parsed.netloc}/posts.json?{urlencode(params)}")
+
+    @classmethod
+    def get_ids_query(cls, post_ids: List[int]) -> str:
+        """Search query matching exactly the given post IDs, to fetch them with one search request."""
+        return "id:" + ",".join(str(post_id) for post_id in post_ids)
+
+    def get_relations(self, post_response: Dict) -> Tuple[Optional[int], Optional[List[int]], bool]:
+        """
+        (parent ID, child IDs, whether the post has children) of a post, Danbooru-like by default.
+        Child IDs are None when the API only says that there are children (they're searched with parent:<id>).
+        """
+        parent_id = post_response.get("parent_id")
+        return (int(parent_id) if parent_id else None), None, bool(post_response.get("has_children"))
+
+    def parse_search(self, response) -> List[Dict]:
+        """Split a search response into single post responses that parse() accepts."""
+        return response if isinstance(response, list) else response.get("posts", [])
+
+    def get_post_id(self, post_response: Dict) -> int:
+        return int(post_response["id"])
+
+    def decode_response(self, content: bytes):
+        """Decode a JSON API response (single post or search page), keeping only API_FIELDS."""
+        data = orjson.loads(content) if orjson is not None else json.loads(content)
+        return self.select_fields(data)
+
+    def select_fields(self, data):
+        """Drop post keys parse() doesn't use, for APIs without a field parameter (or that ignore it)."""
+        if not self.API_FIELDS:
+            return data
+        if isinstance(data, list):
+            return [self.select_fields(post) for post in data]
+        if not isinstance(data, dict):
+            return data
+        keys = {field.split("[")[0] for field in self.API_FIELDS}
+        return {k: v for k, v in data.items() if k in keys}
 
     def fetch(self, url: str, img_size: str, headers: Dict[str, str]) -> Dict:
+        """Blocking fetch_async()."""
+        return http_client.run_sync(self.fetch_async(url, img_size, headers))
+
+    async def fetch_async(self, url: str, img_size: str, headers: Dict[str, str]) -> Dict:
         """
         Fetch data from the API.
-        Handles common errors and provides fallbacks.
+        Handles common errors and provides fallbacks: deleted/missing posts are remembered for a while
+        and hosts that keep failing are skipped (see resilience.py).
         """
+        api_url = self.get_api_url(url)
+        cached = negative_cache.get(api_url)
+        if cached is not None:
+            error, cached_response = cached
+            if error:
+                raise ValueError(error)
+            return cached_response
+
+        breaker = breakers.get(urlparse(api_url).hostname)
+        if not breaker.allow():
+            stale = last_good.get(api_url)
+            if stale is not None:
+                logging.warning(f"{breaker.host} is failing, using the last response of {api_url}")
+                return stale
+            raise HostUnavailableError(f"{breaker.host} is failing, skipping requests for {breaker.retry_in():.0f}s")
+
+        response = None
         try:
-            api_url = self.get_api_url(url)
             logging.info(f"Fetching from {self.HANDLER_NAME}: {api_url}")
 
-            response = requests.get(
-                api_url,
-                headers=headers,
-                timeout=10,
-                impersonate="firefox",
-            )
+            # hedged, a stalled connection is raced by a second request (see http_client.py)
+            response = await http_client.get(api_url, headers=headers, timeout=10)
+        except RequestException as e:
+            logging.error(f"Failed to fetch from {self.HANDLER_NAME}: {e}")
+            raise ValueError(f"Failed to fetch data from {self.HANDLER_NAME}: {e}")
+        finally:
+            # timeouts and connection errors count against the host, so does a cancelled request:
+            # the breaker may be waiting for it as its half-open probe
+            if response is None:
+                breaker.record_failure()
+
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if response.status_code in (404, 410):
+            error = f"Post not found on {self.HANDLER_NAME} (HTTP {response.status_code}): {url}"
+            negative_cache.add(api_url, error=error)
+            raise ValueError(error)
+        try:
             response.raise_for_status()
-
-            # Try JSON first
-            try:
-                return response.json()
-            except ValueError:
-                # todo: todo
-                raise ValueError("Invalid JSON response: " + response.text)
-                # If JSON fails, try XML
-                return self._parse_xml_response(response.text)
-
         except RequestException as e:
             logging.error(f"Failed to fetch from {self.HANDLER_NAME}: {e}")
             raise ValueError(f"Failed to fetch data from {self.HANDLER_NAME}: {e}")
-        except Exception as e:
-            logging.error(f"Unexpected error fetching from {self.HANDLER_NAME}: {e}")
-            raise ValueError(f"Unexpected error: {e}")
+
+        # Try JSON first
+        try:
+            data = self.decode_response(response.content)
+        except ValueError:
+            # todo: todo
+            raise ValueError("Invalid JSON response: " + response.text)
+            # If JSON fails, try XML
+            return self._parse_xml_response(response.text)
+
+        if self.is_unavailable(data):
+            # deleted or hidden for guests, the response stays the same for a while
+            negative_cache.add(api_url, response=data)
+        else:
+            last_good.put(api_url, data)
+        return data
+
+    def is_unavailable(self, response: Dict) -> bool:
+        """Whether the post has no downloadable file (deleted, or hidden without an account)."""
+        try:
+            return self.parse(response, "original")[3] is None
+        except Exception:
+            return False
 
     def _parse_xml_response(self, xml_text: str) -> Dict:
         """Parse XML response (some boorus seem to use it) UNFINISHED.
@@ -1,11 +1,25 @@
+import asyncio
 import importlib
+import json
 import logging
 import os
 import pkgutil
-from typing import Dict, List, Optional, Type
+import threading
+from typing import Dict, List, Optional, Tuple, Type
+from urllib.parse import urlparse
 
 from ..booru_post_handlers.handler_base import BooruHandlerBase
 
+# hosts not in any SUPPORTED_DOMAINS whose API shape was found by probing, host -> handler key
+LEARNED_DOMAINS_PATH = os.environ.get(
+    "BTK_LEARNED_DOMAINS",
+    os.path.normpath(
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "..", "cache", "learned_domains.json")
+    ),
+)
+
+_PROBE_ORDER = ("danbooru", "e621_e6ai", "gelbooru")
+
 
 class HandlerRegistry:
     """
@@ -15,7 +29,12 @@ class HandlerRegistry:
     def __init__(self):
         self._handlers: Dict[str, Type[BooruHandlerBase]] = {}
         self._instances: Dict[str, BooruHandlerBase] = {}
+        # domain -> handler key, a host is looked up with each of its parent domains (a.b.c, b.c, c)
+        self._domains: Dict[str, str] = {}
+        self._learned: Dict[str, str] = {}
+        self._learned_lock = threading.Lock()
         self._auto_discover()
+        self._load_learned()
 
     def _auto_discover(self):
         """Automatically discover all handler classes in the files in the booru_handlers folder.
@@ -38,22 +57,85 @@ class HandlerRegistry:
 
                             self._handlers[handler_key] = attr
                             self._instances[handler_key] = handler_instance
+                            for domain in attr.SUPPORTED_DOMAINS:
+                                self._domains.setdefault(domain.lower(), handler_key)
                             logging.info(f"Registered handler: {attr.HANDLER_NAME} ({handler_key})")
 
                 except Exception as e:
                     logging.error(f"Failed to load handler from {name}: {e}")
 
+    def _load_learned(self):
+        try:
+            with open(LEARNED_DOMAINS_PATH, "r", encoding="utf-8") as f:
+                learned = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring learned booru domains in {LEARNED_DOMAINS_PATH}: {e}")
+            return
+        self._learned = {host: key for host, key in learned.items() if key in self._instances}
+
+    def _save_learned(self):
+        os.makedirs(os.path.dirname(LEARNED_DOMAINS_PATH), exist_ok=True)
+        tmp_path = LEARNED_DOMAINS_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._learned, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, LEARNED_DOMAINS_PATH)
+
     def get_handler_for_url(self, url: str) -> Optional[BooruHandlerBase]:
-        """Get the appropriate handler for a given URL."""
-        for handler in self._instances.values():
-            if handler.can_handle(url):
-                return handler
-        return None
+        """Get the appropriate handler for a given URL (known or learned domains only, no requests)."""
+        host = (urlparse(url).hostname or "").lower()
+        if not host:
+            return None
+        key = self._learned.get(host)
+        if key is None:
+            labels = host.split(".")
+            key = next(
+                (self._domains[d] for d in (".".join(labels[i:]) for i in range(len(labels))) if d in self._domains),
+                None,
+            )
+        return self._instances.get(key) if key else None
+
+    async def probe_handler(self, url: str, headers: Dict[str, str]) -> Tuple[BooruHandlerBase, Dict]:
+        """
+        Find the handler for a host that isn't in any SUPPORTED_DOMAINS (clones of the supported engines):
+        every handler's API URL is requested concurrently, the first one in _PROBE_ORDER whose parse()
+        gives tags and an image is picked and remembered for the host. Returns it with its response.
+        """
+        host = (urlparse(url).hostname or "").lower()
+        candidates = [(key, h) for key, h in self._instances.items() if h.SUPPORTED_DOMAINS]
+        # the engines' reference handlers win over forks that read the same format (AIBooru is a danbooru fork)
+        candidates.sort(key=lambda c: _PROBE_ORDER.index(c[0]) if c[0] in _PROBE_ORDER else len(_PROBE_ORDER))
+
+        async def attempt(handler: BooruHandlerBase):
+            response = await handler.fetch_async(url, "original", headers)
+            tags_dict, width, height, image_url = handler.parse(response, "original")
+            # most parsers accept any JSON and return empty defaults, so require actual post data
+            if not any(tags_dict.values()) or not (image_url or width):
+                raise ValueError("response has no post data in this handler's format")
+            return response
+
+        results = await asyncio.gather(*(attempt(h) for _, h in candidates), return_exceptions=True)
+        for (key, handler), result in zip(candidates, results):
+            if not isinstance(result, BaseException):
+                logging.info(f"Learned that {host} uses the {handler.HANDLER_NAME} API")
+                with self._learned_lock:
+                    self._learned[host] = key
+                    self._save_learned()
+                return handler, result
+        errors = "; ".join(f"{h.HANDLER_NAME}: {r}" for (_, h), r in zip(candidates, results))
+        raise ValueError(f"No handler could read posts from {host} ({errors})")
 
     def get_handler_by_name(self, name: str) -> Optional[BooruHandlerBase]:
         """Get a handler by its registered HANDLER_NAME."""
         return self._instances.get(name.lower().replace("/", "_").replace(" ", "_"))
 
+    def get_handler_for(self, url: str, api_type: str = "auto") -> Optional[BooruHandlerBase]:
+        """Handler of an api_type choice (see get_handler_choices), 'auto' detects it from the URL."""
+        if api_type == "auto":
+            return self.get_handler_for_url(url)
+        return self.get_handler_by_name(api_type)
+
     def get_all_handlers(self) -> Dict[str, BooruHandlerBase]:
         """Get all registered handlers."""
         return self._instances.copy()
@@ -69,4 +151,10 @@ class HandlerRegistry:
         return choices
 
 
+def site_root(url: str) -> str:
+    """scheme://host of a site or post URL, https:// is assumed for a bare host name."""
+    parsed = urlparse(url if "://" in url else "https://" + url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
 registry = HandlerRegistry()
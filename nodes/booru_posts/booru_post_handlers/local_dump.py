@@ -0,0 +1,319 @@
+"""
+Local post-metadata dumps with a memory-mapped ID index, used by the "Local dump" handler.
+
+Build once from a public dump, run from the repository root:
+    python -m nodes.booru_posts.booru_post_handlers.local_dump build e621 posts-2024-01-01.csv.gz --tags tags-2024-01-01.csv.gz
+    python -m nodes.booru_posts.booru_post_handlers.local_dump build danbooru posts.jsonl   (or .jsonl.gz / .parquet)
+    python -m nodes.booru_posts.booru_post_handlers.local_dump lookup e621 12345
+
+The e621 posts export has no tag categories, pass the tags export of the same day with --tags
+(without it every tag ends up in general). Danbooru parquet needs pyarrow.
+
+A built dump is a folder of columns: every string column is a utf-8 blob plus an int64 offsets file,
+number columns are raw int32. ids.i64 holds the sorted post IDs and rows.i32 the column row of each,
+so a lookup is one binary search over a memmap plus a few slices.
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+DUMPS_DIR = os.environ.get(
+    "BTK_DUMPS_DIR",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "..", "dumps")),
+)
+
+# columns kept per site, everything else in the dump is dropped
+SCHEMAS = {
+    "e621": {
+        "strings": [
+            "tag_general",
+            "tag_artist",
+            "tag_contributor",
+            "tag_copyright",
+            "tag_character",
+            "tag_species",
+            "tag_meta",
+            "md5",
+            "file_ext",
+        ],
+        "ints": ["image_width", "image_height"],
+    },
+    "danbooru": {
+        "strings": [
+            "tag_string_general",
+            "tag_string_character",
+            "tag_string_copyright",
+            "tag_string_artist",
+            "tag_string_meta",
+            "md5",
+            "file_ext",
+            "file_url",
+            "large_file_url",
+            "preview_file_url",
+        ],
+        "ints": ["image_width", "image_height"],
+    },
+}
+
+# e621 tag category ids as used in its tags export
+E621_CATEGORIES = {0: "general", 1: "artist", 2: "contributor", 3: "copyright", 4: "character", 5: "species", 7: "meta"}
+
+_FLUSH_ROWS = 100_000
+
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def _csv_rows(path: str) -> Iterator[Dict[str, str]]:
+    # descriptions in the e621 export can be longer than csv's default field limit
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+    with _open_text(path) as f:
+        yield from csv.DictReader(f)
+
+
+def _e621_tag_categories(tags_path: str) -> Dict[str, str]:
+    categories = {}
+    for row in _csv_rows(tags_path):
+        category = E621_CATEGORIES.get(int(row.get("category") or 0))
+        if category:
+            categories[row["name"]] = category
+    logging.info(f"Loaded {len(categories)} e621 tag categories")
+    return categories
+
+
+def _e621_records(posts_path: str, tags_path: str = "") -> Iterator[Dict]:
+    categories = _e621_tag_categories(tags_path) if tags_path else {}
+    if not categories:
+        logging.warning("No e621 tags export given, all tags are stored as general tags")
+    for row in _csv_rows(posts_path):
+        if row.get("is_deleted") == "t":
+            continue
+        tags = {name: [] for name in E621_CATEGORIES.values()}
+        for tag in row.get("tag_string", "").split():
+            tags[categories.get(tag, "general")].append(tag)
+        record = {f"tag_{name}": " ".join(values) for name, values in tags.items()}
+        record.update(
+            id=int(row["id"]),
+            md5=row.get("md5", ""),
+            file_ext=row.get("file_ext", ""),
+            image_width=int(row.get("image_width") or 0),
+            image_height=int(row.get("image_height") or 0),
+        )
+        yield record
+
+
+def _danbooru_records(posts_path: str) -> Iterator[Dict]:
+    if posts_path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Reading parquet dumps needs pyarrow (pip install pyarrow). " + str(e)) from e
+        columns = ["id"] + SCHEMAS["danbooru"]["strings"] + SCHEMAS["danbooru"]["ints"]
+        parquet = pq.ParquetFile(posts_path)
+        columns = [c for c in columns if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(columns=columns):
+            yield from batch.to_pylist()
+        return
+
+    with _open_text(posts_path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class _ColumnWriter:
+    """Streams records into column files, rows are kept in input order."""
+
+    def __init__(self, path: str, schema: Dict[str, List[str]]):
+        self.path = path
+        self.schema = schema
+        self.rows = 0
+        self._files = {}
+        self._offsets = {name: 0 for name in schema["strings"]}
+        self._pending: Dict[str, list] = {}
+        for name in schema["strings"]:
+            self._files[name] = open(os.path.join(path, f"{name}.bin"), "wb")
+            self._files[name + ".off"] = open(os.path.join(path, f"{name}.off"), "wb")
+            self._pending[name + ".off"] = [0]
+        for name in schema["ints"]:
+            self._files[name] = open(os.path.join(path, f"{name}.i32"), "wb")
+            self._pending[name] = []
+        self._files["id"] = open(os.path.join(path, "ids_unsorted.i64"), "wb")
+        self._pending["id"] = []
+
+    def add(self, record: Dict):
+        self._pending["id"].append(int(record["id"]))
+        for name in self.schema["strings"]:
+            data = (record.get(name) or "").encode("utf-8")
+            self._files[name].write(data)
+            self._offsets[name] += len(data)
+            self._pending[name + ".off"].append(self._offsets[name])
+        for name in self.schema["ints"]:
+            self._pending[name].append(int(record.get(name) or 0))
+        self.rows += 1
+        if self.rows % _FLUSH_ROWS == 0:
+            self._flush()
+
+    def _flush(self):
+        for name, values in self._pending.items():
+            dtype = np.int32 if name in self.schema["ints"] else np.int64
+            np.asarray(values, dtype=dtype).tofile(self._files[name])
+            values.clear()
+
+    def close(self):
+        self._flush()
+        for f in self._files.values():
+            f.close()
+
+
+def build(site: str, posts_path: str, tags_path: str = "", dumps_dir: str = DUMPS_DIR) -> str:
+    """Convert a posts dump into the column format, replaces a previous build of the same site."""
+    if site not in SCHEMAS:
+        raise ValueError(f"Unknown dump site '{site}', expected one of {list(SCHEMAS)}")
+    records = _e621_records(posts_path, tags_path) if site == "e621" else _danbooru_records(posts_path)
+
+    # build next to the old one and swap at the end, so lookups keep working meanwhile
+    final_path = os.path.join(dumps_dir, site)
+    path = final_path + ".building"
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+    start = time.perf_counter()
+    writer = _ColumnWriter(path, SCHEMAS[site])
+    try:
+        for record in records:
+            writer.add(record)
+            if writer.rows % 1_000_000 == 0:
+                logging.info(f"{writer.rows} posts")
+    finally:
+        writer.close()
+
+    ids = np.fromfile(os.path.join(path, "ids_unsorted.i64"), dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    ids[order].tofile(os.path.join(path, "ids.i64"))
+    order.astype(np.int32).tofile(os.path.join(path, "rows.i32"))
+    os.remove(os.path.join(path, "ids_unsorted.i64"))
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"site": site, "source": os.path.basename(posts_path), "count": int(len(ids)), "built": time.time()}, f)
+
+    shutil.rmtree(final_path, ignore_errors=True)
+    os.replace(path, final_path)
+    logging.info(f"Built {site} dump with {len(ids)} posts in {time.perf_counter() - start:.0f}s: {final_path}")
+    return final_path
+
+
+class DumpStore:
+    """Read side of one built dump, all files are memory-mapped on first use."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.schema = SCHEMAS[self.meta["site"]]
+        self._maps: Dict[str, np.ndarray] = {}
+
+    def _map(self, file_name: str, dtype) -> np.ndarray:
+        array = self._maps.get(file_name)
+        if array is None:
+            file_path = os.path.join(self.path, file_name)
+            # np.memmap can't map empty files
+            if os.path.getsize(file_path) == 0:
+                array = np.empty(0, dtype=dtype)
+            else:
+                array = np.memmap(file_path, dtype=dtype, mode="r")
+            self._maps[file_name] = array
+        return array
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def __contains__(self, post_id: int) -> bool:
+        return self._row(post_id) is not None
+
+    def _row(self, post_id: int) -> Optional[int]:
+        ids = self._map("ids.i64", np.int64)
+        pos = int(np.searchsorted(ids, post_id))
+        if pos >= len(ids) or ids[pos] != post_id:
+            return None
+        return int(self._map("rows.i32", np.int32)[pos])
+
+    def get(self, post_id: int) -> Optional[Dict]:
+        """The stored columns of a post, None if it's not in the dump."""
+        row = self._row(post_id)
+        if row is None:
+            return None
+        record = {"id": post_id}
+        for name in self.schema["strings"]:
+            offsets = self._map(f"{name}.off", np.int64)
+            start, end = int(offsets[row]), int(offsets[row + 1])
+            record[name] = self._map(f"{name}.bin", np.uint8)[start:end].tobytes().decode("utf-8")
+        for name in self.schema["ints"]:
+            record[name] = int(self._map(f"{name}.i32", np.int32)[row])
+        return record
+
+    def iter_ids(self) -> Iterable[int]:
+        return (int(i) for i in self._map("ids.i64", np.int64))
+
+
+_stores: Dict[str, Optional[DumpStore]] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(site: str, dumps_dir: str = DUMPS_DIR) -> Optional[DumpStore]:
+    """Shared store of a built dump, None if the site has no dump. Reopened when it gets rebuilt."""
+    path = os.path.join(dumps_dir, site)
+    meta_path = os.path.join(path, "meta.json")
+    try:
+        mtime = os.stat(meta_path).st_mtime_ns
+    except OSError:
+        return None
+    key = f"{path}:{mtime}"
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = DumpStore(path)
+        return _stores[key]
+
+
+def available_sites(dumps_dir: str = DUMPS_DIR) -> List[str]:
+    return [site for site in SCHEMAS if os.path.exists(os.path.join(dumps_dir, site, "meta.json"))]
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Convert a posts dump")
+    build_parser.add_argument("site", choices=list(SCHEMAS))
+    build_parser.add_argument("posts", help="e621 posts-*.csv(.gz), or Danbooru .jsonl(.gz)/.parquet")
+    build_parser.add_argument("--tags", default="", help="e621 tags-*.csv(.gz) for tag categories")
+    lookup_parser = commands.add_parser("lookup", help="Print the stored record of a post")
+    lookup_parser.add_argument("site", choices=list(SCHEMAS))
+    lookup_parser.add_argument("post_id", type=int)
+    parser.add_argument("--dumps-dir", default=DUMPS_DIR)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "build":
+        build(args.site, args.posts, args.tags, args.dumps_dir)
+    else:
+        store = get_store(args.site, args.dumps_dir)
+        if store is None:
+            raise SystemExit(f"No {args.site} dump built in {args.dumps_dir}")
+        print(json.dumps(store.get(args.post_id), indent=2))
+
+
+if __name__ == "__main__":
+    main()
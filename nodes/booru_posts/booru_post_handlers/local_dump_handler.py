@@ -0,0 +1,103 @@
+import re
+from typing import Dict, Optional, Tuple
+
+# modules instead of the handler classes, so the registry doesn't find and register them here a second time
+from . import danbooru_handler, e621_handler
+from .handler_base import BooruHandlerBase
+from .local_dump import E621_CATEGORIES, available_sites, get_store
+
+
+class LocalDumpHandler(BooruHandlerBase):
+    """
+    Handler that resolves posts from a locally built metadata dump (see local_dump.py) instead of the API.
+
+    Accepts e621/e926/e6ai and Danbooru post URLs, "e621:12345" / "danbooru:12345",
+    or a bare ID when only one dump is built. parse() gives the same output as the site's own handler.
+    """
+
+    # never picked in auto mode, select "Local dump" as api type
+    SUPPORTED_DOMAINS = []
+    HANDLER_NAME = "Local dump"
+
+    SITE_HANDLERS = {"e621": e621_handler.E621Handler, "danbooru": danbooru_handler.DanbooruHandler}
+
+    def __init__(self):
+        self._parsers = {site: handler_cls() for site, handler_cls in self.SITE_HANDLERS.items()}
+
+    def resolve(self, url: str) -> Tuple[str, int]:
+        """(site, post id) for a post URL, "site:id" or bare id."""
+        url = url.strip()
+        if match := re.fullmatch(r"(e621|danbooru):(\d+)", url, re.IGNORECASE):
+            return match.group(1).lower(), int(match.group(2))
+        if url.isdigit():
+            sites = available_sites()
+            if len(sites) != 1:
+                raise ValueError(f"Bare post ID is ambiguous with dumps for {sites or 'no sites'}, use e.g. e621:{url}")
+            return sites[0], int(url)
+
+        site = next((s for s, cls in self.SITE_HANDLERS.items() if cls.can_handle(url)), None)
+        # /posts/123 on both sites, e621 also has /post/show/123
+        match = re.search(r"/posts?/(?:show/)?(\d+)", url)
+        if site is None or match is None:
+            raise ValueError(f"Can't get a post ID for a local dump from: {url}")
+        return site, int(match.group(1))
+
+    def fetch(self, url: str, img_size: str, headers: Dict[str, str]) -> Dict:
+        """Look the post up in the dump, returns it in the site's API response format."""
+        site, post_id = self.resolve(url)
+        store = get_store(site)
+        if store is None:
+            raise ValueError(f"No local {site} dump built, see local_dump.py")
+        record = store.get(post_id)
+        if record is None:
+            raise ValueError(f"Post {post_id} is not in the local {site} dump ({store.meta.get('source')})")
+        response = self._e621_response(record) if site == "e621" else self._danbooru_response(record)
+        return {"site": site, "response": response}
+
+    async def fetch_async(self, url: str, img_size: str, headers: Dict[str, str]) -> Dict:
+        # a memmap lookup, not worth a thread
+        return self.fetch(url, img_size, headers)
+
+    def parse(self, response: Dict, img_size: str) -> Tuple[Dict[str, str], int, int, Optional[str]]:
+        return self._parsers[response["site"]].parse(response["response"], img_size)
+
+    def get_post_id(self, post_response: Dict) -> int:
+        return self._parsers[post_response["site"]].get_post_id(post_response["response"])
+
+    @staticmethod
+    def _e621_response(record: Dict) -> Dict:
+        md5, ext = record["md5"], record["file_ext"]
+        file_url = sample_url = preview_url = None
+        if md5:
+            path = f"{md5[:2]}/{md5[2:4]}/{md5}"
+            file_url = f"https://static1.e621.net/data/{path}.{ext}"
+            preview_url = f"https://static1.e621.net/data/preview/{path}.jpg"
+            # e621 only has samples for images larger than 850px
+            is_large = max(record["image_width"], record["image_height"]) > 850
+            sample_url = f"https://static1.e621.net/data/sample/{path}.jpg" if is_large else file_url
+        tags = {name: record[f"tag_{name}"].split() for name in E621_CATEGORIES.values()}
+        return {
+            "post": {
+                "id": record["id"],
+                "tags": tags,
+                "file": {"width": record["image_width"], "height": record["image_height"], "url": file_url},
+                "sample": {"url": sample_url},
+                "preview": {"url": preview_url},
+            }
+        }
+
+    @staticmethod
+    def _danbooru_response(record: Dict) -> Dict:
+        response = dict(record)
+        if not response["file_url"] and response["md5"]:
+            md5 = response["md5"]
+            response["file_url"] = f"https://cdn.donmai.us/original/{md5[:2]}/{md5[2:4]}/{md5}.{response['file_ext']}"
+        # rebuild the media asset variants the Danbooru handler picks sizes from
+        variants = [
+            ("180x180", response["preview_file_url"]),
+            ("sample", response["large_file_url"]),
+            ("original", response["file_url"]),
+        ]
+        response["media_asset"] = {"variants": [{"type": t, "url": u} for t, u in variants if u]}
+        return response
+
@@ -0,0 +1,164 @@
+"""
+Fail-fast helpers for booru requests: a short-lived cache of definitive results (deleted/missing posts)
+and a circuit breaker per host, so a dead site or mirror costs one timeout instead of one per post.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# seconds a 404/410 or a post without a file is remembered
+NEGATIVE_TTL_S = float(os.environ.get("BTK_NEGATIVE_CACHE_TTL", "600"))
+# consecutive timeouts/5xx after which a host is skipped
+BREAKER_FAILURES = int(os.environ.get("BTK_BREAKER_FAILURES", "5"))
+# seconds a host is skipped before one probe request is let through
+BREAKER_COOLDOWN_S = float(os.environ.get("BTK_BREAKER_COOLDOWN", "30"))
+
+_MAX_ENTRIES = 4096
+
+
+class HostUnavailableError(ValueError):
+    """Raised instead of a request while the host's circuit breaker is open."""
+
+
+class NegativeCache:
+    """
+    API URL -> definitive outcome for NEGATIVE_TTL_S: an error message (404, 410) or the response
+    of a post without a downloadable file, which is returned again without a request.
+    """
+
+    def __init__(self, ttl: float = NEGATIVE_TTL_S, max_entries: int = _MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Optional[str], Optional[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[Optional[str], Optional[Dict]]]:
+        """(error message, response) or None if nothing is cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1], entry[2]
+
+    def add(self, key: str, error: Optional[str] = None, response: Optional[Dict] = None):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, error, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CircuitBreaker:
+    """
+    closed: requests go through, consecutive failures are counted.
+    open: requests are refused for the cool-down after `failures` consecutive failures.
+    half-open: after the cool-down one probe request goes through, its result closes or reopens it.
+    A probe that never reports back (cancelled, crashed) is replaced by a new one after another cool-down.
+    """
+
+    def __init__(self, host: str, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN_S):
+        self.host = host
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may be made now, the first caller after the cool-down becomes the probe."""
+        with self._lock:
+            if self.state == "closed" or self.failures <= 0:
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now >= self._opened_at + self.cooldown:
+                self.state = "half-open"
+                self._probe_started = now
+                logging.info(f"Probing {self.host} again")
+                return True
+            if self.state == "half-open" and now >= self._probe_started + self.cooldown:
+                self._probe_started = now
+                logging.info(f"Probe of {self.host} didn't report back, probing again")
+                return True
+            # open, or half-open with the probe still running
+            return False
+
+    def retry_in(self) -> float:
+        started = self._probe_started if self.state == "half-open" else self._opened_at
+        return max(0.0, started + self.cooldown - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logging.info(f"{self.host} is responding again")
+            self.state = "closed"
+            self._consecutive = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == "half-open" or (self.state == "closed" and self._consecutive >= self.failures > 0):
+                if self.state == "closed":
+                    logging.warning(
+                        f"{self.host} failed {self._consecutive} times in a row, skipping it for {self.cooldown:.0f}s"
+                    )
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def check(self):
+        """Raise HostUnavailableError if no request may be made now."""
+        if not self.allow():
+            raise HostUnavailableError(f"{self.host} is failing, skipping requests for {self.retry_in():.0f}s")
+
+
+class _Breakers:
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> CircuitBreaker:
+        host = (host or "").lower()
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(host)
+            return breaker
+
+
+class _LastGood:
+    """Last successful response per API URL, served while the host's breaker is open."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key: str, response: Dict):
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+negative_cache = NegativeCache()
+breakers = _Breakers()
+last_good = _LastGood()
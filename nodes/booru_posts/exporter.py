@@ -0,0 +1,354 @@
+"""
+Bulk export of booru posts as a training dataset: original image files plus caption files.
+
+Run from the repository root, e.g.:
+    python -m nodes.booru_posts.exporter --site https://e621.net --tags "wolf solo rating:s" --limit 5000 --out ./dataset
+    python -m nodes.booru_posts.exporter --site https://danbooru.donmai.us --ids ids.txt --out ./dataset --shard 0/4
+
+Writes <id>.<ext> (the file as served, not re-encoded), <id>.txt with the caption and one
+metadata JSONL line per post with the tags of every category. Finished posts are checkpointed,
+running the same command again resumes. --shard i/N (i from 0 to N-1) only exports the posts with
+id % N == i, so N machines with the same arguments split an export between them.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from curl_cffi.requests import AsyncSession
+from curl_cffi.requests.exceptions import RequestException
+
+from .booru_post_handlers.handler_base import BooruHandlerBase
+from .booru_post_handlers.handler_registry import registry
+from .booru_post_handlers.local_dump_handler import LocalDumpHandler
+from .booru_post_handlers.resilience import breakers
+from .get_post_node_base import BaseBooruNode
+from .http_client import HEADERS
+from .post_relations import ID_CHUNK
+
+CATEGORIES = ("artist", "character", "copyright", "species", "general", "meta", "model", "contributor")
+_RETRIES = 3
+
+
+class ExportState:
+    """Checkpoint of one shard: post IDs already written, appended to as posts finish."""
+
+    def __init__(self, out_dir: str, shard: Tuple[int, int]):
+        suffix = f"shard{shard[0]}of{shard[1]}"
+        state_dir = os.path.join(out_dir, ".export")
+        os.makedirs(state_dir, exist_ok=True)
+        self.done_path = os.path.join(state_dir, f"done.{suffix}.txt")
+        self.failed_path = os.path.join(state_dir, f"failed.{suffix}.txt")
+        self.metadata_path = os.path.join(out_dir, f"metadata.{suffix}.jsonl")
+        self.done: Set[int] = set()
+        if os.path.exists(self.done_path):
+            with open(self.done_path, "r", encoding="utf-8") as f:
+                self.done = {int(line) for line in f if line.strip()}
+        self._done_file = open(self.done_path, "a", encoding="utf-8")
+        self._metadata_file = open(self.metadata_path, "a", encoding="utf-8")
+        self._failed_file = open(self.failed_path, "a", encoding="utf-8")
+
+    def finish(self, post_id: int, metadata: Dict):
+        # metadata first, a crash in between re-exports the post instead of losing its metadata
+        self._metadata_file.write(json.dumps(metadata, ensure_ascii=False) + "\n")
+        self._metadata_file.flush()
+        self._done_file.write(f"{post_id}\n")
+        self._done_file.flush()
+        self.done.add(post_id)
+
+    def fail(self, post_id: int, reason: str):
+        self._failed_file.write(f"{post_id}\t{reason}\n")
+        self._failed_file.flush()
+
+    def close(self):
+        for f in (self._done_file, self._metadata_file, self._failed_file):
+            f.close()
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+    if not match or not 0 <= int(match.group(1)) < int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"Expected i/N with 0 <= i < N, got '{value}'")
+    return int(match.group(1)), int(match.group(2))
+
+
+def read_id_list(path: str) -> List[int]:
+    """Post IDs or post URLs, one per line."""
+    ids = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            match = re.search(r"(\d+)\s*$", line.split("?")[0].rstrip("/"))
+            if not match:
+                logging.warning(f"No post ID in line: {line}")
+                continue
+            ids.append(int(match.group(1)))
+    return ids
+
+
+class Exporter:
+    def __init__(self, args):
+        self.args = args
+        self.site = args.site.rstrip("/")
+        self.handler: Optional[BooruHandlerBase] = registry.get_handler_for(self.site, args.api_type)
+        if self.handler is None:
+            raise SystemExit(f"No handler for {self.site}, pick one with --api-type {registry.get_handler_choices()}")
+        self.shard = args.shard
+        self.state = ExportState(args.out, self.shard)
+        self.node = BaseBooruNode()
+        self.excluded_tags = args.exclude_tags
+        if self.excluded_tags is None:
+            self.excluded_tags = BaseBooruNode.INPUT_TYPES()["required"]["user_excluded_tags"][1]["default"]
+        self.stats = {"done": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        self._api_lock = asyncio.Lock()
+        self._last_api_call = 0.0
+
+    def in_shard(self, post_id: int) -> bool:
+        return post_id % self.shard[1] == self.shard[0]
+
+    # metadata
+
+    async def _api_get(self, session: AsyncSession, url: str):
+        # API calls are spaced out (sites ask for ~1-2 requests/s), image downloads are not
+        async with self._api_lock:
+            wait = self._last_api_call + self.args.api_delay - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_api_call = time.monotonic()
+        response = await session.get(url, timeout=30)
+        response.raise_for_status()
+        return self.handler.decode_response(response.content)
+
+    async def search_posts(self, session: AsyncSession) -> AsyncIterator[Tuple[int, Dict]]:
+        """Every post of the tag search, page by page, only metadata requests (one per page)."""
+        before_id = None
+        count = 0
+        while True:
+            url = self.handler.get_search_url(self.site, self.args.tags, before_id)
+            posts = self.handler.parse_search(await self._api_get(session, url))
+            if not posts:
+                return
+            for post in posts:
+                post_id = self.handler.get_post_id(post)
+                before_id = post_id if before_id is None else min(before_id, post_id)
+                yield post_id, post
+                count += 1
+                if self.args.limit and count >= self.args.limit:
+                    return
+
+    async def listed_posts(self, session: AsyncSession, ids: List[int]) -> AsyncIterator[Tuple[int, Optional[Dict]]]:
+        """
+        The listed posts in list order. Their metadata is fetched like search_posts does, with id:1,2,...
+        searches of up to ID_CHUNK posts, local dumps and sites without searches are read post by post.
+        """
+        ids = list(dict.fromkeys(ids[: self.args.limit or None]))
+        # skipped before any request, not after
+        pending = [post_id for post_id in ids if self.in_shard(post_id) and post_id not in self.state.done]
+        self.stats["skipped"] += len(ids) - len(pending)
+        if isinstance(self.handler, LocalDumpHandler) or not self.handler.SEARCH_PAGE_LIMIT:
+            for post_id in pending:
+                # fetched by the download workers
+                yield post_id, None
+            return
+
+        chunk = min(ID_CHUNK, self.handler.SEARCH_PAGE_LIMIT)
+        for start in range(0, len(pending), chunk):
+            chunk_ids = pending[start : start + chunk]
+            url = self.handler.get_search_url(self.site, self.handler.get_ids_query(chunk_ids), limit=chunk)
+            page = self.handler.parse_search(await self._api_get(session, url))
+            posts = {self.handler.get_post_id(post): post for post in page}
+            for post_id in chunk_ids:
+                if post_id in posts:
+                    yield post_id, posts[post_id]
+                else:
+                    self.stats["failed"] += 1
+                    self.state.fail(post_id, "not found (deleted or hidden for guests)")
+
+    async def _fetch_post(self, session: AsyncSession, post_id: int) -> Dict:
+        url = f"{self.site}/posts/{post_id}"
+        if isinstance(self.handler, LocalDumpHandler):
+            # no request, --site is "e621"/"danbooru" or a site URL
+            local_url = url if "://" in self.site else f"{self.site}:{post_id}"
+            return await asyncio.to_thread(self.handler.fetch, local_url, "original", HEADERS)
+        return await self._api_get(session, self.handler.get_api_url(url))
+
+    # download
+
+    async def _download(self, session: AsyncSession, url: str) -> bytes:
+        # a dead mirror fails the remaining posts fast (they're retried on the next run) instead of timing out each
+        breaker = breakers.get(urlparse(url).hostname)
+        for attempt in range(_RETRIES):
+            breaker.check()
+            ok = False
+            try:
+                response = await session.get(url, timeout=120)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise RequestException(f"HTTP {response.status_code}")
+                ok = True
+            except RequestException:
+                if attempt == _RETRIES - 1:
+                    raise
+                await asyncio.sleep(2**attempt)
+                continue
+            finally:
+                # failed or cancelled, either way the breaker mustn't keep waiting for this request
+                if not ok:
+                    breaker.record_failure()
+            breaker.record_success()
+            response.raise_for_status()
+            return response.content
+
+    def _caption(self, tags_dict: Dict[str, str]) -> str:
+        parts = [tags_dict.get(f"{category}_tags", "") for category in self.args.caption_categories]
+        return ", ".join(part.rstrip(",") for part in parts if part)
+
+    async def export_post(self, session: AsyncSession, post_id: int, post: Optional[Dict]):
+        if post is None:
+            post = await self._fetch_post(session, post_id)
+        tags_dict, width, height, image_url = self.handler.parse(post, "original")
+        if not image_url:
+            raise ValueError("post has no file url (deleted or hidden for guests)")
+        tags_dict = self.node._process_tags(
+            tags_dict,
+            bool(self.excluded_tags),
+            self.excluded_tags,
+            self.args.format_tags,
+            False,
+        )
+
+        data = await self._download(session, image_url)
+        ext = os.path.splitext(urlparse(image_url).path)[1] or ".bin"
+        file_name = f"{post_id}{ext}"
+        tmp_path = os.path.join(self.args.out, file_name + ".part")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.args.out, file_name))
+        with open(os.path.join(self.args.out, f"{post_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(self._caption(tags_dict))
+        if self.args.per_category_txt:
+            for key, value in tags_dict.items():
+                if value:
+                    with open(os.path.join(self.args.out, f"{post_id}.{key}.txt"), "w", encoding="utf-8") as f:
+                        f.write(value.rstrip(","))
+
+        self.state.finish(
+            post_id,
+            {"id": post_id, "file": file_name, "width": width, "height": height, "url": image_url, "tags": tags_dict},
+        )
+        self.stats["bytes"] += len(data)
+
+    async def _worker(self, session: AsyncSession, queue: "asyncio.Queue"):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            post_id, post = item
+            try:
+                await self.export_post(session, post_id, post)
+                self.stats["done"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                self.state.fail(post_id, str(e))
+                logging.warning(f"Post {post_id} failed: {e}")
+
+    async def run(self):
+        os.makedirs(self.args.out, exist_ok=True)
+        if self.args.ids:
+            ids = read_id_list(self.args.ids)
+        elif self.args.tags:
+            if not self.handler.SEARCH_PAGE_LIMIT:
+                raise SystemExit(f"{self.handler.HANDLER_NAME} doesn't support tag searches, use --ids")
+        else:
+            raise SystemExit("Give --tags or --ids")
+
+        start = time.perf_counter()
+        # the queue is bounded, so paging through a big search doesn't run far ahead of the downloads
+        queue: "asyncio.Queue" = asyncio.Queue(maxsize=self.args.concurrency * 4)
+        async with AsyncSession(
+            headers=HEADERS, impersonate="firefox", max_clients=self.args.concurrency
+        ) as session:
+            workers = [asyncio.create_task(self._worker(session, queue)) for _ in range(self.args.concurrency)]
+            source = self.listed_posts(session, ids) if self.args.ids else self.search_posts(session)
+            try:
+                error = await self._queue_posts(source, queue, start)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                # interrupted: the unfinished posts aren't checkpointed, the next run exports them
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                self.state.close()
+
+        self._log_progress(start)
+        if error is not None:
+            raise SystemExit(f"Listing the posts failed, run the same command again to continue: {error}")
+
+    async def _queue_posts(
+        self, source: AsyncIterator[Tuple[int, Optional[Dict]]], queue: "asyncio.Queue", start: float
+    ) -> Optional[Exception]:
+        """Feed the workers, returns the error that stopped the listing early (the queued posts are still exported)."""
+        try:
+            async for post_id, post in source:
+                if not self.in_shard(post_id) or post_id in self.state.done:
+                    self.stats["skipped"] += 1
+                    continue
+                await queue.put((post_id, post))
+                total = self.stats["done"] + self.stats["failed"]
+                if total and total % 100 == 0:
+                    self._log_progress(start)
+        except Exception as e:
+            logging.error(f"Listing the posts failed, finishing the ones queued so far: {e}")
+            return e
+        return None
+
+    def _log_progress(self, start: float):
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        logging.info(
+            f"{self.stats['done']} exported, {self.stats['failed']} failed, {self.stats['skipped']} skipped "
+            f"({self.stats['done'] / elapsed:.1f} posts/s, {self.stats['bytes'] / elapsed / 1024**2:.1f} MB/s)"
+        )
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--site", required=True, help="Site URL, e.g. https://e621.net, or 'e621'/'danbooru' for local dumps")
+    parser.add_argument("--api-type", default="auto", help="Handler name, auto detects it from --site")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--tags", help="Tag search query")
+    source.add_argument("--ids", help="File with post IDs or URLs, one per line")
+    parser.add_argument("--out", required=True, help="Output folder")
+    parser.add_argument("--limit", type=int, default=0, help="Max posts before sharding, 0 = all")
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1), help="i/N, export only id %% N == i")
+    parser.add_argument("--concurrency", type=int, default=16, help="Parallel downloads")
+    parser.add_argument("--api-delay", type=float, default=0.5, help="Seconds between API requests")
+    parser.add_argument(
+        "--caption-categories",
+        type=lambda v: [c.strip() for c in v.split(",") if c.strip()],
+        default=list(CATEGORIES),
+        help=f"Tag categories in the .txt caption, in order. Default: {','.join(CATEGORIES)}",
+    )
+    parser.add_argument("--per-category-txt", action="store_true", help="Also write <id>.<category>_tags.txt files")
+    parser.add_argument("--no-format-tags", dest="format_tags", action="store_false", help="Keep underscores")
+    parser.add_argument(
+        "--exclude-tags", default=None, help="Comma separated tags to leave out, defaults to the post nodes' list"
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.api_type == "auto" and "://" not in args.site:
+        # bare site names are local dumps
+        args.api_type = "Local dump"
+    asyncio.run(Exporter(args).run())
+
+
+if __name__ == "__main__":
+    main()
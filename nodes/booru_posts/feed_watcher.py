@@ -0,0 +1,235 @@
+"""
+Incremental polling of tag searches: every query keeps a cursor (the highest post ID seen), a poll only
+requests the posts above it (page=a<id>), so it costs one request per page of new posts.
+A bloom filter of every emitted post (per site) keeps posts matching several queries from being emitted twice.
+
+Run from the repository root, e.g. from cron:
+    python -m nodes.booru_posts.feed_watcher poll --site https://e621.net --tags "wolf solo" --tags "fox solo"
+prints one JSON line per new post. The first poll of a query only sets its cursor (--backfill N emits the newest N).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import numpy as np
+
+from .booru_post_handlers.handler_base import BooruHandlerBase
+from .booru_post_handlers.handler_registry import registry, site_root
+from .http_client import HEADERS, http_client
+
+FEEDS_DIR = os.environ.get(
+    "BTK_FEEDS_DIR",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "cache", "feeds")),
+)
+# posts the seen-set is sized for, the false positive rate rises slowly past it
+SEEN_CAPACITY = int(os.environ.get("BTK_FEED_SEEN_CAPACITY", "1000000"))
+SEEN_ERROR_RATE = 1e-4
+
+
+class BloomFilter:
+    """Bit array bloom filter with double hashing over one blake2b digest."""
+
+    def __init__(self, bits: np.ndarray, hashes: int):
+        self.bits = bits
+        self.size = len(bits) * 8
+        self.hashes = hashes
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(size / capacity * math.log(2)))
+        return cls(np.zeros((size + 7) // 8, dtype=np.uint8), hashes)
+
+    def _positions(self, key: str) -> np.ndarray:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return np.array([(h1 + i * h2) % self.size for i in range(self.hashes)], dtype=np.int64)
+
+    def __contains__(self, key: str) -> bool:
+        positions = self._positions(key)
+        return bool(np.all(self.bits[positions >> 3] & (1 << (positions & 7)).astype(np.uint8)))
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+
+class FeedWatcher:
+    """Cursors and seen-set of all watched queries, stored in FEEDS_DIR."""
+
+    def __init__(self, path: str = FEEDS_DIR):
+        self.path = path
+        self._state_path = os.path.join(path, "state.json")
+        self._seen_path = os.path.join(path, "seen.bloom")
+        self._lock = threading.Lock()
+        # serializes writes, so an older snapshot never replaces a newer one
+        self._save_lock = threading.Lock()
+        # what changed since the last save, a poll without new posts writes nothing
+        self._cursors_dirty = False
+        self._seen_dirty = False
+        self.cursors: Dict[str, int] = {}
+        self.seen = BloomFilter.for_capacity(SEEN_CAPACITY, SEEN_ERROR_RATE)
+        if os.path.exists(self._state_path):
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.cursors = state["cursors"]
+            if os.path.exists(self._seen_path) and state.get("seen_hashes"):
+                bits = np.fromfile(self._seen_path, dtype=np.uint8)
+                self.seen = BloomFilter(bits, state["seen_hashes"])
+
+    def _save(self):
+        """Write what changed since the last save. Blocking, the seen-set is a few MB: run it in a thread."""
+        with self._save_lock:
+            with self._lock:
+                bits = self.seen.bits.copy() if self._seen_dirty else None
+                state = {"cursors": dict(self.cursors), "seen_hashes": self.seen.hashes}
+                if bits is None and not self._cursors_dirty:
+                    return
+                self._cursors_dirty = self._seen_dirty = False
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                if bits is not None:
+                    bits.tofile(self._seen_path + ".tmp")
+                    os.replace(self._seen_path + ".tmp", self._seen_path)
+                with open(self._state_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(state, f, indent=2, sort_keys=True)
+                os.replace(self._state_path + ".tmp", self._state_path)
+            except OSError:
+                # written with the next save
+                with self._lock:
+                    self._cursors_dirty = True
+                    self._seen_dirty = self._seen_dirty or bits is not None
+                raise
+
+    @staticmethod
+    def query_key(handler: BooruHandlerBase, site: str, tags: str) -> str:
+        return f"{handler.HANDLER_NAME}|{site_root(site)}|{' '.join(sorted(tags.split()))}"
+
+    async def _search(self, handler: BooruHandlerBase, url: str) -> List[Dict]:
+        response = await http_client.get(url, headers=HEADERS, timeout=10)
+        response.raise_for_status()
+        return handler.parse_search(handler.decode_response(response.content))
+
+    async def poll(
+        self, handler: BooruHandlerBase, site: str, tags: str, max_posts: int = 0, backfill: int = 0
+    ) -> List[Dict]:
+        """New posts of the query since the last poll, oldest first. max_posts > 0 leaves the rest for the next poll."""
+        if not handler.SEARCH_PAGE_LIMIT:
+            raise ValueError(f"{handler.HANDLER_NAME} doesn't support tag searches")
+        site = site_root(site)
+        key = self.query_key(handler, site, tags)
+        with self._lock:
+            cursor = self.cursors.get(key)
+
+        posts = []
+        if cursor is None:
+            # first poll: the newest post is the starting point, only backfill posts are emitted
+            posts = await self._search(handler, handler.get_search_url(site, tags, limit=max(backfill, 1)))
+            cursor = max((handler.get_post_id(p) for p in posts), default=0)
+            posts = posts[:backfill]
+        else:
+            while not max_posts or len(posts) < max_posts:
+                limit = handler.SEARCH_PAGE_LIMIT if not max_posts else max_posts - len(posts)
+                page = await self._search(handler, handler.get_search_url(site, tags, after_id=cursor, limit=limit))
+                if not page:
+                    break
+                posts.extend(page)
+                cursor = max(cursor, max(handler.get_post_id(p) for p in page))
+                if len(page) < min(limit, handler.SEARCH_PAGE_LIMIT):
+                    break
+
+        items = []
+        host = urlparse(site).netloc
+        with self._lock:
+            for post in sorted(posts, key=handler.get_post_id):
+                post_id = handler.get_post_id(post)
+                seen_key = f"{host}:{post_id}"
+                if seen_key in self.seen:
+                    continue
+                self.seen.add(seen_key)
+                self._seen_dirty = True
+                tags_dict, width, height, image_url = handler.parse(post, "original")
+                items.append(
+                    {
+                        "id": post_id,
+                        "url": f"{site}/posts/{post_id}",
+                        "image_url": image_url,
+                        "width": width,
+                        "height": height,
+                        "tags": tags_dict,
+                        "query": tags,
+                    }
+                )
+            if key not in self.cursors or cursor > self.cursors[key]:
+                self.cursors[key] = cursor
+                self._cursors_dirty = True
+            dirty = self._cursors_dirty or self._seen_dirty
+        if dirty:
+            # off the event loop, ComfyUI runs async nodes on it
+            await asyncio.to_thread(self._save)
+        return items
+
+    def reset(self, handler: BooruHandlerBase, site: str, tags: str):
+        with self._lock:
+            if self.cursors.pop(self.query_key(handler, site, tags), None) is not None:
+                self._cursors_dirty = True
+        self._save()
+
+
+_watchers: Dict[str, FeedWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def get_watcher(path: str = FEEDS_DIR) -> FeedWatcher:
+    with _watchers_lock:
+        if path not in _watchers:
+            _watchers[path] = FeedWatcher(path)
+        return _watchers[path]
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    poll_parser = commands.add_parser("poll", help="Print the new posts of the queries as JSON lines")
+    poll_parser.add_argument("--site", required=True)
+    poll_parser.add_argument("--tags", action="append", required=True, help="Query, can be given several times")
+    poll_parser.add_argument("--api-type", default="auto")
+    poll_parser.add_argument("--max-posts", type=int, default=0, help="Per query and poll, 0 = all new posts")
+    poll_parser.add_argument("--backfill", type=int, default=0, help="Newest posts emitted by a query's first poll")
+    reset_parser = commands.add_parser("reset", help="Forget the cursor of the queries")
+    reset_parser.add_argument("--site", required=True)
+    reset_parser.add_argument("--tags", action="append", required=True)
+    reset_parser.add_argument("--api-type", default="auto")
+    parser.add_argument("--feeds-dir", default=FEEDS_DIR)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    handler = registry.get_handler_for(site_root(args.site), args.api_type)
+    if handler is None:
+        raise SystemExit(f"No handler for {args.site}, pick one with --api-type {registry.get_handler_choices()}")
+    watcher = get_watcher(args.feeds_dir)
+
+    if args.command == "reset":
+        for tags in args.tags:
+            watcher.reset(handler, args.site, tags)
+        return
+
+    async def poll_all():
+        for tags in args.tags:
+            for item in await watcher.poll(handler, args.site, tags, args.max_posts, args.backfill):
+                print(json.dumps(item, ensure_ascii=False), flush=True)
+
+    asyncio.run(poll_all())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import json
+
+from ..booru_posts.booru_post_handlers.handler_registry import registry, site_root
+from ..booru_posts.feed_watcher import get_watcher
+from ..booru_posts.http_client import http_client
+from ..misc.utils import comfy_supports_async_nodes
+
+
+class BooruFeedWatcherNode:
+    """
+    Outputs the posts of a tag search that are new since the node last ran (see feed_watcher.py).
+    """
+
+    DESCRIPTION = (
+        "Polls a tag search and outputs only the posts that are new since the last run, for automated pipelines.\n"
+        "The first run only remembers where the search is (unless backfill > 0). "
+        "Posts already output by any watched search aren't output again."
+    )
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "site": ("STRING", {"default": "https://danbooru.donmai.us"}),
+                "tags": ("STRING", {"default": "", "tooltip": "Search query, e.g. 'wolf solo'"}),
+                "api_type": (
+                    registry.get_handler_choices(),
+                    {"default": "auto", "tooltip": "Select booru api type. 'auto' should generally be OK to use"},
+                ),
+                "max_posts": (
+                    "INT",
+                    {"default": 0, "min": 0, "max": 10000, "tooltip": "Per run, the rest is output by the next runs. 0 = all"},
+                ),
+                "backfill": (
+                    "INT",
+                    {"default": 0, "min": 0, "max": 1000, "tooltip": "Newest posts to output on the first run of a search"},
+                ),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING", "INT")
+    RETURN_NAMES = ("post_urls", "posts", "count")
+    OUTPUT_TOOLTIPS = (
+        "URLs of the new posts, one per line, oldest first",
+        "JSON list of the new posts (id, url, image_url, width, height, tags)",
+        "Number of new posts",
+    )
+    FUNCTION = "poll_async" if comfy_supports_async_nodes() else "poll"
+    CATEGORY = "Booru Toolkit/Posts"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # every run is a new poll
+        return float("nan")
+
+    def poll(self, site: str, tags: str, api_type: str, max_posts: int, backfill: int):
+        return http_client.run_sync(self.poll_async(site, tags, api_type, max_posts, backfill))
+
+    async def poll_async(self, site: str, tags: str, api_type: str, max_posts: int, backfill: int):
+        handler = registry.get_handler_for(site_root(site), api_type)
+        if handler is None:
+            raise ValueError(f"No suitable handler found for site: {site}")
+
+        items = await get_watcher().poll(handler, site, tags, max_posts, backfill)
+        return ("\n".join(item["url"] for item in items), json.dumps(items, ensure_ascii=False), len(items))
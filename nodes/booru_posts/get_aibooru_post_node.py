@@ -27,6 +27,7 @@ class AIBooruPostNode(BaseBooruNode):
         "MODEL_TAGS": "STRING",  # aibooru
         "ORIGINAL_WIDTH": "INT",
         "ORIGINAL_HEIGHT": "INT",
+        "MASK": "MASK",
     }
     RETURN_TYPES = tuple(RETURN_INFO.values())
     RETURN_NAMES = tuple(RETURN_INFO.keys())
@@ -28,6 +28,7 @@ class E621PostNode(BaseBooruNode):
         "META_TAGS": "STRING",
         "ORIGINAL_WIDTH": "INT",
         "ORIGINAL_HEIGHT": "INT",
+        "MASK": "MASK",
     }
     RETURN_TYPES = tuple(RETURN_INFO.values())
     RETURN_NAMES = tuple(RETURN_INFO.keys())
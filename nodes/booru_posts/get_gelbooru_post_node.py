@@ -22,6 +22,7 @@ class GelbooruPostNode(BaseBooruNode):
         "ALL_TAGS": "STRING",
         "ORIGINAL_WIDTH": "INT",
         "ORIGINAL_HEIGHT": "INT",
+        "MASK": "MASK",
     }
     RETURN_TYPES = tuple(RETURN_INFO.values())
     RETURN_NAMES = tuple(RETURN_INFO.keys())
@@ -1,29 +1,30 @@
+import asyncio
 import io
 import logging
 from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
 
 import numpy as np
 import torch
-from curl_cffi import requests
 from curl_cffi.requests.exceptions import RequestException
 from PIL import Image
 
 from ..booru_posts.booru_post_handlers.handler_registry import registry
+from ..booru_posts.booru_post_handlers.resilience import HostUnavailableError, breakers
+from ..booru_posts.http_client import http_client
 from ..misc.utils import (
     adjust_tags,
+    comfy_supports_async_nodes,
     exclude_tags_from_string,
-    to_tensor,
+    to_tensor_and_mask,
 )
 
-# todo: so basically when request comes in for auto mode it checks every handler for SUPPORTED_DOMAINS
-# and then picks the first one that matches, but when no match, it errors; for this now we assume e926.net url
-# and we also assume its not set in SUPPORTED_DOMAINS of E621Handler:
-# if mode is not "auto" and instead its set to e621 (like when e621postnode is used)
-# then itll ignore SUPPORTED_DOMAINS and WILL make the request to e926 and WILL try to parse it, where auto would say no and not do it
-# in this case e926 will work with no issues
-# todo: consideration is to make it work in auto mode too, so instead of erroring when no match,
-# todo: it just tries every handler's parse() in order; this is for when the response json is the same as another site's
-# but it doesnt do that right now, could probably remove SUPPORTED_DOMAINS then, idk too tire
+# NOTE: in auto mode hosts are routed by SUPPORTED_DOMAINS, unknown hosts are probed with every handler once
+# and the working one is remembered (see HandlerRegistry.probe_handler). Site specific nodes always use their handler.
+
+
+def _decode_image(data: bytes) -> Tuple[torch.Tensor, torch.Tensor]:
+    return to_tensor_and_mask(Image.open(io.BytesIO(data)))
 
 
 class BaseBooruNode:
@@ -41,7 +42,8 @@ class BaseBooruNode:
     HANDLER_CLASS = None
 
     CATEGORY = "Booru Toolkit/Posts"
-    FUNCTION = "get_data"
+    # on ComfyUI versions with async nodes independent post nodes fetch concurrently
+    FUNCTION = "get_data_async" if comfy_supports_async_nodes() else "get_data"
 
     # Set to False in child classes when they are stable
     EXPERIMENTAL = True
@@ -60,6 +62,7 @@ class BaseBooruNode:
         "MODEL_TAGS": "STRING",
         "ORIGINAL_WIDTH": "INT",
         "ORIGINAL_HEIGHT": "INT",
+        "MASK": "MASK",  # last so existing workflow links keep their output slots
     }
     RETURN_TYPES = tuple(RETURN_INFO.values())
     RETURN_NAMES = tuple(RETURN_INFO.keys())
@@ -140,27 +143,35 @@ class BaseBooruNode:
         exclude_tags: bool = True,
         user_excluded_tags: str = "",
         api_type: str = "auto",
+    ) -> Tuple:
+        """Blocking get_data_async(), for ComfyUI versions without async nodes."""
+        return http_client.run_sync(
+            self.get_data_async(
+                url, img_size, format_tags, trailing_comma, exclude_tags, user_excluded_tags, api_type
+            )
+        )
+
+    async def get_data_async(
+        self,
+        url: str,
+        img_size: str,
+        format_tags: bool = True,
+        trailing_comma: bool = False,
+        exclude_tags: bool = True,
+        user_excluded_tags: str = "",
+        api_type: str = "auto",
     ) -> Tuple:
         """Main function to fetch and process booru data."""
         headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:151.0) Gecko/20100101 Firefox/151.0"}
         blank_img_tensor = torch.from_numpy(np.zeros((64, 64, 3), dtype=np.float32) / 255.0).unsqueeze(0)
+        blank_mask_tensor = torch.zeros((1, 64, 64), dtype=torch.float32)
 
         # Raise error if URL is empty after trimming
         if not url.strip():
             raise ValueError("URL cannot be empty.")
 
-        # Determine which handler to use
-        # todo: this fails when theres a domain that isnt added
-        # todo: might not be desirable when theres a domain with supported api format, yet errors because domain isnt hardcoded in handler
-        # todo: allow adding custom domains? in some config file?
-        # todo: or have a "brute force" mode that goes through every handler. Or can add both ig
-        # NOTE: the todos above only apply to the any node, image board specific nodes will try to fetch and parse regardless of domain
-        handler = self._get_handler(url, api_type)
-        if not handler:
-            raise ValueError(f"No suitable handler found for URL: {url}")
+        handler, response = await self._fetch_post(url, img_size, api_type, headers)
         try:
-            # Fetch and parse data
-            response = handler.fetch(url, img_size, headers)
             tags_dict, img_width, img_height, image_url = handler.parse(response, img_size)
 
             logging.info(f"Successfully fetched data using {handler.HANDLER_NAME} handler")
@@ -170,13 +181,30 @@ class BaseBooruNode:
             raise ValueError(f"Failed to fetch data: {e}")
 
         # Download image
-        img_tensor = self._download_image(image_url, img_size, blank_img_tensor)
+        img_tensor, mask_tensor = await self._download_image(image_url, img_size, blank_img_tensor, blank_mask_tensor)
 
         # Process tags
         tags_dict = self._process_tags(tags_dict, exclude_tags, user_excluded_tags, format_tags, trailing_comma)
 
         # Build return tuple dynamically based on the class's RETURN_NAMES
-        return self._build_return_tuple(img_tensor, tags_dict, img_width, img_height)
+        return self._build_return_tuple(img_tensor, tags_dict, img_width, img_height, mask_tensor)
+
+    async def _fetch_post(self, url: str, img_size: str, api_type: str, headers: Dict[str, str]) -> Tuple:
+        """(handler, API response) of a post URL, unknown hosts are probed in auto mode."""
+        # Determine which handler to use
+        handler = self._get_handler(url, api_type)
+        if not handler:
+            if api_type != "auto":
+                raise ValueError(f"No suitable handler found for URL: {url}")
+            try:
+                return await registry.probe_handler(url, headers)
+            except Exception as e:
+                raise ValueError(f"No suitable handler found for URL: {url} ({e})")
+        try:
+            return handler, await handler.fetch_async(url, img_size, headers)
+        except Exception as e:
+            logging.error(f"Failed to fetch data: {e}")
+            raise ValueError(f"Failed to fetch data: {e}")
 
     def _get_handler(self, url: str, api_type: str):
         """Get the appropriate handler for the URL and API type.
@@ -216,30 +244,48 @@ class BaseBooruNode:
         # Otherwise, use the specified handler
         return registry.get_handler_by_name(api_type)
 
-    def _download_image(self, image_url: Optional[str], img_size: str, blank_img_tensor: torch.Tensor) -> torch.Tensor:
-        """Download and process the image."""
+    async def _download_bytes(self, image_url: str, timeout: float = 10) -> bytes:
+        """The image file as served, failures count against the host's breaker (see resilience.py)."""
+        breaker = breakers.get(urlparse(image_url).hostname)
+        breaker.check()
+        response = None
+        try:
+            response = await http_client.get(image_url, timeout=timeout)
+        finally:
+            # failed or cancelled, either way the breaker mustn't keep waiting for this request
+            if response is None:
+                breaker.record_failure()
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        response.raise_for_status()
+        return response.content
+
+    async def _download_image(
+        self, image_url: Optional[str], img_size: str, blank_img_tensor: torch.Tensor, blank_mask_tensor: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Download and process the image. Returns the RGB image and its alpha as a mask."""
+        blank = (blank_img_tensor, blank_mask_tensor)
         if img_size == "none - don't download image" or not image_url:
-            return blank_img_tensor
+            return blank
 
         try:
-            img_data = requests.get(
-                image_url,
-                timeout=10,
-                impersonate="firefox",
-            )
-            img_data.raise_for_status()
-            img_stream = io.BytesIO(img_data.content)
-            image_ = Image.open(img_stream)
-            return to_tensor(image_)
+            img_data = await self._download_bytes(image_url)
+            # decoding big originals takes a while, keep it off the event loop
+            return await asyncio.to_thread(_decode_image, img_data)
+        except HostUnavailableError as e:
+            logging.error(f"Image download skipped, {e}")
+            return blank
         except RequestException as req_exc:
             logging.error(f"Image download failed: {req_exc}")
-            return blank_img_tensor
+            return blank
         except (OSError, ValueError) as img_exc:
             logging.error(f"Image processing failed: {img_exc}")
-            return blank_img_tensor
+            return blank
         except Exception as exc:
             logging.error(f"Unexpected error during image download: {exc}")
-            return blank_img_tensor
+            return blank
 
     def _process_tags(
         self,
@@ -274,7 +320,13 @@ class BaseBooruNode:
         return tags_dict
 
     def _build_return_tuple(
-        self, img_tensor: torch.Tensor, tags_dict: Dict[str, str], img_width: int, img_height: int
+        self,
+        img_tensor: torch.Tensor,
+        tags_dict: Dict[str, str],
+        img_width: int,
+        img_height: int,
+        mask_tensor: Optional[torch.Tensor] = None,
+        extra_values: Optional[Dict] = None,
     ) -> Tuple:
         """
         Build return tuple dynamically based on the class's RETURN_NAMES.
@@ -286,6 +338,8 @@ class BaseBooruNode:
             "IMAGE": img_tensor,
             "ORIGINAL_WIDTH": img_width,
             "ORIGINAL_HEIGHT": img_height,
+            "MASK": mask_tensor,
+            **(extra_values or {}),
         }
 
         # Build return tuple based on this class's RETURN_NAMES
@@ -0,0 +1,189 @@
+"""
+Shared HTTP client for API and image requests, with hedging against stalled connections.
+
+Every host's time to first response byte is tracked. When a request hasn't received its response headers
+within the BTK_HEDGE_PERCENTILE of that host's recent latencies, a duplicate is sent on a separate
+session (so not on the stalled connection), the first one to answer is used and the other cancelled.
+Hedges are limited to BTK_HEDGE_BUDGET extra requests per request (default 5%).
+
+Coroutines run on the caller's event loop, run_sync()/get_sync() run them on a background loop for sync code.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from curl_cffi.requests import AsyncSession, Response
+
+# identifies the toolkit to the sites' APIs (search, pool and feed requests)
+HEADERS = {"User-Agent": "ComfyUI_e621_booru_toolkit/1.0 (by draconicdragon on github)"}
+
+HEDGE_ENABLED = os.environ.get("BTK_HEDGE", "1") != "0"
+HEDGE_PERCENTILE = float(os.environ.get("BTK_HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET = float(os.environ.get("BTK_HEDGE_BUDGET", "0.05"))
+
+# hedge delay while a host has fewer samples than _MIN_SAMPLES
+_DEFAULT_DELAY_S = 1.0
+_MIN_DELAY_S = 0.05
+_MIN_SAMPLES = 20
+_SAMPLES = 256
+# unused budget that can be saved up, allows short bursts of hedges
+_MAX_TOKENS = 5.0
+
+
+class _HostLatency:
+    def __init__(self):
+        self.samples = deque(maxlen=_SAMPLES)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self, timeout: float) -> float:
+        with self._lock:
+            if len(self.samples) < _MIN_SAMPLES:
+                delay = _DEFAULT_DELAY_S
+            else:
+                ordered = sorted(self.samples)
+                delay = ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))]
+        # a hedge after half the timeout can't save much anymore
+        return min(max(delay, _MIN_DELAY_S), timeout / 2)
+
+
+class _HedgeBudget:
+    """Token bucket: every request adds HEDGE_BUDGET tokens, a hedge costs one."""
+
+    def __init__(self, ratio: float):
+        self.ratio = ratio
+        self.tokens = 1.0
+        self._lock = threading.Lock()
+
+    def add_request(self):
+        with self._lock:
+            self.tokens = min(_MAX_TOKENS, self.tokens + self.ratio)
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+
+class HttpClient:
+    def __init__(self):
+        self._latency: Dict[str, _HostLatency] = {}
+        self._budget = _HedgeBudget(HEDGE_BUDGET)
+        # curl_cffi sessions are bound to the loop they're used on
+        self._sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncSession]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._draining = set()
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def _host_latency(self, host: str) -> _HostLatency:
+        with self._lock:
+            latency = self._latency.get(host)
+            if latency is None:
+                latency = self._latency[host] = _HostLatency()
+            return latency
+
+    def _session(self, kind: str) -> AsyncSession:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            sessions = self._sessions.setdefault(loop, {})
+            if kind not in sessions:
+                sessions[kind] = AsyncSession(impersonate="firefox", max_clients=16)
+            return sessions[kind]
+
+    async def _headers(self, session: AsyncSession, url: str, headers, timeout: float, latency: _HostLatency):
+        start = time.perf_counter()
+        response = await session.get(url, headers=headers, timeout=timeout, stream=True)
+        latency.add(time.perf_counter() - start)
+        return response
+
+    async def get(
+        self, url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 10, hedge: bool = True
+    ) -> Response:
+        """GET with the whole body read, raises curl_cffi's RequestException subclasses like requests.get."""
+        latency = self._host_latency(urlparse(url).hostname or "")
+        self.requests += 1
+        self._budget.add_request()
+
+        primary = asyncio.ensure_future(self._headers(self._session("primary"), url, headers, timeout, latency))
+        tasks = [primary]
+        winner = None
+        try:
+            if hedge and HEDGE_ENABLED:
+                done, _ = await asyncio.wait(tasks, timeout=latency.hedge_delay(timeout))
+                if not done and self._budget.take():
+                    self.hedges += 1
+                    logging.debug(f"Hedging request to {url}")
+                    tasks.append(
+                        asyncio.ensure_future(self._headers(self._session("hedge"), url, headers, timeout, latency))
+                    )
+
+            error = None
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = error or task.exception()
+            if winner is None:
+                raise error
+            if winner is not primary:
+                self.hedges_won += 1
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    # both answered at the same time, let the other one finish in the background
+                    drain = asyncio.ensure_future(task.result().aclose())
+                    self._draining.add(drain)
+                    drain.add_done_callback(self._draining.discard)
+
+        response = winner.result()
+        response.content = await response.acontent()
+        return response
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="btk-http", daemon=True).start()
+            return self._loop
+
+    def submit(self, coro) -> "concurrent.futures.Future":
+        """Start a coroutine on the background loop, e.g. for work that should outlive the caller."""
+        return asyncio.run_coroutine_threadsafe(coro, self._background_loop())
+
+    def run_sync(self, coro):
+        """Run a coroutine to completion from sync code in any thread, including ones running an event loop."""
+        return self.submit(coro).result()
+
+    def get_sync(
+        self, url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 10, hedge: bool = True
+    ) -> Response:
+        """Blocking get()."""
+        return self.run_sync(self.get(url, headers, timeout, hedge))
+
+
+http_client = HttpClient()
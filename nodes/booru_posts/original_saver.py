@@ -0,0 +1,99 @@
+"""
+Saves downloaded post files as served (no decoding, no re-encoding) with a JSON sidecar per file.
+
+Every folder keeps an index of the files saved into it, by image URL and by SHA-256 of the content:
+saving a URL again costs no request at all, a different URL with the same content (mirrors, re-uploads)
+costs the download but isn't written twice.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+INDEX_NAME = ".btk_originals.jsonl"
+
+
+class OriginalStore:
+    """Index of the files saved into one folder, a JSON line per saved URL that's only ever appended to."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._index_path = os.path.join(folder, INDEX_NAME)
+        self._lock = threading.Lock()
+        self.urls: Dict[str, str] = {}
+        self.hashes: Dict[str, str] = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.urls[entry["url"]] = entry["file"]
+                        self.hashes[entry["sha256"]] = entry["file"]
+
+    def _existing(self, file_name: Optional[str]) -> Optional[str]:
+        # files deleted by hand are saved again
+        if file_name and os.path.exists(os.path.join(self.folder, file_name)):
+            return file_name
+        return None
+
+    def lookup_url(self, image_url: str) -> Optional[str]:
+        """File name the URL was saved as, if it's still there."""
+        with self._lock:
+            return self._existing(self.urls.get(image_url))
+
+    def _append_index(self, image_url: str, digest: str, file_name: str):
+        with open(self._index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"url": image_url, "sha256": digest, "file": file_name}) + "\n")
+
+    def write(self, image_url: str, data: bytes, file_name: str, sidecar: Optional[Dict]) -> Tuple[str, bool]:
+        """
+        Write the file (and <file>.json with the sidecar data) unless the same content is already saved.
+        Returns the file name and whether it was written. Blocking, run it in a thread.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            existing = self._existing(self.hashes.get(digest))
+            if existing is None:
+                path = os.path.join(self.folder, file_name)
+                with open(path + ".part", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".part", path)
+                if sidecar is not None:
+                    with open(path + ".json", "w", encoding="utf-8") as f:
+                        json.dump({**sidecar, "file": file_name, "sha256": digest}, f, ensure_ascii=False, indent=2)
+                self.hashes[digest] = file_name
+            self.urls[image_url] = existing or file_name
+            self._append_index(image_url, digest, existing or file_name)
+        return existing or file_name, existing is None
+
+
+def file_name_for(prefix: str, site: str, post_id, image_url: str, img_size: str) -> str:
+    """<prefix>_<host>_<post id>[_<size>]<ext>, the extension as served."""
+    ext = os.path.splitext(image_url.split("?")[0])[1] or ".bin"
+    host = re.sub(r"[^A-Za-z0-9.-]", "_", site)
+    size = "" if img_size == "original" else "_" + re.sub(r"[^A-Za-z0-9]", "_", img_size)
+    return f"{prefix}_{host}_{post_id}{size}{ext.lower()}"
+
+
+_stores: Dict[str, OriginalStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(folder: str) -> OriginalStore:
+    folder = os.path.abspath(folder)
+    with _stores_lock:
+        if folder not in _stores:
+            os.makedirs(folder, exist_ok=True)
+            _stores[folder] = OriginalStore(folder)
+        return _stores[folder]
+
+
+async def write_async(
+    store: OriginalStore, image_url: str, data: bytes, file_name: str, sidecar: Optional[Dict]
+) -> Tuple[str, bool]:
+    """store.write() off the event loop, hashing and writing big files takes a moment."""
+    return await asyncio.to_thread(store.write, image_url, data, file_name, sidecar)
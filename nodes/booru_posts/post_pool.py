@@ -0,0 +1,221 @@
+"""
+Pools of random posts per search query for the random post node, refilled in the background.
+
+A pick takes a post out of the pool and, when fewer than BTK_RANDOM_POOL_LOW_WATER posts are left,
+starts fetching another order:random page on the HTTP client's background loop. Refills skip the
+last _RECENT_IDS picked posts, so posts don't repeat unless the search has fewer results than that.
+Only the very first pick of a query waits for the network, and only for the page: images are
+prefetched afterwards, while at most BTK_RANDOM_PREFETCH_MB of them are held across all pools
+(a post picked before its image arrived is downloaded by the node).
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from curl_cffi.requests.exceptions import RequestException
+
+from .booru_post_handlers.handler_base import BooruHandlerBase
+from .booru_post_handlers.handler_registry import site_root
+from .http_client import HEADERS, http_client
+
+POOL_SIZE = int(os.environ.get("BTK_RANDOM_POOL_SIZE", "40"))
+LOW_WATER = int(os.environ.get("BTK_RANDOM_POOL_LOW_WATER", "10"))
+PREFETCH_MB = float(os.environ.get("BTK_RANDOM_PREFETCH_MB", "256"))
+
+_PREFETCH_CONCURRENCY = 4
+# picks remembered per pool so a seed gives the same post again (they may hold image data)
+_SEED_MEMORY = 64
+# picked post IDs remembered per pool, refills skip them
+_RECENT_IDS = 500
+_MAX_POOLS = 16
+
+
+@dataclass
+class Candidate:
+    post_id: int
+    post_url: str
+    response: Dict
+    image_url: Optional[str]
+    image: Optional[bytes] = None
+
+
+class _PrefetchBudget:
+    """Bytes of prefetched images held by all pools, images that don't fit aren't kept."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def full(self) -> bool:
+        return self.used >= self.max_bytes
+
+    def reserve(self, size: int) -> bool:
+        with self._lock:
+            if self.used + size > self.max_bytes:
+                return False
+            self.used += size
+            return True
+
+    def release(self, candidate: Candidate):
+        if candidate.image is not None:
+            with self._lock:
+                self.used -= len(candidate.image)
+
+
+prefetch_budget = _PrefetchBudget(int(PREFETCH_MB * 1024 * 1024))
+
+
+class PostPool:
+    def __init__(self, handler: BooruHandlerBase, site: str, tags: str, img_size: str, prefetch_images: bool):
+        self.handler = handler
+        self.site = site_root(site)
+        self.tags = tags
+        self.img_size = img_size
+        self.prefetch_images = prefetch_images
+        self._candidates: List[Candidate] = []
+        self._by_seed: "OrderedDict[int, Candidate]" = OrderedDict()
+        self._recent: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refill: Optional[concurrent.futures.Future] = None
+
+    def __len__(self):
+        return len(self._candidates)
+
+    async def _fetch_candidates(self, count: int) -> List[Candidate]:
+        query = f"{self.tags} order:random".strip()
+        url = self.handler.get_search_url(self.site, query, limit=count)
+        response = await http_client.get(url, headers=HEADERS, timeout=10)
+        response.raise_for_status()
+        posts = self.handler.parse_search(self.handler.decode_response(response.content))
+
+        candidates = []
+        for post in posts:
+            post_id = self.handler.get_post_id(post)
+            image_url = self.handler.parse(post, self.img_size)[3]
+            candidates.append(Candidate(post_id, f"{self.site}/posts/{post_id}", post, image_url))
+        return candidates
+
+    def _pooled(self, candidate: Candidate) -> bool:
+        with self._lock:
+            return any(c is candidate for c in self._candidates)
+
+    async def _prefetch_images(self, candidates: List[Candidate]):
+        semaphore = asyncio.Semaphore(_PREFETCH_CONCURRENCY)
+
+        async def prefetch(candidate: Candidate):
+            async with semaphore:
+                # picked meanwhile (the node downloads it), or no room left
+                if not self._pooled(candidate) or prefetch_budget.full():
+                    return
+                try:
+                    image_response = await http_client.get(candidate.image_url, timeout=30)
+                    image_response.raise_for_status()
+                except RequestException as e:
+                    # downloaded again when picked
+                    logging.warning(f"Prefetching {candidate.image_url} failed: {e}")
+                    return
+                with self._lock:
+                    if any(c is candidate for c in self._candidates) and prefetch_budget.reserve(
+                        len(image_response.content)
+                    ):
+                        candidate.image = image_response.content
+
+        await asyncio.gather(*(prefetch(c) for c in candidates if c.image_url))
+
+    async def _refill_async(self):
+        with self._lock:
+            count = POOL_SIZE - len(self._candidates)
+            pooled = {c.post_id for c in self._candidates}
+        if count <= 0:
+            return
+        candidates = await self._fetch_candidates(count)
+        with self._lock:
+            fresh = [c for c in candidates if c.post_id not in pooled and c.post_id not in self._recent]
+            if not fresh and not self._candidates and candidates:
+                # every result was picked recently, the search has fewer posts than _RECENT_IDS
+                logging.info(f"All posts for '{self.tags}' were picked recently, repeating them")
+                self._recent.clear()
+                fresh = candidates
+            self._candidates.extend(fresh)
+        logging.info(f"Random post pool for '{self.tags}' has {len(self._candidates)} posts")
+
+        if self.prefetch_images and fresh:
+            # picks don't wait for the images, they're used if they arrive in time
+            http_client.submit(self._prefetch_images(fresh)).add_done_callback(self._log_refill_error)
+
+    def _start_refill(self) -> concurrent.futures.Future:
+        with self._lock:
+            if self._refill is None or self._refill.done():
+                self._refill = http_client.submit(self._refill_async())
+            return self._refill
+
+    async def pick(self, seed: int) -> Candidate:
+        """A random post of the query, the same seed returns the same post while it's remembered."""
+        with self._lock:
+            if seed in self._by_seed:
+                self._by_seed.move_to_end(seed)
+                return self._by_seed[seed]
+            empty = not self._candidates
+        if empty:
+            # first pick of the query (or the pool ran dry), nothing to do but wait
+            await asyncio.wrap_future(self._start_refill())
+
+        with self._lock:
+            if not self._candidates:
+                raise ValueError(f"No posts found on {self.site} for '{self.tags}'")
+            index = random.Random(seed).randrange(len(self._candidates))
+            candidate = self._candidates.pop(index)
+            self._recent[candidate.post_id] = None
+            while len(self._recent) > _RECENT_IDS:
+                self._recent.popitem(last=False)
+            self._by_seed[seed] = candidate
+            while len(self._by_seed) > _SEED_MEMORY:
+                prefetch_budget.release(self._by_seed.popitem(last=False)[1])
+            low = len(self._candidates) < LOW_WATER
+
+        if low:
+            refill = self._start_refill()
+            refill.add_done_callback(self._log_refill_error)
+        return candidate
+
+    def _log_refill_error(self, future: concurrent.futures.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning(f"Refilling the random post pool for '{self.tags}' failed: {future.exception()}")
+
+    def release(self):
+        """Give the prefetched images back to the budget, the pool is dropped."""
+        with self._lock:
+            for candidate in self._candidates + list(self._by_seed.values()):
+                prefetch_budget.release(candidate)
+            # a prefetch still running finds nothing to store its image in
+            self._candidates = []
+            self._by_seed.clear()
+
+
+_pools: "OrderedDict[Tuple, PostPool]" = OrderedDict()
+_pools_lock = threading.Lock()
+
+
+def get_pool(handler: BooruHandlerBase, site: str, tags: str, img_size: str, prefetch_images: bool) -> PostPool:
+    tags = " ".join(tags.split())
+    prefetch_images = prefetch_images and img_size != "none - don't download image"
+    # prefetched images are of one size, pools without images can serve any size
+    key = (handler.HANDLER_NAME, urlparse(site_root(site)).netloc, tags)
+    key += (img_size,) if prefetch_images else ("",)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = PostPool(handler, site, tags, img_size, prefetch_images)
+            while len(_pools) > _MAX_POOLS:
+                _pools.popitem(last=False)[1].release()
+        _pools.move_to_end(key)
+        return pool
@@ -0,0 +1,182 @@
+"""
+Resolves pools, sets and favorite groups, or the parent/child relations of a post, into ordered post lists.
+
+Members are fetched with bulk ID searches (id:1,2,3, up to ID_CHUNK posts per request) instead of one request
+per post, so a 200 page pool takes the collection request plus a couple of searches.
+Relations are walked breadth-first from the post (parents and children, with a visited set), every level
+fetched at once; at most BTK_RELATION_CONCURRENCY requests run at a time.
+
+Run from the repository root, e.g.:
+    python -m nodes.booru_posts.post_relations https://e621.net/pools/12345
+    python -m nodes.booru_posts.post_relations https://danbooru.donmai.us/posts/1234567
+prints one JSON line per post, in pool order (relations: by post ID, i.e. upload order).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from .booru_post_handlers.handler_base import BooruHandlerBase
+from .booru_post_handlers.handler_registry import registry, site_root
+from .http_client import HEADERS, http_client
+
+CONCURRENCY = int(os.environ.get("BTK_RELATION_CONCURRENCY", "4"))
+# posts per bulk ID search, keeps the URLs at a sane length
+ID_CHUNK = 100
+
+
+def parse_collection_url(handler: BooruHandlerBase, url: str) -> Optional[Tuple[str, int]]:
+    """(path segment, ID) of a pool/set/favorite group URL of the handler's site, None for other URLs."""
+    path = urlparse(url if "://" in url else "https://" + url).path
+    match = re.match(r"^/([a-z_]+)/(\d+)(?:\.json)?/?$", path)
+    if match and match.group(1) in handler.COLLECTION_PATHS:
+        return match.group(1), int(match.group(2))
+    return None
+
+
+class RelationResolver:
+    """Ordered post lists of collections and relation graphs on one site."""
+
+    def __init__(self, handler: BooruHandlerBase, site: str, concurrency: int = CONCURRENCY):
+        if not handler.SEARCH_PAGE_LIMIT:
+            raise ValueError(f"{handler.HANDLER_NAME} doesn't support tag searches, pools and relations need them")
+        self.handler = handler
+        self.site = site_root(site)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _get_json(self, url: str, posts: bool = True):
+        async with self._semaphore:
+            logging.info(f"Fetching from {self.handler.HANDLER_NAME}: {url}")
+            response = await http_client.get(url, headers=HEADERS, timeout=30)
+        if response.status_code in (404, 410):
+            raise ValueError(f"Not found on {self.handler.HANDLER_NAME} (HTTP {response.status_code}): {url}")
+        response.raise_for_status()
+        # decode_response() would drop the keys of non-post responses
+        return self.handler.decode_response(response.content) if posts else json.loads(response.content)
+
+    async def _search(self, query: str, limit: int = 0) -> List[Dict]:
+        url = self.handler.get_search_url(self.site, query, limit=limit)
+        return self.handler.parse_search(await self._get_json(url))
+
+    async def fetch_posts(self, post_ids: List[int]) -> Dict[int, Dict]:
+        """Posts by ID, ID_CHUNK per search request. Deleted or hidden posts are missing from the result."""
+        post_ids = list(dict.fromkeys(post_ids))
+        chunk = min(ID_CHUNK, self.handler.SEARCH_PAGE_LIMIT)
+        pages = await asyncio.gather(
+            *(
+                self._search(self.handler.get_ids_query(post_ids[i : i + chunk]), limit=chunk)
+                for i in range(0, len(post_ids), chunk)
+            )
+        )
+        return {self.handler.get_post_id(post): post for page in pages for post in page}
+
+    async def resolve_collection(self, url: str, max_posts: int = 0) -> List[Dict]:
+        """Posts of a pool/set/favorite group in its order."""
+        parsed = parse_collection_url(self.handler, url)
+        if parsed is None:
+            raise ValueError(f"Not a {'/'.join(self.handler.COLLECTION_PATHS) or 'collection'} URL: {url}")
+        path, collection_id = parsed
+        collection = await self._get_json(f"{self.site}/{path}/{collection_id}.json", posts=False)
+        post_ids = [int(post_id) for post_id in collection.get("post_ids") or []]
+        if max_posts:
+            post_ids = post_ids[:max_posts]
+        posts = await self.fetch_posts(post_ids)
+        if len(posts) < len(post_ids):
+            logging.warning(f"{len(post_ids) - len(posts)} posts of {url} are deleted or hidden, skipping them")
+        return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+    async def _children(self, post_id: int) -> List[Dict]:
+        # one page, posts with more children than that are rare
+        posts = await self._search(f"parent:{post_id}")
+        return [p for p in posts if self.handler.get_relations(p)[0] == post_id]
+
+    async def resolve_relations(self, post_id: int, max_posts: int = 0) -> List[Dict]:
+        """The post and every post connected to it by parent/child relations, ordered by post ID."""
+        posts = await self.fetch_posts([post_id])
+        if post_id not in posts:
+            raise ValueError(f"Post {post_id} not found on {self.handler.HANDLER_NAME}")
+        visited = {post_id}
+        frontier = [post_id]
+        while frontier and not (max_posts and len(visited) >= max_posts):
+            related, searches = [], []
+            for current in frontier:
+                parent_id, child_ids, has_children = self.handler.get_relations(posts[current])
+                if parent_id:
+                    related.append(parent_id)
+                if child_ids is not None:
+                    related.extend(child_ids)
+                elif has_children:
+                    searches.append(current)
+            # children searches return the posts, only parents and listed children need fetching
+            for children in await asyncio.gather(*(self._children(current) for current in searches)):
+                for child in children:
+                    child_id = self.handler.get_post_id(child)
+                    posts.setdefault(child_id, child)
+                    related.append(child_id)
+
+            frontier = [r for r in dict.fromkeys(related) if r not in visited]
+            if max_posts:
+                frontier = frontier[: max_posts - len(visited)]
+            visited.update(frontier)
+            missing = [r for r in frontier if r not in posts]
+            if missing:
+                posts.update(await self.fetch_posts(missing))
+            # deleted/hidden relatives end the walk on their branch
+            frontier = [r for r in frontier if r in posts]
+        return [posts[r] for r in sorted(visited) if r in posts]
+
+    async def resolve(self, url: str, max_posts: int = 0) -> List[Dict]:
+        """Collection URLs resolve to their posts, post URLs to their relations."""
+        if parse_collection_url(self.handler, url) is not None:
+            return await self.resolve_collection(url, max_posts)
+        return await self.resolve_relations(await self._post_id_of(url), max_posts)
+
+    async def _post_id_of(self, url: str) -> int:
+        match = re.search(r"/posts/(\d+)", urlparse(url).path)
+        if match:
+            return int(match.group(1))
+        # anything else the handler can fetch (e.g. index.php?id=), the ID comes from the response
+        response = await self.handler.fetch_async(url, "none - don't download image", HEADERS)
+        return self.handler.get_post_id(response)
+
+
+async def resolve(handler: BooruHandlerBase, url: str, max_posts: int = 0) -> List[Dict]:
+    """Ordered posts (as returned by the API) of a pool/set/favorite group URL or of a post's relations."""
+    return await RelationResolver(handler, url).resolve(url, max_posts)
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url", help="Pool, set or favorite group URL, or a post URL for its parent/child relations")
+    parser.add_argument("--api-type", default="auto")
+    parser.add_argument("--img-size", default="original", help="Image URL to print (original, sample, ...)")
+    parser.add_argument("--max-posts", type=int, default=0, help="0 = all posts")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    handler = registry.get_handler_for(site_root(args.url), args.api_type)
+    if handler is None:
+        raise SystemExit(f"No handler for {args.url}, pick one with --api-type {registry.get_handler_choices()}")
+
+    site = site_root(args.url)
+    for post in asyncio.run(resolve(handler, args.url, args.max_posts)):
+        post_id = handler.get_post_id(post)
+        tags_dict, width, height, image_url = handler.parse(post, args.img_size)
+        item = {
+            "id": post_id,
+            "url": f"{site}/posts/{post_id}",
+            "image_url": image_url,
+            "width": width,
+            "height": height,
+            "tags": tags_dict,
+        }
+        print(json.dumps(item, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    main()
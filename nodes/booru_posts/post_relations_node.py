@@ -0,0 +1,93 @@
+import asyncio
+from typing import Tuple
+
+import numpy as np
+import torch
+
+from ..booru_posts.get_post_node_base import BaseBooruNode
+from ..booru_posts.http_client import http_client
+from ..booru_posts.post_relations import CONCURRENCY, RelationResolver
+from ..misc.utils import comfy_supports_async_nodes
+
+
+class BooruPostSetNode(BaseBooruNode):
+    """
+    Outputs the posts of a pool/set/favorite group, or of a post's parent/child relations, as lists (see post_relations.py).
+    """
+
+    EXPERIMENTAL = False
+
+    FUNCTION = "get_posts_async" if comfy_supports_async_nodes() else "get_posts"
+
+    DESCRIPTION = (
+        "Outputs every post of a pool, set or favorite group in pool order, e.g. for comics or character sheets.\n"
+        "A post URL outputs the post with its parents and children instead (in upload order). "
+        "Every output is a list with one entry per post, images keep their own size."
+    )
+
+    RETURN_INFO = {**BaseBooruNode.RETURN_INFO, "POST_URL": "STRING"}
+    RETURN_TYPES = tuple(RETURN_INFO.values())
+    RETURN_NAMES = tuple(RETURN_INFO.keys())
+    OUTPUT_IS_LIST = (True,) * len(RETURN_INFO)
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        inputs = super().INPUT_TYPES()
+        required = inputs["required"]
+        required["url"] = (
+            "STRING",
+            {
+                "multiline": False,
+                "tooltip": "Pool, set or favorite group URL (e.g. https://e621.net/pools/123), or a post URL for its relations",
+            },
+        )
+        required["max_posts"] = ("INT", {"default": 0, "min": 0, "max": 10000, "tooltip": "0 = all posts"})
+        return inputs
+
+    def get_posts(self, url: str, img_size: str, max_posts: int = 0, **kwargs):
+        """Blocking get_posts_async(), for ComfyUI versions without async nodes."""
+        return http_client.run_sync(self.get_posts_async(url, img_size, max_posts, **kwargs))
+
+    async def get_posts_async(
+        self,
+        url: str,
+        img_size: str,
+        max_posts: int = 0,
+        format_tags: bool = True,
+        trailing_comma: bool = False,
+        exclude_tags: bool = True,
+        user_excluded_tags: str = "",
+        api_type: str = "auto",
+    ) -> Tuple:
+        url = url.strip()
+        if not url:
+            raise ValueError("URL cannot be empty.")
+        handler = self._get_handler(url, api_type)
+        if not handler:
+            raise ValueError(f"No suitable handler found for URL: {url}")
+
+        resolver = RelationResolver(handler, url)
+        posts = await resolver.resolve(url, max_posts)
+        if not posts:
+            raise ValueError(f"No posts found for {url}")
+
+        blank_img_tensor = torch.from_numpy(np.zeros((64, 64, 3), dtype=np.float32)).unsqueeze(0)
+        blank_mask_tensor = torch.zeros((1, 64, 64), dtype=torch.float32)
+        # downloads run CONCURRENCY at a time, gather keeps the pool order
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def build(post) -> Tuple:
+            tags_dict, img_width, img_height, image_url = handler.parse(post, img_size)
+            async with semaphore:
+                img_tensor, mask_tensor = await self._download_image(
+                    image_url, img_size, blank_img_tensor, blank_mask_tensor
+                )
+            tags_dict = self._process_tags(tags_dict, exclude_tags, user_excluded_tags, format_tags, trailing_comma)
+            post_url = f"{resolver.site}/posts/{handler.get_post_id(post)}"
+            return self._build_return_tuple(
+                img_tensor, tags_dict, img_width, img_height, mask_tensor, extra_values={"POST_URL": post_url}
+            )
+
+        rows = await asyncio.gather(*(build(post) for post in posts))
+        # one list per output
+        return tuple(list(values) for values in zip(*rows))
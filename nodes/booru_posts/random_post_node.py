@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Tuple
+
+import numpy as np
+import torch
+
+from ..booru_posts.get_post_node_base import BaseBooruNode, _decode_image
+from ..booru_posts.http_client import http_client
+from ..booru_posts.post_pool import get_pool
+from ..misc.utils import comfy_supports_async_nodes
+
+
+class RandomBooruPostNode(BaseBooruNode):
+    """
+    Picks a random post of a tag search from a pool of prefetched posts (see post_pool.py).
+    """
+
+    EXPERIMENTAL = False
+
+    FUNCTION = "get_random_post_async" if comfy_supports_async_nodes() else "get_random_post"
+
+    DESCRIPTION = (
+        "Outputs a random post matching the tags from a Danbooru-like or e621-like site.\n"
+        "Posts are prefetched in the background, so only the first run of a search waits for the site. "
+        "The same seed gives the same post again (while it's remembered), other seeds don't repeat any of the "
+        "last 500 posts unless the search has fewer."
+    )
+
+    RETURN_INFO = {**BaseBooruNode.RETURN_INFO, "POST_URL": "STRING"}
+    RETURN_TYPES = tuple(RETURN_INFO.values())
+    RETURN_NAMES = tuple(RETURN_INFO.keys())
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        inputs = super().INPUT_TYPES()
+        required = inputs["required"]
+        del required["url"]
+        inputs["required"] = {
+            "site": (
+                "STRING",
+                {"default": "https://danbooru.donmai.us", "tooltip": "Site to search, e.g. https://e621.net"},
+            ),
+            "tags": ("STRING", {"default": "", "multiline": False, "tooltip": "Search query, e.g. 'wolf solo'"}),
+            "seed": ("INT", {"default": 0, "min": 0, "max": 0xFFFFFFFFFFFFFFFF, "control_after_generate": True}),
+            **required,
+            "prefetch_images": (
+                "BOOLEAN",
+                {"default": True, "tooltip": "Download the images of pooled posts ahead of time (in img_size)"},
+            ),
+        }
+        return inputs
+
+    def get_random_post(self, site: str, tags: str, seed: int, img_size: str, prefetch_images: bool = True, **kwargs):
+        """Blocking get_random_post_async(), for ComfyUI versions without async nodes."""
+        return http_client.run_sync(self.get_random_post_async(site, tags, seed, img_size, prefetch_images, **kwargs))
+
+    async def get_random_post_async(
+        self,
+        site: str,
+        tags: str,
+        seed: int,
+        img_size: str,
+        prefetch_images: bool = True,
+        format_tags: bool = True,
+        trailing_comma: bool = False,
+        exclude_tags: bool = True,
+        user_excluded_tags: str = "",
+        api_type: str = "auto",
+    ) -> Tuple:
+        handler = self._get_handler(site, api_type)
+        if not handler:
+            raise ValueError(f"No suitable handler found for site: {site}")
+        if not handler.SEARCH_PAGE_LIMIT:
+            raise ValueError(f"{handler.HANDLER_NAME} doesn't support tag searches")
+
+        candidate = await get_pool(handler, site, tags, img_size, prefetch_images).pick(seed)
+        tags_dict, img_width, img_height, image_url = handler.parse(candidate.response, img_size)
+
+        blank_img_tensor = torch.from_numpy(np.zeros((64, 64, 3), dtype=np.float32)).unsqueeze(0)
+        blank_mask_tensor = torch.zeros((1, 64, 64), dtype=torch.float32)
+        if candidate.image is not None and img_size != "none - don't download image":
+            try:
+                img_tensor, mask_tensor = await asyncio.to_thread(_decode_image, candidate.image)
+            except (OSError, ValueError) as e:
+                logging.error(f"Image processing failed: {e}")
+                img_tensor, mask_tensor = blank_img_tensor, blank_mask_tensor
+        else:
+            img_tensor, mask_tensor = await self._download_image(
+                image_url, img_size, blank_img_tensor, blank_mask_tensor
+            )
+
+        tags_dict = self._process_tags(tags_dict, exclude_tags, user_excluded_tags, format_tags, trailing_comma)
+        return self._build_return_tuple(
+            img_tensor, tags_dict, img_width, img_height, mask_tensor, extra_values={"POST_URL": candidate.post_url}
+        )
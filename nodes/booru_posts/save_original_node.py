@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+from typing import Tuple
+from urllib.parse import urlparse
+
+import folder_paths
+
+from ..booru_posts.get_post_node_base import BaseBooruNode
+from ..booru_posts.http_client import http_client
+from ..booru_posts.original_saver import file_name_for, get_store, write_async
+from ..misc.utils import comfy_supports_async_nodes
+
+# posts fetched and downloaded at a time
+_CONCURRENCY = 4
+
+
+class SaveBooruOriginalNode(BaseBooruNode):
+    """
+    Saves post files to the output folder exactly as downloaded, with a JSON sidecar (see original_saver.py).
+    """
+
+    ALLOW_FORMAT_TAGS = False
+    ALLOW_TRAILING_COMMA = False
+    ALLOW_EXCLUDE_TAGS = False
+    EXPERIMENTAL = False
+
+    FUNCTION = "save_async" if comfy_supports_async_nodes() else "save"
+    OUTPUT_NODE = True
+
+    DESCRIPTION = (
+        "Archives post files into the output folder as the site serves them (jpg/png/webp/gif, never decoded or "
+        "re-encoded), each with a .json sidecar of its tags and source.\n"
+        "Files that are already saved (same URL or same content) aren't downloaded or written again."
+    )
+
+    RETURN_TYPES = ("STRING", "INT")
+    RETURN_NAMES = ("files", "saved")
+    OUTPUT_TOOLTIPS = (
+        "Paths of the files relative to the output folder, one per line",
+        "Number of files written by this run (0 when everything was saved already)",
+    )
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        inputs = super().INPUT_TYPES()
+        required = inputs["required"]
+        required["url"] = ("STRING", {"multiline": True, "tooltip": "Post URLs, one per line"})
+        required["img_size"] = (
+            ["original", "sample", "720x720", "360x360", "180x180"],
+            {"default": "original", "tooltip": "File variant to save. For e6, anything below sample will be 'preview'"},
+        )
+        required["filename_prefix"] = (
+            "STRING",
+            {"default": "booru/booru", "tooltip": "Like SaveImage, may contain subfolders of the output folder"},
+        )
+        required["sidecar"] = ("BOOLEAN", {"default": True, "tooltip": "Write <file>.json with tags and source"})
+        return inputs
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # rerunning is cheap, files that are still saved are skipped without a download
+        return float("nan")
+
+    def save(self, url: str, img_size: str, filename_prefix: str, sidecar: bool, api_type: str = "auto"):
+        """Blocking save_async(), for ComfyUI versions without async nodes."""
+        return http_client.run_sync(self.save_async(url, img_size, filename_prefix, sidecar, api_type))
+
+    async def save_async(
+        self, url: str, img_size: str, filename_prefix: str, sidecar: bool, api_type: str = "auto"
+    ) -> dict:
+        urls = list(dict.fromkeys(line.strip() for line in url.splitlines() if line.strip()))
+        if not urls:
+            raise ValueError("URL cannot be empty.")
+
+        output_dir = folder_paths.get_output_directory()
+        subfolder, prefix = os.path.split(os.path.normpath(filename_prefix.strip() or "booru"))
+        folder = os.path.abspath(os.path.join(output_dir, subfolder))
+        if os.path.commonpath((os.path.abspath(output_dir), folder)) != os.path.abspath(output_dir):
+            raise ValueError(f"filename_prefix points outside of the output folder: {filename_prefix}")
+        store = get_store(folder)
+        semaphore = asyncio.Semaphore(_CONCURRENCY)
+
+        async def save_post(post_url: str) -> Tuple[str, bool]:
+            async with semaphore:
+                headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:151.0) Gecko/20100101 Firefox/151.0"}
+                handler, response = await self._fetch_post(post_url, img_size, api_type, headers)
+                tags_dict, img_width, img_height, image_url = handler.parse(response, img_size)
+                if not image_url:
+                    raise ValueError(f"Post has no file (deleted or hidden for guests): {post_url}")
+
+                saved = store.lookup_url(image_url)
+                if saved is not None:
+                    return saved, False
+                data = await self._download_bytes(image_url, timeout=120)
+
+            try:
+                post_id = handler.get_post_id(response)
+            except (KeyError, IndexError, TypeError, ValueError):
+                # e.g. gelbooru's wrapped responses, their file names are content hashes
+                post_id = os.path.splitext(os.path.basename(urlparse(image_url).path))[0]
+            file_name = file_name_for(prefix, urlparse(post_url).netloc, post_id, image_url, img_size)
+            metadata = {
+                "post_url": post_url,
+                "image_url": image_url,
+                "site": handler.HANDLER_NAME,
+                "width": img_width,
+                "height": img_height,
+                "tags": tags_dict,
+            }
+            return await write_async(store, image_url, data, file_name, metadata if sidecar else None)
+
+        results = await asyncio.gather(*(save_post(post_url) for post_url in urls))
+        files = [os.path.join(subfolder, file_name) for file_name, _ in results]
+        written = sum(1 for _, was_written in results if was_written)
+        logging.info(f"Saved {written} of {len(files)} booru files to {folder}")
+        text = "\n".join(files)
+        return {"ui": {"text": [text]}, "result": (text, written)}
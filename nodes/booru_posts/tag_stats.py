@@ -0,0 +1,264 @@
+"""
+Streaming tag statistics over search results (or exporter metadata files) in bounded memory.
+
+Tag counts go into a count-min sketch, the most frequent tags additionally get exact counters
+(up to --track tags; a tag that enters later starts from its sketch estimate). Tag pairs go into a
+second sketch, the co-occurrence matrix of the top tags is read from it at the end. Posts are never kept.
+
+Run from the repository root, e.g.:
+    python -m nodes.booru_posts.tag_stats --site https://e621.net --tags "wolf solo" --max-posts 5000 --top-k 50 --out ./stats
+    python -m nodes.booru_posts.tag_stats --jsonl dataset/metadata.shard0of1.jsonl --out ./stats
+writes tags.tsv, categories.tsv and cooccurrence.csv (and prints the top tags).
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .booru_post_handlers.handler_base import BooruHandlerBase
+from .booru_post_handlers.handler_registry import registry, site_root
+from .http_client import HEADERS, http_client
+
+_PAIR_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def tag_hashes(tags: List[str]) -> np.ndarray:
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little") for t in tags],
+        dtype=np.uint64,
+    )
+
+
+def pair_hashes(hashes: np.ndarray) -> np.ndarray:
+    """Order independent hash of every pair of the given tag hashes."""
+    a, b = np.triu_indices(len(hashes), k=1)
+    low, high = np.minimum(hashes[a], hashes[b]), np.maximum(hashes[a], hashes[b])
+    mixed = (low * _PAIR_MIX) ^ high
+    # splitmix64 finalizer, spreads the xor over all bits
+    mixed ^= mixed >> np.uint64(31)
+    mixed *= np.uint64(0xBF58476D1CE4E5B9)
+    mixed ^= mixed >> np.uint64(27)
+    return mixed
+
+
+class CountMinSketch:
+    """depth rows of 2**width_bits uint32 counters, multiply-shift hashing of 64-bit keys."""
+
+    def __init__(self, width_bits: int = 18, depth: int = 4, seed: int = 0):
+        self.width_bits = width_bits
+        self.table = np.zeros((depth, 1 << width_bits), dtype=np.uint32)
+        rng = np.random.default_rng(seed)
+        # odd multipliers
+        self._multipliers = rng.integers(1, 2**63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._shift = np.uint64(64 - width_bits)
+
+    def _indexes(self, keys: np.ndarray) -> np.ndarray:
+        return ((keys[None, :] * self._multipliers[:, None]) >> self._shift).astype(np.int64)
+
+    def add(self, keys: np.ndarray):
+        if len(keys):
+            # one flat update for all rows, unique+counts is several times faster than np.add.at
+            flat = (self._indexes(keys) + (np.arange(len(self.table)) << self.width_bits)[:, None]).ravel()
+            cells, counts = np.unique(flat, return_counts=True)
+            table = self.table.reshape(-1)
+            table[cells] += counts.astype(np.uint32)
+
+    def estimate(self, keys: np.ndarray) -> np.ndarray:
+        if not len(keys):
+            return np.zeros(0, dtype=np.uint32)
+        indexes = self._indexes(keys)
+        return np.min(self.table[np.arange(len(self.table))[:, None], indexes], axis=0)
+
+
+class TagStats:
+    def __init__(self, track: int = 2000, pair_width_bits: int = 20):
+        self.track = track
+        self.posts = 0
+        self.tag_sketch = CountMinSketch(18)
+        self.pair_sketch = CountMinSketch(pair_width_bits, seed=1)
+        # exact (once tracked) counts of the frequent tags, and their category
+        self.counts: Dict[str, int] = {}
+        self.categories: Dict[str, str] = {}
+        self._hashes: Dict[str, int] = {}
+        self._floor = 0
+        self.category_totals: Dict[str, int] = {}
+        self.category_posts: Dict[str, int] = {}
+
+    def add_post(self, tags_dict: Dict[str, str]):
+        """tags_dict as returned by the handlers' parse(): "<category>_tags" -> "tag, tag, ..."."""
+        self.posts += 1
+        tags, categories = [], []
+        for key, value in tags_dict.items():
+            category = key[: -len("_tags")] if key.endswith("_tags") else key
+            post_tags = [t.strip() for t in (value or "").split(",") if t.strip()]
+            if post_tags:
+                self.category_totals[category] = self.category_totals.get(category, 0) + len(post_tags)
+                self.category_posts[category] = self.category_posts.get(category, 0) + 1
+            tags.extend(post_tags)
+            categories.extend([category] * len(post_tags))
+        if not tags:
+            return
+
+        hashes = tag_hashes(tags)
+        self.tag_sketch.add(hashes)
+        self.pair_sketch.add(pair_hashes(hashes))
+
+        untracked = [i for i, tag in enumerate(tags) if tag not in self.counts]
+        for i, tag in enumerate(tags):
+            if tag in self.counts:
+                self.counts[tag] += 1
+        if not untracked:
+            return
+        estimates = self.tag_sketch.estimate(hashes[untracked])
+        for i, estimate in zip(untracked, estimates):
+            tag = tags[i]
+            if len(self.counts) >= self.track:
+                # replace the least frequent tracked tag when the sketch says this one is more frequent.
+                # counts only grow, so the last minimum is a lower bound and saves most of the scans
+                if estimate <= self._floor:
+                    continue
+                weakest = min(self.counts, key=self.counts.get)
+                self._floor = self.counts[weakest]
+                if estimate <= self._floor:
+                    continue
+                del self.counts[weakest], self.categories[weakest], self._hashes[weakest]
+            self.counts[tag] = int(estimate)
+            self.categories[tag] = categories[i]
+            self._hashes[tag] = int(hashes[i])
+
+    def top(self, k: int) -> List[Tuple[str, str, int]]:
+        ordered = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(tag, self.categories[tag], count) for tag, count in ordered]
+
+    def cooccurrence(self, k: int) -> Tuple[List[str], np.ndarray]:
+        """Top k tags and their k x k matrix of estimated shared posts (diagonal: the tag's post count)."""
+        top = self.top(k)
+        tags = [tag for tag, _, _ in top]
+        hashes = np.array([self._hashes[t] for t in tags], dtype=np.uint64)
+        matrix = np.diag(np.array([count for _, _, count in top], dtype=np.int64))
+        if len(tags) > 1:
+            a, b = np.triu_indices(len(tags), k=1)
+            estimates = self.pair_sketch.estimate(pair_hashes(hashes)).astype(np.int64)
+            # a pair can't occur more often than its rarer tag
+            estimates = np.minimum(estimates, np.minimum(matrix[a, a], matrix[b, b]))
+            matrix[a, b] = matrix[b, a] = estimates
+        return tags, matrix
+
+    def category_table(self) -> List[Tuple[str, int, float, float]]:
+        """(category, tag occurrences, share of all occurrences, mean tags per post)."""
+        total = sum(self.category_totals.values()) or 1
+        rows = [
+            (category, count, count / total, count / max(self.posts, 1))
+            for category, count in self.category_totals.items()
+        ]
+        return sorted(rows, key=lambda row: -row[1])
+
+    def write(self, out_dir: str, top_k: int):
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, "tags.tsv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["tag", "category", "posts", "fraction"])
+            for tag, category, count in self.top(self.track):
+                writer.writerow([tag, category, count, f"{count / max(self.posts, 1):.4f}"])
+        with open(os.path.join(out_dir, "categories.tsv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["category", "occurrences", "share", "per_post"])
+            for category, count, share, per_post in self.category_table():
+                writer.writerow([category, count, f"{share:.4f}", f"{per_post:.2f}"])
+        tags, matrix = self.cooccurrence(top_k)
+        with open(os.path.join(out_dir, "cooccurrence.csv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([""] + tags)
+            for tag, row in zip(tags, matrix):
+                writer.writerow([tag] + row.tolist())
+
+
+async def iter_search(
+    handler: BooruHandlerBase, site: str, tags: str, max_posts: int = 0, api_delay: float = 0.5
+) -> AsyncIterator[Dict]:
+    """Parsed tags of every post of a search, newest first, one page in memory at a time."""
+    if not handler.SEARCH_PAGE_LIMIT:
+        raise ValueError(f"{handler.HANDLER_NAME} doesn't support tag searches")
+    before_id, count = None, 0
+    while True:
+        started = time.monotonic()
+        url = handler.get_search_url(site, tags, before_id)
+        response = await http_client.get(url, headers=HEADERS, timeout=30)
+        response.raise_for_status()
+        posts = handler.parse_search(handler.decode_response(response.content))
+        if not posts:
+            return
+        for post in posts:
+            post_id = handler.get_post_id(post)
+            before_id = post_id if before_id is None else min(before_id, post_id)
+            yield handler.parse(post, "none - don't download image")[0]
+            count += 1
+            if max_posts and count >= max_posts:
+                return
+        # sites ask for ~1-2 API requests per second
+        await asyncio.sleep(max(0.0, api_delay - (time.monotonic() - started)))
+
+
+def iter_jsonl(paths: Iterable[str]) -> Iterable[Dict]:
+    """Tags of the posts in exporter metadata files."""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)["tags"]
+
+
+def format_top(stats: TagStats, k: int) -> str:
+    return "\n".join(
+        f"{count:>8}  {count / max(stats.posts, 1):6.1%}  {tag} ({category})" for tag, category, count in stats.top(k)
+    )
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--site", help="Site URL, e.g. https://e621.net")
+    parser.add_argument("--tags", default="", help="Search query")
+    parser.add_argument("--api-type", default="auto")
+    parser.add_argument("--jsonl", nargs="+", help="Exporter metadata files instead of a search")
+    parser.add_argument("--max-posts", type=int, default=5000, help="0 = all posts of the search")
+    parser.add_argument("--top-k", type=int, default=50, help="Tags in the co-occurrence matrix")
+    parser.add_argument("--track", type=int, default=2000, help="Tags with exact counters")
+    parser.add_argument("--api-delay", type=float, default=0.5)
+    parser.add_argument("--out", help="Folder for tags.tsv, categories.tsv and cooccurrence.csv")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    stats = TagStats(track=args.track)
+    if args.jsonl:
+        for tags_dict in iter_jsonl(args.jsonl):
+            stats.add_post(tags_dict)
+    elif args.site:
+        handler = registry.get_handler_for(site_root(args.site), args.api_type)
+        if handler is None:
+            raise SystemExit(f"No handler for {args.site}, pick one with --api-type {registry.get_handler_choices()}")
+
+        async def consume():
+            async for tags_dict in iter_search(handler, args.site, args.tags, args.max_posts, args.api_delay):
+                stats.add_post(tags_dict)
+                if stats.posts % 1000 == 0:
+                    logging.info(f"{stats.posts} posts")
+
+        asyncio.run(consume())
+    else:
+        raise SystemExit("Give --site (and --tags) or --jsonl")
+
+    print(f"{stats.posts} posts\n{format_top(stats, args.top_k)}")
+    if args.out:
+        stats.write(args.out, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+
+from ..booru_posts.booru_post_handlers.handler_registry import registry, site_root
+from ..booru_posts.http_client import http_client
+from ..booru_posts.tag_stats import TagStats, format_top, iter_search
+from ..misc.utils import comfy_supports_async_nodes
+
+
+class BooruTagStatsNode:
+    """
+    Tag frequency, per category distribution and co-occurrence of the top tags over a search (see tag_stats.py).
+    """
+
+    DESCRIPTION = (
+        "Streams the posts of a tag search and counts their tags in bounded memory: the most frequent tags, "
+        "how tags are spread over the categories and how often the top tags appear together."
+    )
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "site": ("STRING", {"default": "https://danbooru.donmai.us"}),
+                "tags": ("STRING", {"default": "", "tooltip": "Search query, e.g. 'wolf solo'"}),
+                "api_type": (
+                    registry.get_handler_choices(),
+                    {"default": "auto", "tooltip": "Select booru api type. 'auto' should generally be OK to use"},
+                ),
+                "max_posts": (
+                    "INT",
+                    {"default": 2000, "min": 1, "max": 1000000, "tooltip": "Newest posts of the search to count"},
+                ),
+                "top_k": (
+                    "INT",
+                    {"default": 30, "min": 2, "max": 500, "tooltip": "Tags in the table and co-occurrence matrix"},
+                ),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING")
+    RETURN_NAMES = ("top_tags", "categories", "cooccurrence", "stats")
+    OUTPUT_TOOLTIPS = (
+        "Most frequent tags with their post count and share of posts",
+        "Tag occurrences per category",
+        "Co-occurrence matrix of the top tags as CSV (estimated posts with both tags)",
+        "Everything as JSON",
+    )
+    FUNCTION = "get_stats_async" if comfy_supports_async_nodes() else "get_stats"
+    CATEGORY = "Booru Toolkit/Tags"
+
+    def get_stats(self, site: str, tags: str, api_type: str, max_posts: int, top_k: int):
+        return http_client.run_sync(self.get_stats_async(site, tags, api_type, max_posts, top_k))
+
+    async def get_stats_async(self, site: str, tags: str, api_type: str, max_posts: int, top_k: int):
+        handler = registry.get_handler_for(site_root(site), api_type)
+        if handler is None:
+            raise ValueError(f"No suitable handler found for site: {site}")
+
+        stats = TagStats(track=max(2000, top_k * 4))
+        async for tags_dict in iter_search(handler, site, tags, max_posts):
+            stats.add_post(tags_dict)
+
+        categories = "\n".join(
+            f"{category}: {count} ({share:.1%}, {per_post:.1f} per post)"
+            for category, count, share, per_post in stats.category_table()
+        )
+        top_tags, matrix = stats.cooccurrence(top_k)
+        csv_text = io.StringIO()
+        writer = csv.writer(csv_text, lineterminator="\n")
+        writer.writerow([""] + top_tags)
+        for tag, row in zip(top_tags, matrix):
+            writer.writerow([tag] + row.tolist())
+        result = {
+            "posts": stats.posts,
+            "top_tags": [{"tag": t, "category": c, "posts": n} for t, c, n in stats.top(top_k)],
+            "categories": [
+                {"category": category, "occurrences": count, "per_post": per_post}
+                for category, count, _, per_post in stats.category_table()
+            ],
+            "cooccurrence": {"tags": top_tags, "matrix": matrix.tolist()},
+        }
+        return (
+            f"{stats.posts} posts\n{format_top(stats, top_k)}",
+            categories,
+            csv_text.getvalue(),
+            json.dumps(result, ensure_ascii=False),
+        )
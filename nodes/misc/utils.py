@@ -1,11 +1,80 @@
+import inspect
+from typing import Tuple
+
 import numpy as np
 import torch
 from PIL.Image import Image as PILImage
 
+# modes that carry an alpha channel as their last band
+_ALPHA_MODES = ("RGBA", "LA")
+# modes PIL can't hand to numpy as plain RGB/L(A) data, converted up front
+_CONVERT_MODES = {
+    "PA": "RGBA",
+    "RGBa": "RGBA",  # premultiplied alpha
+    "La": "LA",
+    "CMYK": "RGB",
+    "YCbCr": "RGB",
+    "LAB": "RGB",
+    "HSV": "RGB",
+}
+# value range of non 8-bit modes, everything else is scaled by 1/255
+_MODE_SCALE = {
+    "1": 1.0,
+    "I": 1.0 / 65535.0,  # 16-bit PNGs open as "I" on older pillow versions
+    "I;16": 1.0 / 65535.0,
+    "I;16B": 1.0 / 65535.0,
+    "I;16L": 1.0 / 65535.0,
+    "I;16N": 1.0 / 65535.0,
+}
+
+
+def _normalize_mode(image: PILImage) -> PILImage:
+    """Converts exotic modes to RGB/RGBA/L/LA, keeps everything numpy can read directly as is."""
+    mode = image.mode
+    if mode == "P":
+        return image.convert("RGBA" if "transparency" in image.info else "RGB")
+    if mode in ("L", "RGB") and "transparency" in image.info:
+        return image.convert("LA" if mode == "L" else "RGBA")
+    if mode in _CONVERT_MODES:
+        return image.convert(_CONVERT_MODES[mode])
+    return image
+
+
+def to_tensor_and_mask(image: PILImage) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Converts a PIL Image of any mode to an RGB IMAGE tensor (1, H, W, 3) and a MASK tensor (1, H, W).
+
+    The mask follows ComfyUI's LoadImage convention (1.0 where the image is transparent)
+    and is all zeros for images without alpha. Pixels are scaled straight into preallocated
+    tensors, grayscale is broadcast to RGB in the same pass.
+    """
+    image = _normalize_mode(image)
+    arr = np.asarray(image)
+    if arr.ndim == 2:
+        arr = arr[..., None]
+    height, width, channels = arr.shape
+
+    img_tensor = torch.empty((1, height, width, 3), dtype=torch.float32)
+    mask_tensor = torch.zeros((1, height, width), dtype=torch.float32)
+    img_np = img_tensor.numpy()[0]
+
+    # RGB(A/X) keeps its first three bands, L(A) broadcasts its single band to all three
+    color = arr[..., :3] if channels >= 3 else arr[..., :1]
+    np.multiply(color, np.float32(_MODE_SCALE.get(image.mode, 1.0 / 255.0)), out=img_np, casting="unsafe")
+    if image.mode in ("I", "F"):
+        # 32-bit modes have no fixed range
+        np.clip(img_np, 0.0, 1.0, out=img_np)
+
+    if image.mode in _ALPHA_MODES:
+        mask_np = mask_tensor.numpy()[0]
+        np.multiply(arr[..., -1], np.float32(-1.0 / 255.0), out=mask_np, casting="unsafe")
+        mask_np += 1.0
+
+    return img_tensor, mask_tensor
+
 
 def to_tensor(image: PILImage) -> torch.Tensor:
     """Converts a PIL Image to a PyTorch tensor with an added batch dimension as ComfyUI expects it."""
-    return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+    return to_tensor_and_mask(image)[0]
 
 
 def adjust_tags(tags: str) -> str:
@@ -48,3 +117,12 @@ def calculate_dimensions_for_diffusion(
     new_height = (new_height // multiples_of) * multiples_of
 
     return int(new_width), int(new_height)
+
+
+def comfy_supports_async_nodes() -> bool:
+    """Whether the running ComfyUI awaits `async def` node functions (added in v0.3.44)."""
+    try:
+        import execution
+    except ImportError:
+        return False
+    return inspect.iscoroutinefunction(getattr(execution, "_async_map_node_over_list", None))
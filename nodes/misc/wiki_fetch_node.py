@@ -1,3 +1,7 @@
+from ..booru_posts.http_client import http_client
+from .utils import comfy_supports_async_nodes
+
+
 class TagWikiFetch:
     @classmethod
     def INPUT_TYPES(cls):
@@ -27,18 +31,20 @@ class TagWikiFetch:
         }
 
     RETURN_TYPES = ("STRING",)
-    FUNCTION = "get_wiki_data"
+    FUNCTION = "get_wiki_data_async" if comfy_supports_async_nodes() else "get_wiki_data"
     OUTPUT_NODE = True
 
     CATEGORY = "E621 Booru Toolkit/Tags"
 
     def get_wiki_data(self, tags, booru, extended_info):
+        # not asyncio.run(), the executing thread may already run an event loop
+        return http_client.run_sync(self.get_wiki_data_async(tags, booru, extended_info))
 
-        import asyncio
+    async def get_wiki_data_async(self, tags, booru, extended_info):
 
         from ..pyserver import get_tag_wiki_data
 
-        response = asyncio.run(get_tag_wiki_data.fetch_wiki_data(tags, booru, extended_info))
+        response = await get_tag_wiki_data.fetch_wiki_data(tags, booru, extended_info)
 
         data = response.get("data", "")
         return {"ui": {"text": data}, "result": (data,)}
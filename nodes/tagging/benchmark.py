@@ -0,0 +1,121 @@
+"""
+Benchmark the PixAI tagger execution modes against each other.
+
+Run from the repository root, e.g.:
+    python -m nodes.tagging.benchmark --model "pixai-tagger-v0.9/model.safetensors" --images ./some_images
+    python -m nodes.tagging.benchmark --model "pixai-tagger-v0.9/model.safetensors" --modes fp32,bf16,int8,int8+compile
+
+Reports model throughput (images/s, preprocessing excluded) and how well each mode's tags
+agree with fp32 at the given thresholds (mean Jaccard of the per-image tag sets).
+"""
+
+import argparse
+import os
+import time
+from typing import Dict, List
+
+import torch
+from PIL import Image
+
+from ..misc.utils import to_tensor
+from .inference.pixai_tagger_pth_sft import EndpointHandler, preprocess_tensor
+from .model_manager import model_index
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif")
+
+
+def parse_mode(mode: str) -> Dict:
+    """'int8+compile+channels_last' -> EndpointHandler options."""
+    precision, *flags = mode.split("+")
+    return {
+        "precision": precision,
+        "compile_model": "compile" in flags,
+        "channels_last": "channels_last" in flags,
+    }
+
+
+def load_inputs(images_dir: str, count: int) -> torch.Tensor:
+    """Preprocessed (N, 3, 448, 448) model input, from a folder of images or random noise."""
+    if not images_dir:
+        return preprocess_tensor(torch.rand(count, 448, 448, 3))
+    files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS))[:count]
+    if not files:
+        raise SystemExit(f"No images found in {images_dir}")
+    with torch.inference_mode():
+        return torch.cat([preprocess_tensor(to_tensor(Image.open(os.path.join(images_dir, f)))) for f in files])
+
+
+def tag_sets(handler: EndpointHandler, probs: torch.Tensor, general_threshold: float, character_threshold: float):
+    thresholds = torch.full((probs.shape[1],), general_threshold)
+    thresholds[handler.gen_tag_count :] = character_threshold
+    return [set(row.nonzero(as_tuple=True)[0].tolist()) for row in probs > thresholds]
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def run(args) -> List[Dict]:
+    model_info = model_index.get_model(args.model)
+    if not model_info:
+        raise SystemExit(f"Model '{args.model}' not found in {model_index.models_dir}")
+
+    inputs = load_inputs(args.images, args.count)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    if modes[0] != "fp32":
+        modes.insert(0, "fp32")  # reference for the agreement numbers
+
+    reference = None
+    results = []
+    for mode in modes:
+        handler = EndpointHandler(
+            weights_file=model_info["weights"],
+            tags_file=model_info["tags"],
+            mapping_file=model_info["mapping"],
+            num_threads=args.threads,
+            **parse_mode(mode),
+        )
+        # warmup, also triggers torch.compile
+        handler.predict_probs(inputs[: args.batch_size], args.batch_size)
+
+        start = time.perf_counter()
+        probs = handler.predict_probs(inputs, args.batch_size)
+        elapsed = time.perf_counter() - start
+
+        tags = tag_sets(handler, probs, args.general_threshold, args.character_threshold)
+        if reference is None:
+            reference = (probs, tags)
+        results.append(
+            {
+                "mode": mode,
+                "device": handler.device,
+                "images_per_s": inputs.shape[0] / elapsed,
+                "tag_agreement": sum(jaccard(a, b) for a, b in zip(tags, reference[1])) / len(tags),
+                "max_prob_diff": (probs - reference[0]).abs().max().item(),
+            }
+        )
+        del handler
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="Model label as shown in the node (folder/weights file)")
+    parser.add_argument("--images", default="", help="Folder with test images, random noise if omitted")
+    parser.add_argument("--count", type=int, default=32, help="Number of images to benchmark")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--modes", default="fp32,bf16,int8", help="Comma separated, flags: +compile, +channels_last")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads, 0 = torch default")
+    parser.add_argument("--general-threshold", type=float, default=0.35)
+    parser.add_argument("--character-threshold", type=float, default=0.85)
+    args = parser.parse_args()
+
+    print(f"{'mode':<28} {'device':<6} {'images/s':>9} {'tag agreement':>14} {'max prob diff':>14}")
+    for r in run(args):
+        print(
+            f"{r['mode']:<28} {r['device']:<6} {r['images_per_s']:>9.2f} {r['tag_agreement']:>14.4f} {r['max_prob_diff']:>14.5f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
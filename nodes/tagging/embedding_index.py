@@ -0,0 +1,395 @@
+"""
+Local similarity-search index over tagger encoder embeddings.
+
+The tagger node adds embeddings to a named index when its embedding_index input is set.
+A folder of images can also be indexed from the repository root:
+    python -m nodes.tagging.embedding_index add --model "pixai-tagger-v0.9/model.safetensors" --images ./imgs --index refs
+    python -m nodes.tagging.embedding_index search --index refs --key some_image.png --top-k 10
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+INDEX_DIR = os.environ.get(
+    "BTK_EMBEDDING_INDEX_DIR",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "cache", "embeddings")),
+)
+# an inverted file (IVF) is trained once an index has this many vectors, smaller ones are searched exactly
+IVF_MIN_VECTORS = int(os.environ.get("BTK_EMBEDDING_IVF_MIN", "50000"))
+# the IVF is retrained when the index has grown by this factor since the last training
+IVF_RETRAIN_GROWTH = 4
+_SEARCH_CHUNK = 65536
+_KMEANS_ITERATIONS = 10
+_KMEANS_MAX_SAMPLES = 100_000
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2 normalize rows, so the dot product is the cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, highest first."""
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class EmbeddingIndex:
+    """
+    Append-only vector index stored in one folder.
+
+    vectors.f16: flat (N, dim) float16 matrix of L2 normalized embeddings, memory-mapped for search
+    keys.txt: one key (image hash, post ID/URL, file name) per line, line i belongs to row i
+    ivf_centroids.npy / ivf_assign.i32: optional k-means coarse clusters and the cluster of every row,
+    a search then only scans the rows of the nprobe clusters closest to the query.
+
+    Adding an existing key overwrites its vector in place.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self.meta: Dict = {}
+        self.keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._vectors: Optional[np.memmap] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._assign: Optional[np.ndarray] = None
+        self._load()
+
+    # files
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        try:
+            with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {}
+        if not self.meta.get("dim"):
+            return
+
+        try:
+            with open(self._file("keys.txt"), "r", encoding="utf-8", newline="\n") as f:
+                text = f.read()
+        except OSError:
+            text = ""
+        # only lines with their newline are complete, the last one may have been cut off
+        keys = text.split("\n")[:-1]
+        row_bytes = self.meta["dim"] * 2
+        try:
+            vectors_size = os.path.getsize(self._file("vectors.f16"))
+        except OSError:
+            vectors_size = 0
+        self.keys = keys[: min(len(keys), vectors_size // row_bytes)]
+        self._rows = {key: row for row, key in enumerate(self.keys)}
+
+        # an interrupted append can leave a file with extra (or partly written) rows. They are cut off
+        # on disk, later appends would land after them and shift every new key off its vector otherwise
+        rows = len(self.keys)
+        if vectors_size > rows * row_bytes:
+            logging.warning(f"Embedding index {self.path} has unfinished rows, dropping them")
+            os.truncate(self._file("vectors.f16"), rows * row_bytes)
+        if len(keys) > rows or not text.endswith("\n") and text:
+            self._write_keys()
+
+        if os.path.exists(self._file("ivf_centroids.npy")):
+            self._centroids = np.load(self._file("ivf_centroids.npy"))
+            assign = np.fromfile(self._file("ivf_assign.i32"), dtype=np.int32)
+            if len(assign) >= rows:
+                self._assign = assign[:rows]
+                if os.path.getsize(self._file("ivf_assign.i32")) > rows * 4:
+                    os.truncate(self._file("ivf_assign.i32"), rows * 4)
+            else:
+                logging.warning(f"Embedding index {self.path} has an incomplete IVF, it will be retrained")
+                self._centroids = None
+
+    def _write_keys(self):
+        with open(self._file("keys.txt.tmp"), "w", encoding="utf-8", newline="\n") as f:
+            f.write("".join(key + "\n" for key in self.keys))
+        os.replace(self._file("keys.txt.tmp"), self._file("keys.txt"))
+
+    def _save_meta(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file("meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def dim(self) -> int:
+        return self.meta.get("dim", 0)
+
+    def vectors(self) -> np.ndarray:
+        """(N, dim) float16 memmap of all stored vectors."""
+        with self._lock:
+            if not self.keys:
+                return np.empty((0, self.dim), dtype=np.float16)
+            if self._vectors is None or self._vectors.shape[0] != len(self.keys):
+                self._vectors = np.memmap(
+                    self._file("vectors.f16"), dtype=np.float16, mode="r", shape=(len(self.keys), self.dim)
+                )
+            return self._vectors
+
+    # writing
+
+    def add(self, keys: Sequence[str], vectors: np.ndarray, model: str = ""):
+        """
+        Store one vector per key. model: label of the model that made the embeddings,
+        adding embeddings of another model is logged since their similarities aren't comparable.
+        """
+        vectors = normalize(vectors).astype(np.float16)
+        if len(keys) != len(vectors):
+            raise ValueError(f"Got {len(keys)} keys for {len(vectors)} embeddings")
+        keys = [str(key).replace("\n", " ").strip() for key in keys]
+        if not all(keys):
+            raise ValueError("Embedding index keys can't be empty")
+
+        with self._lock:
+            if not self.dim:
+                self.meta = {"dim": int(vectors.shape[1]), "model": model, "ivf_trained_at": 0}
+                self._save_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding size {vectors.shape[1]} doesn't match the index ({self.dim})")
+            elif model and self.meta.get("model") and model != self.meta["model"]:
+                logging.warning(
+                    f"Adding {model} embeddings to an index built with {self.meta['model']}, similarities will be off"
+                )
+
+            in_place: Dict[int, np.ndarray] = {}
+            appended: Dict[str, np.ndarray] = {}
+            # later duplicates of a key win
+            for key, vector in zip(keys, vectors):
+                if key in self._rows:
+                    in_place[self._rows[key]] = vector
+                else:
+                    appended[key] = vector
+            # drop the read-only mapping before writing, windows doesn't like resizing mapped files
+            self._vectors = None
+
+            if in_place:
+                rows = np.fromiter(in_place, dtype=np.int64)
+                stored = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r+", shape=(len(self), self.dim))
+                stored[rows] = np.stack(list(in_place.values()))
+                stored.flush()
+                del stored
+                if self._centroids is not None:
+                    self._assign[rows] = self._nearest_centroids(np.stack(list(in_place.values())))
+                    self._assign.tofile(self._file("ivf_assign.i32"))
+
+            if appended:
+                new_vectors = np.stack(list(appended.values()))
+                with open(self._file("vectors.f16"), "ab") as f:
+                    new_vectors.tofile(f)
+                with open(self._file("keys.txt"), "a", encoding="utf-8", newline="\n") as f:
+                    f.write("".join(key + "\n" for key in appended))
+                for key in appended:
+                    self._rows[key] = len(self.keys)
+                    self.keys.append(key)
+                if self._centroids is not None:
+                    new_assign = self._nearest_centroids(new_vectors)
+                    with open(self._file("ivf_assign.i32"), "ab") as f:
+                        new_assign.tofile(f)
+                    self._assign = np.concatenate((self._assign, new_assign))
+
+            trained_at = self.meta.get("ivf_trained_at", 0)
+            if len(self) >= IVF_MIN_VECTORS and (not trained_at or len(self) >= trained_at * IVF_RETRAIN_GROWTH):
+                self.train_ivf()
+
+    # IVF
+
+    def _nearest_centroids(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+        centroids = self._centroids if centroids is None else centroids
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), _SEARCH_CHUNK):
+            chunk = np.asarray(vectors[start : start + _SEARCH_CHUNK], dtype=np.float32)
+            assign[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return assign
+
+    def train_ivf(self, nlist: int = 0, seed: int = 0):
+        """Spherical k-means over (a sample of) the stored vectors, nlist defaults to ~sqrt(N) clusters."""
+        with self._lock:
+            vectors = self.vectors()
+            if len(vectors) == 0:
+                return
+            nlist = min(nlist or max(16, int(np.sqrt(len(vectors)))), len(vectors))
+            logging.info(f"Training IVF with {nlist} clusters for {len(vectors)} embeddings in {self.path}")
+
+            rng = np.random.default_rng(seed)
+            sample_rows = np.sort(rng.choice(len(vectors), min(len(vectors), _KMEANS_MAX_SAMPLES), replace=False))
+            sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+            for _ in range(_KMEANS_ITERATIONS):
+                assign = self._nearest_centroids(sample, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                empty = np.bincount(assign, minlength=nlist) == 0
+                # reseed empty clusters with random samples
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                centroids = normalize(sums)
+
+            self._centroids = centroids
+            self._assign = self._nearest_centroids(vectors)
+            np.save(self._file("ivf_centroids.npy"), centroids)
+            self._assign.tofile(self._file("ivf_assign.i32"))
+            self.meta["ivf_trained_at"] = len(vectors)
+            self._save_meta()
+
+    # search
+
+    def vector_for(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        return None if row is None else np.asarray(self.vectors()[row], dtype=np.float32)
+
+    def search(self, query: np.ndarray, top_k: int = 10, nprobe: int = 8) -> List[Tuple[str, float]]:
+        """
+        Keys and cosine similarities of the top_k most similar stored vectors, most similar first.
+        With an IVF only the nprobe closest clusters are scanned (approximate), nprobe <= 0 scans everything.
+        """
+        query = normalize(np.asarray(query, dtype=np.float32).reshape(-1))
+        top_k = max(1, int(top_k))
+        with self._lock:
+            vectors = self.vectors()
+            if len(vectors) == 0:
+                return []
+            if query.shape[0] != self.dim:
+                raise ValueError(f"Query embedding size {query.shape[0]} doesn't match the index ({self.dim})")
+            centroids, assign = self._centroids, self._assign
+
+        if centroids is not None and 0 < nprobe < len(centroids):
+            probes = _top_k(centroids @ query, nprobe)
+            rows = np.flatnonzero(np.isin(assign, probes))
+            if len(rows) == 0:
+                # the probed clusters are empty (rows moved by overwrites, reseeded clusters), scan everything
+                rows = None
+        else:
+            rows = None
+
+        best_rows, best_scores = [], []
+        total = len(vectors) if rows is None else len(rows)
+        for start in range(0, total, _SEARCH_CHUNK):
+            if rows is None:
+                chunk_rows = np.arange(start, min(start + _SEARCH_CHUNK, total))
+                chunk = vectors[start : start + len(chunk_rows)]
+            else:
+                chunk_rows = rows[start : start + _SEARCH_CHUNK]
+                chunk = vectors[chunk_rows]
+            scores = np.asarray(chunk, dtype=np.float32) @ query
+            top = _top_k(scores, top_k)
+            best_rows.append(chunk_rows[top])
+            best_scores.append(scores[top])
+
+        best_rows, best_scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        top = _top_k(best_scores, top_k)
+        return [(self.keys[row], float(score)) for row, score in zip(best_rows[top], best_scores[top])]
+
+
+_INDEX_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+_indexes: Dict[str, EmbeddingIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(name: str, index_dir: str = INDEX_DIR) -> EmbeddingIndex:
+    """Shared EmbeddingIndex for a name (letters, digits, '_', '-', '.'), created on the first add."""
+    name = name.strip()
+    if not _INDEX_NAME.match(name) or name in (".", ".."):
+        raise ValueError(f"Invalid embedding index name '{name}'")
+    path = os.path.join(index_dir, name)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = EmbeddingIndex(path)
+        return _indexes[path]
+
+
+def list_indexes(index_dir: str = INDEX_DIR) -> List[str]:
+    try:
+        return sorted(f for f in os.listdir(index_dir) if os.path.exists(os.path.join(index_dir, f, "meta.json")))
+    except OSError:
+        return []
+
+
+def _add_folder(args):
+    import torch
+    from PIL import Image
+
+    from ..misc.utils import to_tensor
+    from .model_manager import model_index, model_manager
+
+    model_info = model_index.get_model(args.model)
+    if not model_info:
+        raise SystemExit(f"Model '{args.model}' not found in {model_index.models_dir}")
+    handler = model_manager.get_handler(model_info, backend=args.backend, precision=args.precision)
+    if not handler.supports_embeddings:
+        raise SystemExit("This ONNX export has no embedding output, export it again")
+    index = get_index(args.index)
+
+    extensions = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif")
+    files = sorted(f for f in os.listdir(args.images) if f.lower().endswith(extensions))
+    for start in range(0, len(files), args.batch_size):
+        names = files[start : start + args.batch_size]
+        embeddings = []
+        for name in names:
+            # images differ in size, so each is preprocessed on its own
+            image = to_tensor(Image.open(os.path.join(args.images, name)))
+            embeddings.append(handler.predict_from_images(image)[1])
+        index.add(names, torch.cat(embeddings).numpy(), model=model_info["label"])
+        print(f"{min(start + args.batch_size, len(files))}/{len(files)}")
+
+
+def _search(args):
+    index = get_index(args.index)
+    query = index.vector_for(args.key)
+    if query is None:
+        raise SystemExit(f"'{args.key}' is not in the index")
+    for key, score in index.search(query, args.top_k, args.nprobe):
+        print(f"{score:.4f}  {key}")
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="Embed a folder of images, keyed by file name")
+    add.add_argument("--model", required=True, help="Model label as shown in the node (folder/weights file)")
+    add.add_argument("--images", required=True)
+    add.add_argument("--index", default="default")
+    add.add_argument("--backend", default="auto", choices=["auto", "pytorch", "onnx"])
+    add.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "int8"])
+    add.add_argument("--batch-size", type=int, default=64, help="Images per index write")
+
+    search = commands.add_parser("search", help="Most similar entries to an indexed key")
+    search.add_argument("--index", default="default")
+    search.add_argument("--key", required=True)
+    search.add_argument("--top-k", type=int, default=10)
+    search.add_argument("--nprobe", type=int, default=8)
+
+    train = commands.add_parser("train-ivf", help="(Re)train the IVF clusters now")
+    train.add_argument("--index", default="default")
+    train.add_argument("--nlist", type=int, default=0)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "add":
+        _add_folder(args)
+    elif args.command == "search":
+        _search(args)
+    else:
+        get_index(args.index).train_ivf(args.nlist)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import json
+import logging
+
+import torch
+
+from .embedding_index import get_index, list_indexes
+
+
+class TaggerEmbeddingSearchNode:
+    """
+    Finds the images/posts in a local embedding index that are most similar to a tagger embedding.
+    Useful for near-duplicate detection (score close to 1) and finding reference images.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "embedding": ("TAGGER_EMBEDDING",),
+                "index_name": (
+                    "STRING",
+                    {
+                        "default": "default",
+                        "tooltip": f"Index filled by the tagger node. Existing: {', '.join(list_indexes()) or 'none yet'}",
+                    },
+                ),
+                "top_k": ("INT", {"default": 10, "min": 1, "max": 1000}),
+                "nprobe": (
+                    "INT",
+                    {
+                        "default": 8,
+                        "min": 0,
+                        "max": 4096,
+                        "tooltip": (
+                            "Only used for large indexes: how many clusters to scan. "
+                            "Higher = more accurate and slower, 0 = exact search"
+                        ),
+                    },
+                ),
+                "min_score": (
+                    "FLOAT",
+                    {"default": 0.0, "min": -1.0, "max": 1.0, "step": 0.01, "tooltip": "Minimum cosine similarity"},
+                ),
+                "skip_identical": (
+                    "BOOLEAN",
+                    {"default": False, "tooltip": "Leave out exact matches, e.g. the query image itself"},
+                ),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("keys", "results")
+    OUTPUT_TOOLTIPS = ("Keys of the matches, one per line, most similar first", "JSON list of {key, score}")
+    FUNCTION = "search"
+    CATEGORY = "Tagging"
+
+    def search(
+        self,
+        embedding: torch.Tensor,
+        index_name: str,
+        top_k: int = 10,
+        nprobe: int = 8,
+        min_score: float = 0.0,
+        skip_identical: bool = False,
+    ):
+        if embedding is None:
+            logging.error("No embedding given, the tagger backend might not support embeddings")
+            return ("", "[]")
+        try:
+            index = get_index(index_name)
+            # one extra in case the query itself is in the index
+            matches = index.search(embedding.float().cpu().numpy(), top_k + int(skip_identical), nprobe)
+        except ValueError as e:
+            logging.error(f"Embedding search in '{index_name}' failed: {e}")
+            return ("", "[]")
+
+        matches = [(key, score) for key, score in matches if score >= min_score]
+        if skip_identical:
+            matches = [(key, score) for key, score in matches if score < 0.9999]
+        matches = matches[:top_k]
+
+        keys = "\n".join(key for key, _ in matches)
+        results = json.dumps([{"key": key, "score": round(score, 4)} for key, score in matches])
+        return (keys, results)
@@ -0,0 +1,174 @@
+"""
+ONNX Runtime backend for the PixAI tagger.
+
+Export the encoder + tagging head once from the .pth/.safetensors weights (needs timm and onnx),
+run from the repository root:
+    python -m nodes.tagging.inference.pixai_tagger_onnx models/pixai-tagger-v0.9/model.safetensors
+    python -m nodes.tagging.inference.pixai_tagger_onnx models/pixai-tagger-v0.9/model.safetensors --calibration-images ./imgs
+
+This writes model.onnx (and model.int8.onnx when calibration images are given) next to the weights,
+where the tagger node picks them up. Inference afterwards only needs onnxruntime, not timm.
+"""
+
+import argparse
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+from .pixai_tagger_pth_sft import EndpointHandler, load_model, preprocess_tensor
+
+IMAGE_SIZE = 448
+INPUT_NAME = "pixel_values"
+OUTPUT_NAME = "probs"
+EMBEDDING_NAME = "embedding"
+INT8_SUFFIX = ".int8.onnx"
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise RuntimeError("Failed to load pixai tagger model (onnx version), onnxruntime is not installed. " + str(e)) from e
+    return onnxruntime
+
+
+class _ProbsAndEmbedding(torch.nn.Module):
+    """Exported graph outputs the tag probabilities and the pooled encoder features."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.encoder, self.decoder = model
+
+    def forward(self, x):
+        embedding = self.encoder(x)
+        return self.decoder(embedding), embedding
+
+
+def export_onnx(weights_file: str, onnx_file: str, opset: int = 18) -> str:
+    """Export encoder + head with a dynamic batch dimension."""
+    model = _ProbsAndEmbedding(load_model(weights_file, "cpu"))
+    dummy = torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE)
+    torch.onnx.export(
+        model,
+        (dummy,),
+        onnx_file,
+        input_names=[INPUT_NAME],
+        output_names=[OUTPUT_NAME, EMBEDDING_NAME],
+        dynamic_axes={INPUT_NAME: {0: "batch"}, OUTPUT_NAME: {0: "batch"}, EMBEDDING_NAME: {0: "batch"}},
+        opset_version=opset,
+    )
+    logging.info(f"Exported tagger to {onnx_file}")
+    return onnx_file
+
+
+class _ImageFolderCalibrationReader:
+    """Feeds preprocessed images to onnxruntime's static quantization calibration."""
+
+    def __init__(self, images_dir: str, count: int):
+        from PIL import Image
+
+        from ...misc.utils import to_tensor
+
+        files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith((".png", ".jpg", ".jpeg", ".webp")))
+        if not files:
+            raise ValueError(f"No calibration images found in {images_dir}")
+        self._inputs = iter(
+            {INPUT_NAME: preprocess_tensor(to_tensor(Image.open(os.path.join(images_dir, f)))).numpy()}
+            for f in files[:count]
+        )
+
+    def get_next(self):
+        return next(self._inputs, None)
+
+
+def quantize_onnx_static(onnx_file: str, output_file: str, images_dir: str, count: int = 64) -> str:
+    """int8 static (QDQ) quantization, calibrated on a folder of representative images."""
+    _import_onnxruntime()
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared_file = output_file + ".prep.onnx"
+    quant_pre_process(onnx_file, prepared_file)
+    try:
+        quantize_static(
+            prepared_file,
+            output_file,
+            _ImageFolderCalibrationReader(images_dir, count),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+    finally:
+        os.remove(prepared_file)
+    logging.info(f"Quantized tagger to {output_file}")
+    return output_file
+
+
+class OnnxEndpointHandler(EndpointHandler):
+    """EndpointHandler running an exported model through onnxruntime's CPU provider."""
+
+    def __init__(self, onnx_file: str, tags_file: str, mapping_file: str, num_threads: int = 0):
+        onnx_path = self._check_files(onnx_file, tags_file, mapping_file)
+        ort = _import_onnxruntime()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(onnx_path), options, providers=["CPUExecutionProvider"])
+        self.onnx_file = str(onnx_path)
+        self.weights_file = self.onnx_file
+        # exports made before the embedding output was added only have probs
+        self.supports_embeddings = EMBEDDING_NAME in {o.name for o in self.session.get_outputs()}
+        self._output_names = [OUTPUT_NAME, EMBEDDING_NAME] if self.supports_embeddings else [OUTPUT_NAME]
+
+        self.precision = "int8" if str(onnx_path).endswith(INT8_SUFFIX) else "fp32"
+        self.device = "cpu"
+        self.channels_last = False
+        self.model = None
+        self.output_indices = None
+        self._init_common(tags_file, mapping_file)
+
+    def model_nbytes(self) -> int:
+        return os.path.getsize(self.onnx_file)
+
+    def _prune_model(self, indices: np.ndarray):
+        # the head is baked into the graph, select the kept outputs instead
+        self.output_indices = indices
+
+    def _forward(self, chunk: torch.Tensor) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        outputs = self.session.run(
+            self._output_names, {INPUT_NAME: np.ascontiguousarray(chunk.numpy(), dtype=np.float32)}
+        )
+        probs = outputs[0]
+        if self.output_indices is not None:
+            probs = probs[:, self.output_indices]
+        embeddings = torch.from_numpy(outputs[1]) if self.supports_embeddings else None
+        return torch.from_numpy(probs), embeddings
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("weights", help="Path to the .pth/.safetensors tagger weights")
+    parser.add_argument("--output", default="", help="Output .onnx path, defaults to the weights path with .onnx")
+    parser.add_argument("--opset", type=int, default=18)
+    parser.add_argument("--calibration-images", default="", help="Folder of images, enables int8 static quantization")
+    parser.add_argument("--calibration-count", type=int, default=64)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    output = args.output or str(Path(args.weights).with_suffix(".onnx"))
+    export_onnx(args.weights, output, args.opset)
+    if args.calibration_images:
+        quantize_onnx_static(
+            output, output[: -len(".onnx")] + INT8_SUFFIX, args.calibration_images, args.calibration_count
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,30 @@
 # Copied from https://huggingface.co/pixai-labs/pixai-tagger-v0.9/tree/main/handler.py | Apache 2.0 Licensed
 
 import base64
+import copy
+import hashlib
 import io
+import itertools
 import json
 import logging
+import math
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator, Optional
 
+import numpy as np
 import requests
-import timm
 import torch
 import torchvision.transforms as transforms
 from PIL import Image
 
+from .tag_vocabulary import TagVocabulary
+
+
+# torch's own thread count, restored for handlers that don't set one
+DEFAULT_NUM_THREADS = torch.get_num_threads()
+
 
 class TaggingHead(torch.nn.Module):
     def __init__(self, input_dim, num_classes):
@@ -45,6 +56,9 @@ def get_character_ip_mapping(mapping_file: Path):
 
 
 def get_encoder():
+    # imported here so the ONNX backend works without timm installed
+    import timm
+
     base_model_repo = "hf_hub:SmilingWolf/wd-eva02-large-tagger-v3"
     encoder = timm.create_model(base_model_repo, pretrained=False)
     encoder.reset_classifier(0)
@@ -63,23 +77,66 @@ def get_model():
     return model
 
 
-def load_model(weights_file, device):
-    model = get_model()
+def load_state_dict(weights_file) -> dict[str, torch.Tensor]:
+    """Load weights memory-mapped, tensors stay backed by the file instead of being copied into RAM."""
     suffix = Path(weights_file).suffix.lower()
     if suffix in {".safetensors", ".sft"}:
         try:
             from safetensors.torch import load_file as safe_load_file
         except ImportError as e:
             raise RuntimeError("Failed to load pixai tagger model (safetensors version). " + str(e)) from e
-        state_dict = safe_load_file(weights_file, device="cpu")
-    else:
-        state_dict = torch.load(weights_file, map_location="cpu", weights_only=True)
-    model.load_state_dict(state_dict)
+        # safetensors mmaps the file, CPU tensors are zero-copy views into it
+        return safe_load_file(weights_file, device="cpu")
+    return torch.load(weights_file, map_location="cpu", weights_only=True, mmap=True)
+
+
+def _materialize_meta_buffers(model: torch.nn.Module) -> bool:
+    """Recompute non-persistent buffers (e.g. rope tables) left on the meta device, False if that's not possible."""
+    for module in model.modules():
+        meta_buffers = [name for name, buffer in module.named_buffers(recurse=False) if buffer.is_meta]
+        if not meta_buffers:
+            continue
+        init_buffers = getattr(module, "init_non_persistent_buffers", None)
+        if init_buffers is None:
+            return False
+        # only swap the buffers, module.to_empty() would also wipe the parameters assigned from the file
+        for name in meta_buffers:
+            module._buffers[name] = torch.empty_like(module._buffers[name], device="cpu")
+        init_buffers()
+    return not any(t.is_meta for t in itertools.chain(model.parameters(), model.buffers()))
+
+
+def load_model(weights_file, device):
+    state_dict = load_state_dict(weights_file)
+    # build the module skeleton without allocating or randomly initializing weights,
+    # then adopt the mmapped tensors as the parameters (assign=True, no copy)
+    with torch.device("meta"):
+        model = get_model()
+    model.load_state_dict(state_dict, assign=True)
+    if not _materialize_meta_buffers(model):
+        logging.warning("Tagger model has buffers that can't be built on the meta device, using regular init")
+        model = get_model()
+        model.load_state_dict(state_dict, assign=True)
     model.to(device)
     model.eval()
     return model
 
 
+def quantize_linear_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Dynamic int8 quantization of the Linear layers (MLPs, attention projections and the tagging head), CPU only.
+    The fused attention qkv Linear is skipped because EVA reads its .weight directly.
+    """
+    from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+    qconfig_spec = {
+        name: default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and not name.endswith("qkv")
+    }
+    return quantize_dynamic(model, qconfig_spec, dtype=torch.qint8)
+
+
 def pure_pil_alpha_to_color_v2(image: Image.Image, color: tuple[int, int, int] = (255, 255, 255)) -> Image.Image:
     """
     Convert a PIL image with an alpha channel to a RGB image.
@@ -103,21 +160,207 @@ def pil_to_rgb(image: Image.Image) -> Image.Image:
     return image
 
 
+def preprocess_tensor(images: torch.Tensor, size: int = 448) -> torch.Tensor:
+    """
+    Convert a ComfyUI IMAGE batch (B, H, W, C floats in 0..1) to normalized model input (B, 3, size, size).
+    Same steps as the PIL transform (alpha onto white, antialiased bilinear resize, normalize to -1..1)
+    but done on the tensor's own device without a uint8 round-trip.
+    """
+    channels = images.shape[-1]
+    if channels == 4:
+        alpha = images[..., 3:]
+        images = images[..., :3] * alpha + (1.0 - alpha)
+    elif channels == 1:
+        images = images.expand(-1, -1, -1, 3)
+    elif channels != 3:
+        raise ValueError(f"Expected an image with 1, 3 or 4 channels, got {channels}")
+
+    # BHWC -> BCHW is a view, interpolate writes the only full copy
+    images = images.movedim(-1, 1)
+    images = torch.nn.functional.interpolate(
+        images, size=(size, size), mode="bilinear", antialias=True, align_corners=False
+    )
+    return images.clamp_(0.0, 1.0).sub_(0.5).div_(0.5)
+
+
+TILE_MERGE_MODES = ("max", "mean")
+
+
+def tile_boxes(height: int, width: int, max_tiles: int, overlap: float = 0.25) -> list[tuple[int, int, int, int]]:
+    """
+    Overlapping (top, left, bottom, right) crops along the long side of an image, each spanning the whole short side.
+    Crops are square when max_tiles allows it, otherwise they get longer (and are squashed a bit more by the resize).
+    Returns an empty list when a single view covers the image well enough.
+    """
+    short, long = min(height, width), max(height, width)
+    step = 1.0 - overlap
+    count = min(max_tiles, math.ceil((long / short - overlap) / step - 1e-6))
+    if count <= 1:
+        return []
+    crop = min(long, max(short, math.ceil(long / (count * step + overlap))))
+    starts = [round(i * (long - crop) / (count - 1)) for i in range(count)]
+    if height >= width:
+        return [(start, 0, start + crop, width) for start in starts]
+    return [(0, start, height, start + crop) for start in starts]
+
+
+def tile_views(height: int, width: int, max_tiles: int) -> int:
+    """Number of views tiled_inputs makes of an image of this size, the whole image included."""
+    return 1 + len(tile_boxes(height, width, max_tiles))
+
+
+def tiled_inputs(images: torch.Tensor, max_tiles: int, size: int = 448) -> tuple[torch.Tensor, int]:
+    """
+    Model input for a ComfyUI IMAGE batch (B, H, W, C) as the whole (squashed) image plus aspect preserving tiles.
+    Returns (B * views, 3, size, size) with the views of one image next to each other, and the number of views.
+    """
+    batch = images.shape[0]
+    views = [preprocess_tensor(images, size)]
+    for top, left, bottom, right in tile_boxes(images.shape[1], images.shape[2], max_tiles):
+        views.append(preprocess_tensor(images[:, top:bottom, left:right], size))
+    return torch.stack(views, dim=1).reshape(batch * len(views), *views[0].shape[1:]), len(views)
+
+
+def merge_views(
+    probs: torch.Tensor, embeddings: Optional[torch.Tensor], views: int, merge: str = "max"
+) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """Per image probabilities from tiled_inputs results, the embedding is the whole image view's."""
+    if merge not in TILE_MERGE_MODES:
+        raise ValueError(f"Unknown tile merge mode '{merge}', expected one of {TILE_MERGE_MODES}")
+    probs = probs.reshape(-1, views, probs.shape[-1])
+    probs = probs.amax(dim=1) if merge == "max" else probs.mean(dim=1)
+    if embeddings is not None:
+        embeddings = embeddings.reshape(-1, views, embeddings.shape[-1])[:, 0]
+    return probs, embeddings
+
+
 class EndpointHandler:
-    def __init__(self, weights_file: str, tags_file: str, mapping_file: str):
+    PRECISIONS = ("fp32", "bf16", "int8")
+    # torch intra-op threads of predict calls that don't ask for a count, 0 = torch's default
+    num_threads = 0
+
+    def __init__(
+        self,
+        weights_file: str,
+        tags_file: str,
+        mapping_file: str,
+        precision: str = "fp32",
+        compile_model: bool = False,
+        num_threads: int = 0,
+        channels_last: bool = False,
+    ):
+        """
+        precision: "fp32", "bf16" (autocast) or "int8" (dynamic quantization of Linear layers, runs on CPU).
+        compile_model: wrap the model with torch.compile, falls back to eager if compiling fails.
+        num_threads: intra-op thread count, 0 = torch's default. It's process wide, so it's (re)applied
+            on every predict call, which can also ask for its own count.
+        channels_last: use channels_last memory format for the model input and conv weights.
+        """
+        weights_path = self._check_files(weights_file, tags_file, mapping_file)
+
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {self.PRECISIONS}")
+        self.num_threads = num_threads
+
+        self.weights_file = str(weights_path)
+        self.precision = precision
+        self.channels_last = channels_last
+        # quantized kernels only exist for CPU
+        self.device = "cuda" if torch.cuda.is_available() and precision != "int8" else "cpu"
+        self.model = load_model(str(weights_path), self.device)
+        if precision == "int8":
+            self.model = quantize_linear_int8(self.model)
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        self._compiled = compile_model
+        self._eager_model = self.model
+        if compile_model:
+            # only the encoder, the head is a single Linear and stays addressable for embeddings/pruning
+            encoder, decoder = self.model
+            self.model = torch.nn.Sequential(torch.compile(encoder), decoder)
+
+        self._init_common(tags_file, mapping_file)
+
+    MAX_PRUNED_HEADS = 8
+
+    def pruned(self, allow_list: Iterable[str]) -> "EndpointHandler":
+        """
+        Handler that only computes and reports the allow-listed tags.
+
+        The tagging head's Linear is sliced down to the kept rows, so head compute, memory and
+        post-processing scale with the allow-list. Probabilities of kept tags are the same as with
+        the full head. Shares the encoder with this handler and is cached per allow-list.
+        """
+        indices = self.vocabulary.indices_for(allow_list)
+        if len(indices) == 0:
+            raise ValueError("None of the allow-listed tags are in the tagger vocabulary")
+        prune_key = hashlib.blake2b(indices.tobytes(), digest_size=8).hexdigest()
+
+        cached = self._pruned_heads.get(prune_key)
+        if cached is not None:
+            self._pruned_heads.move_to_end(prune_key)
+            return cached
+
+        view = copy.copy(self)
+        view._pruned_heads = OrderedDict()
+        view.vocabulary = self.vocabulary.subset(indices)
+        view.gen_tag_count = view.vocabulary.gen_tag_count
+        view.character_tag_count = len(indices) - view.gen_tag_count
+        view.index_to_tag_map = dict(enumerate(view.vocabulary.tag_names.tolist()))
+        view.cache_variant = f"{self.cache_variant}-pruned{prune_key}"
+        view._prune_model(indices)
+        logging.info(f"Built pruned tagger head with {len(indices)} tags")
+
+        self._pruned_heads[prune_key] = view
+        while len(self._pruned_heads) > self.MAX_PRUNED_HEADS:
+            self._pruned_heads.popitem(last=False)
+        return view
+
+    def _prune_model(self, indices: np.ndarray):
+        encoder, decoder = self._eager_model
+        head = decoder.head[0]
+        if isinstance(head, torch.nn.Linear):
+            weight, bias = head.weight, head.bias
+        else:  # int8 dynamically quantized Linear
+            weight, bias = head.weight().dequantize(), head.bias()
+
+        index = torch.from_numpy(indices).to(weight.device)
+        pruned_decoder = TaggingHead(decoder.input_dim, len(indices)).to(weight.device)
+        with torch.no_grad():
+            pruned_decoder.head[0].weight.copy_(weight.index_select(0, index))
+            pruned_decoder.head[0].bias.copy_(bias.index_select(0, index))
+        pruned_decoder.eval()
+        if self.precision == "int8":
+            pruned_decoder = quantize_linear_int8(pruned_decoder)
+            if not isinstance(head, torch.nn.Linear):
+                # keep the original quantized rows and scale, requantizing would shift the kept tags' scores
+                pruned_decoder.head[0].set_weight_bias(
+                    head.weight().index_select(0, index), bias.index_select(0, index)
+                )
+
+        # the pruned model isn't compiled, compiling per allow-list would cost more than it saves
+        self.model = torch.nn.Sequential(encoder, pruned_decoder)
+        self._eager_model = self.model
+        self._compiled = False
+
+    def model_nbytes(self) -> int:
+        """Approximate memory held by the model weights."""
+        tensors = itertools.chain(self.model.parameters(), self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    @staticmethod
+    def _check_files(weights_file: str, tags_file: str, mapping_file: str) -> Path:
         weights_path = Path(weights_file)
-        tags_path = Path(tags_file)
-        mapping_path = Path(mapping_file)
-
         if not weights_path.exists():
             raise FileNotFoundError(f"Model file not found: {weights_path}")
-        if not tags_path.exists():
-            raise FileNotFoundError(f"Tags file not found: {tags_path}")
-        if not mapping_path.exists():
-            raise FileNotFoundError(f"Mapping file not found: {mapping_path}")
-
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = load_model(str(weights_path), self.device)
+        if not Path(tags_file).exists():
+            raise FileNotFoundError(f"Tags file not found: {tags_file}")
+        if not Path(mapping_file).exists():
+            raise FileNotFoundError(f"Mapping file not found: {mapping_file}")
+        return weights_path
+
+    def _init_common(self, tags_file: str, mapping_file: str):
+        """Backend independent setup: PIL transform, defaults and tag tables."""
         self.transform = transforms.Compose(
             [
                 transforms.Resize((448, 448)),
@@ -129,9 +372,13 @@ class EndpointHandler:
         self.default_general_threshold = 0.3
         self.default_character_threshold = 0.85
 
-        tag_map, self.gen_tag_count, self.character_tag_count = get_tags(tags_path)
+        tag_map, self.gen_tag_count, self.character_tag_count = get_tags(Path(tags_file))
         self.index_to_tag_map = {v: k for k, v in tag_map.items()}
-        self.character_ip_mapping = get_character_ip_mapping(mapping_path)
+        self.character_ip_mapping = get_character_ip_mapping(Path(mapping_file))
+        self.vocabulary = TagVocabulary.from_maps(self.index_to_tag_map, self.gen_tag_count, self.character_ip_mapping)
+        # result cache key suffix for anything besides weights/precision that changes the model output
+        self.cache_variant = ""
+        self._pruned_heads: "OrderedDict[str, EndpointHandler]" = OrderedDict()
 
     def __call__(self, data: dict[str, Any]) -> dict[str, Any]:
         inputs = data.pop("inputs", data)
@@ -155,57 +402,167 @@ class EndpointHandler:
         general_threshold = parameters.pop("general_threshold", self.default_general_threshold)
         character_threshold = parameters.pop("character_threshold", self.default_character_threshold)
 
+        results = self.tag_batch([image], general_threshold, character_threshold)
+        logging.info(f"Timing - Fetch: {fetch_time:.3f}s")
+        return results[0]
+
+    def tag_batch(
+        self,
+        images: list[Image.Image],
+        general_threshold: float,
+        character_threshold: float,
+        batch_size: int = 8,
+    ) -> list[dict[str, Any]]:
+        """Tags a list of PIL images (the URL/base64 path), returns one {"feature", "character", "ip"} dict per image."""
         inference_start_time = time.time()
-        with torch.inference_mode():
-            # Preprocess image on CPU, then pin memory for faster async transfer
-            image_tensor = self.transform(image).unsqueeze(0).pin_memory()
-
-            # Asynchronously move image to GPU
-            image_tensor = image_tensor.to(self.device, non_blocking=True)
-
-            # Run model on GPU
-            probs = self.model(image_tensor)[0]  # Get probs for the single image
-
-            # Perform thresholding directly on the GPU
-            general_mask = probs[: self.gen_tag_count] > general_threshold
-            character_mask = probs[self.gen_tag_count :] > character_threshold
-
-            # Get the indices of positive tags on the GPU
-            general_indices = general_mask.nonzero(as_tuple=True)[0]
-            character_indices = character_mask.nonzero(as_tuple=True)[0] + self.gen_tag_count
+        image_tensor = torch.stack([self.transform(image if image.mode == "RGB" else pil_to_rgb(image)) for image in images])
+        probs = self.predict_probs(image_tensor, batch_size)
+        inference_time = time.time() - inference_start_time
 
-            # Combine indices and move the small result tensor to the CPU
-            combined_indices = torch.cat((general_indices, character_indices)).cpu()
+        post_process_start_time = time.time()
+        results = self.postprocess(probs, general_threshold, character_threshold)
+        post_process_time = time.time() - post_process_start_time
 
+        logging.info(
+            f"Timing ({len(images)} images) - Inference: {inference_time:.3f}s, Post-process: {post_process_time:.3f}s, Total: {inference_time + post_process_time:.3f}s"
+        )
+        return results
+
+    def tag_tensor_batch(
+        self,
+        images: torch.Tensor,
+        general_threshold: float,
+        character_threshold: float,
+        batch_size: int = 8,
+    ) -> list[dict[str, Any]]:
+        """Tags a ComfyUI IMAGE batch (B, H, W, C) directly, without going through PIL."""
+        inference_start_time = time.time()
+        probs = self.predict_probs_from_images(images, batch_size)
         inference_time = time.time() - inference_start_time
 
         post_process_start_time = time.time()
-
-        cur_gen_tags = []
-        cur_char_tags = []
-
-        # Use the efficient pre-computed map for lookups
-        for i in combined_indices:
-            idx = i.item()
-            tag = self.index_to_tag_map[idx]
-            if idx < self.gen_tag_count:
-                cur_gen_tags.append(tag)
-            else:
-                cur_char_tags.append(tag)
-
-        ip_tags = []
-        for tag in cur_char_tags:
-            if tag in self.character_ip_mapping:
-                ip_tags.extend(self.character_ip_mapping[tag])
-        ip_tags = sorted(set(ip_tags))
+        results = self.postprocess(probs, general_threshold, character_threshold)
         post_process_time = time.time() - post_process_start_time
 
         logging.info(
-            f"Timing - Fetch: {fetch_time:.3f}s, Inference: {inference_time:.3f}s, Post-process: {post_process_time:.3f}s, Total: {fetch_time + inference_time + post_process_time:.3f}s"
+            f"Timing ({images.shape[0]} images) - Preprocess + Inference: {inference_time:.3f}s, Post-process: {post_process_time:.3f}s, Total: {inference_time + post_process_time:.3f}s"
         )
-
-        return {
-            "feature": cur_gen_tags,
-            "character": cur_char_tags,
-            "ip": ip_tags,
-        }
+        return results
+
+    # pooled encoder features are available from this backend
+    supports_embeddings = True
+    # requests can be merged into shared batches by the tagger service
+    batchable = True
+
+    def predict_probs(self, image_tensor: torch.Tensor, batch_size: int = 8) -> torch.Tensor:
+        """Runs preprocessed images (B, 3, 448, 448) through the model in mini-batches.
+
+        Returns the sigmoid probabilities of all tags as a (B, num_tags) CPU tensor.
+        """
+        return self.predict(image_tensor, batch_size)[0]
+
+    def predict_probs_from_images(self, images: torch.Tensor, batch_size: int = 8) -> torch.Tensor:
+        """Like predict_probs but for raw ComfyUI IMAGE batches (B, H, W, C)."""
+        return self.predict_from_images(images, batch_size)[0]
+
+    def predict(
+        self, image_tensor: torch.Tensor, batch_size: int = 8, num_threads: int = 0
+    ) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        predict_probs that also returns the pooled encoder embeddings (B, 1024), None if the backend has none.
+        num_threads: torch intra-op threads for this call, 0 = the handler's num_threads.
+        """
+        batch_size = max(1, int(batch_size))
+        chunks = (
+            self._to_device(image_tensor[start : start + batch_size])
+            for start in range(0, image_tensor.shape[0], batch_size)
+        )
+        return self._run_chunks(chunks, num_threads)
+
+    def predict_from_images(
+        self, images: torch.Tensor, batch_size: int = 8, num_threads: int = 0
+    ) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        predict for raw ComfyUI IMAGE batches (B, H, W, C).
+
+        Each mini-batch is moved to the model device first and resized there, so only
+        one mini-batch of full-resolution images is ever copied at a time.
+        """
+        return self._run_chunks(self.preprocess_chunks(images, batch_size), num_threads)
+
+    def preprocess_chunks(self, images: torch.Tensor, batch_size: int = 8) -> Iterator[torch.Tensor]:
+        """Model input (b, 3, 448, 448) of an IMAGE batch, one mini-batch at a time, resized on the model device."""
+        batch_size = max(1, int(batch_size))
+        for start in range(0, images.shape[0], batch_size):
+            yield preprocess_tensor(self._to_device(images[start : start + batch_size].float()))
+
+    def predict_tiled_from_images(
+        self, images: torch.Tensor, batch_size: int = 8, max_tiles: int = 4, merge: str = "max", num_threads: int = 0
+    ) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        predict_from_images for tall/wide images: the whole image and up to max_tiles aspect preserving crops
+        go through the model in one batch, the tag probabilities of the views are merged by max or mean.
+        """
+        views = tile_views(images.shape[1], images.shape[2], max_tiles)
+        probs, embeddings = self._run_chunks(self.tiled_chunks(images, batch_size, max_tiles), num_threads)
+        return merge_views(probs, embeddings, views, merge)
+
+    def tiled_chunks(self, images: torch.Tensor, batch_size: int = 8, max_tiles: int = 4) -> Iterator[torch.Tensor]:
+        """
+        tiled_inputs of an IMAGE batch like preprocess_chunks: a few images at a time, cropped and resized
+        on the model device, so a chunk holds about batch_size views.
+        """
+        per_chunk = max(1, int(batch_size) // tile_views(images.shape[1], images.shape[2], max_tiles))
+        for start in range(0, images.shape[0], per_chunk):
+            yield tiled_inputs(self._to_device(images[start : start + per_chunk].float()), max_tiles)[0]
+
+    def _run_chunks(
+        self, chunks: Iterable[torch.Tensor], num_threads: int = 0
+    ) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+        num_threads = num_threads or self.num_threads or DEFAULT_NUM_THREADS
+        if torch.get_num_threads() != num_threads:
+            torch.set_num_threads(num_threads)
+        probs, embeddings = [], []
+        with torch.inference_mode():
+            for chunk in chunks:
+                chunk_probs, chunk_embeddings = self._forward(chunk)
+                probs.append(chunk_probs)
+                embeddings.append(chunk_embeddings)
+        if any(e is None for e in embeddings):
+            return torch.cat(probs), None
+        return torch.cat(probs), torch.cat(embeddings)
+
+    def _to_device(self, chunk: torch.Tensor) -> torch.Tensor:
+        if self.device == "cuda" and chunk.device.type != "cuda":
+            # pin memory for faster async transfer, pinning is only useful (and possible) with CUDA
+            return chunk.contiguous().pin_memory().to(self.device, non_blocking=True)
+        return chunk
+
+    def _forward(self, chunk: torch.Tensor) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """Runs one preprocessed mini-batch on the model device, returns float32 probs and embeddings on the CPU."""
+        if self.channels_last:
+            chunk = chunk.contiguous(memory_format=torch.channels_last)
+        with torch.autocast(device_type=self.device, dtype=torch.bfloat16, enabled=self.precision == "bf16"):
+            try:
+                embeddings = self.model[0](chunk)
+            except Exception as e:
+                if not self._compiled:
+                    raise
+                # compile errors only show up on the first call
+                logging.warning(f"torch.compile failed for the tagger model, using eager mode: {e}")
+                self._compiled = False
+                self.model = self._eager_model
+                embeddings = self.model[0](chunk)
+            probs = self.model[1](embeddings)
+        return probs.float().cpu(), embeddings.float().cpu()
+
+    def postprocess(
+        self,
+        probs: torch.Tensor,
+        general_threshold: float,
+        character_threshold: float,
+        top_k: int = 0,
+        sort_by: str = "alphabetical",
+    ) -> list[dict[str, Any]]:
+        """Thresholds a (B, num_tags) probability tensor and maps the positive indices to tag names."""
+        return self.vocabulary.postprocess(probs, general_threshold, character_threshold, top_k, sort_by)
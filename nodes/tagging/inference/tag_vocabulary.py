@@ -0,0 +1,194 @@
+import logging
+from typing import Any, Iterable
+
+import numpy as np
+import torch
+
+
+class TagVocabulary:
+    """
+    Array based tag tables for vectorized post-processing.
+
+    tag_names: object array, position = model output index
+    gen_tag_count: outputs before this index are general tags, the rest are character tags
+    ip_indptr/ip_indices: CSR mapping of character position (index - gen_tag_count) to positions in ip_names
+    """
+
+    SORT_MODES = ("alphabetical", "confidence")
+
+    def __init__(
+        self,
+        tag_names: np.ndarray,
+        gen_tag_count: int,
+        ip_names: np.ndarray,
+        ip_indptr: np.ndarray,
+        ip_indices: np.ndarray,
+    ):
+        self.tag_names = tag_names
+        self.gen_tag_count = gen_tag_count
+        self.ip_names = ip_names
+        self.ip_indptr = ip_indptr
+        self.ip_indices = ip_indices
+        # alphabetical rank of every tag/ip so sorting by name is an integer sort
+        self.tag_rank = np.argsort(np.argsort(tag_names.astype(str), kind="stable"), kind="stable")
+        self.ip_rank = np.argsort(np.argsort(ip_names.astype(str), kind="stable"), kind="stable")
+
+    def __len__(self):
+        return len(self.tag_names)
+
+    @staticmethod
+    def normalize_tag(tag: str) -> str:
+        """'blue hair', 'blue_hair' and 'hat \\(object\\)' style input to the model's tag format."""
+        return tag.strip().replace("\\", "").replace(" ", "_")
+
+    def indices_for(self, tags: Iterable[str]) -> np.ndarray:
+        """Sorted unique output positions of the given tag names, unknown names are logged and skipped."""
+        if not hasattr(self, "_positions"):
+            self._positions = {name: i for i, name in enumerate(self.tag_names)}
+        indices = set()
+        unknown = []
+        for tag in tags:
+            tag = self.normalize_tag(tag)
+            if not tag:
+                continue
+            if tag in self._positions:
+                indices.add(self._positions[tag])
+            else:
+                unknown.append(tag)
+        if unknown:
+            logging.warning(f"Tags not in the tagger vocabulary: {', '.join(unknown[:20])}")
+        return np.array(sorted(indices), dtype=np.int64)
+
+    def subset(self, indices: np.ndarray) -> "TagVocabulary":
+        """Vocabulary of only the given sorted output positions, position i of the subset = indices[i]."""
+        char_positions = indices[indices >= self.gen_tag_count] - self.gen_tag_count
+        starts = self.ip_indptr[char_positions]
+        lengths = self.ip_indptr[char_positions + 1] - starts
+        total = int(lengths.sum())
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return TagVocabulary(
+            self.tag_names[indices],
+            int((indices < self.gen_tag_count).sum()),
+            self.ip_names,
+            np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+            self.ip_indices[offsets + np.arange(total)],
+        )
+
+    @classmethod
+    def from_maps(
+        cls, index_to_tag_map: dict[int, str], gen_tag_count: int, character_ip_mapping: dict[str, list[str]]
+    ) -> "TagVocabulary":
+        num_tags = max(index_to_tag_map) + 1
+        tag_names = np.empty(num_tags, dtype=object)
+        tag_names[:] = ""
+        for idx, tag in index_to_tag_map.items():
+            tag_names[idx] = tag
+
+        ip_names = sorted({ip for ips in character_ip_mapping.values() for ip in ips})
+        ip_positions = {ip: i for i, ip in enumerate(ip_names)}
+        ip_indptr = np.zeros(num_tags - gen_tag_count + 1, dtype=np.int64)
+        ip_indices = []
+        for char_pos, tag in enumerate(tag_names[gen_tag_count:]):
+            ips = character_ip_mapping.get(tag, [])
+            ip_indices.extend(ip_positions[ip] for ip in ips)
+            ip_indptr[char_pos + 1] = len(ip_indices)
+
+        return cls(
+            tag_names,
+            gen_tag_count,
+            np.array(ip_names, dtype=object),
+            ip_indptr,
+            np.array(ip_indices, dtype=np.int64),
+        )
+
+    def _top_k_mask(self, masked_probs: np.ndarray, top_k: int) -> np.ndarray:
+        """Mask of the top_k highest entries per row, masked_probs has -inf where tags are below the threshold."""
+        if top_k >= masked_probs.shape[1]:
+            return np.ones(masked_probs.shape, dtype=bool)
+        top = np.argpartition(-masked_probs, top_k - 1, axis=1)[:, :top_k]
+        mask = np.zeros(masked_probs.shape, dtype=bool)
+        np.put_along_axis(mask, top, True, axis=1)
+        return mask
+
+    def _ips_for(self, char_positions: np.ndarray, char_conf: np.ndarray, sort_by: str):
+        """IP names (deduplicated, confidence = best matching character) for a set of character positions."""
+        starts = self.ip_indptr[char_positions]
+        lengths = self.ip_indptr[char_positions + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return [], []
+        # concatenated ranges starts[i]..starts[i]+lengths[i] without a python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        ip_ids = self.ip_indices[offsets + np.arange(total)]
+        ip_conf = np.repeat(char_conf, lengths)
+
+        # keep the highest confidence per ip
+        order = np.lexsort((-ip_conf, ip_ids))
+        ip_ids, ip_conf = ip_ids[order], ip_conf[order]
+        first = np.concatenate(([True], ip_ids[1:] != ip_ids[:-1]))
+        ip_ids, ip_conf = ip_ids[first], ip_conf[first]
+
+        order = np.argsort(-ip_conf, kind="stable") if sort_by == "confidence" else np.argsort(self.ip_rank[ip_ids])
+        return self.ip_names[ip_ids[order]].tolist(), ip_conf[order].tolist()
+
+    def postprocess(
+        self,
+        probs: Any,
+        general_threshold: float,
+        character_threshold: float,
+        top_k: int = 0,
+        sort_by: str = "alphabetical",
+    ) -> list[dict[str, Any]]:
+        """
+        Threshold a (B, num_tags) probability array and map the positives to names.
+
+        top_k > 0 keeps only the k most confident general and k most confident character tags per image.
+        Tags are ordered alphabetically or by descending confidence (sort_by, one of SORT_MODES).
+        Returns per image {"feature", "character", "ip"} name lists and a "confidence" dict of the same keys.
+        """
+        if sort_by not in self.SORT_MODES:
+            raise ValueError(f"Unknown sort_by '{sort_by}', expected one of {self.SORT_MODES}")
+        if isinstance(probs, torch.Tensor):
+            probs = probs.numpy()
+        probs = np.asarray(probs, dtype=np.float32)
+        gen = self.gen_tag_count
+
+        thresholds = np.empty(probs.shape[1], dtype=np.float32)
+        thresholds[:gen] = general_threshold
+        thresholds[gen:] = character_threshold
+        mask = probs > thresholds
+
+        if top_k > 0:
+            masked_probs = np.where(mask, probs, -np.inf)
+            mask[:, :gen] &= self._top_k_mask(masked_probs[:, :gen], top_k)
+            mask[:, gen:] &= self._top_k_mask(masked_probs[:, gen:], top_k)
+
+        rows, cols = np.nonzero(mask)
+        conf = probs[rows, cols]
+        if sort_by == "confidence":
+            order = np.lexsort((-conf, rows))
+        else:
+            order = np.lexsort((self.tag_rank[cols], rows))
+        cols, conf = cols[order], conf[order]
+        splits = np.cumsum(mask.sum(axis=1))[:-1]
+
+        results = []
+        for image_cols, image_conf in zip(np.split(cols, splits), np.split(conf, splits)):
+            is_general = image_cols < gen
+            names = self.tag_names[image_cols]
+            general_names, general_conf = names[is_general].tolist(), image_conf[is_general].tolist()
+            char_names, char_conf = names[~is_general].tolist(), image_conf[~is_general].tolist()
+            ip_names, ip_conf = self._ips_for(image_cols[~is_general] - gen, image_conf[~is_general], sort_by)
+            results.append(
+                {
+                    "feature": general_names,
+                    "character": char_names,
+                    "ip": ip_names,
+                    "confidence": {
+                        "feature": dict(zip(general_names, general_conf)),
+                        "character": dict(zip(char_names, char_conf)),
+                        "ip": dict(zip(ip_names, ip_conf)),
+                    },
+                }
+            )
+        return results
@@ -0,0 +1,262 @@
+import concurrent.futures
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from .inference.pixai_tagger_onnx import INT8_SUFFIX, OnnxEndpointHandler
+from .inference.pixai_tagger_pth_sft import EndpointHandler
+from .worker_pool import RemoteHandler, worker_pool
+
+MODELS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "models"))
+
+# RAM budget for loaded tagger models, least recently used ones are dropped when it's exceeded.
+# The most recently used model always stays loaded even if it alone is over budget.
+CACHE_BUDGET_MB = int(os.environ.get("BTK_TAGGER_CACHE_MB", "4096"))
+# Comma separated model labels (e.g. "pixai-tagger-v0.9/model.safetensors") or "*" for every model,
+# loaded in a background thread when ComfyUI starts. Empty = load on first use.
+PRELOAD_MODELS = os.environ.get("BTK_TAGGER_PRELOAD", "")
+
+WEIGHTS_EXTENSIONS = (".pt", ".pth", ".safetensors", ".sft")
+
+# EndpointHandler option defaults, filled in before building cache keys so a request that leaves
+# options out (preload, the HTTP route) finds the handler loaded by one that spells them out
+HANDLER_DEFAULTS = {"precision": "fp32", "compile_model": False, "num_threads": 0, "channels_last": False}
+
+
+def _scan_model_folder(folder: str, folder_path: str) -> Optional[Dict[str, str]]:
+    """Look for a weights file, tags json, and mapping json in one model folder.
+
+    An exported model.onnx / model.int8.onnx next to the weights is picked up as well,
+    a folder with only an .onnx file and the jsons is also a valid model.
+    """
+    weights = None
+    onnx = None
+    onnx_int8 = None
+    tags = None
+    mapping = None
+    for f in os.listdir(folder_path):
+        if f.lower().endswith(WEIGHTS_EXTENSIONS):
+            weights = f
+        elif f.lower().endswith(INT8_SUFFIX):
+            onnx_int8 = f
+        elif f.lower().endswith(".onnx") and not f.lower().endswith(".prep.onnx"):
+            onnx = f
+        elif f.lower().startswith("tags_") and f.lower().endswith(".json"):
+            tags = f
+        elif f.lower().startswith("char_ip_map") and f.lower().endswith(".json"):
+            mapping = f
+    if not ((weights or onnx or onnx_int8) and tags and mapping):
+        return None
+    # Show as folder/model.pth
+    return {
+        "label": f"{folder}/{weights or onnx or onnx_int8}",
+        "weights": os.path.join(folder_path, weights) if weights else "",
+        "onnx": os.path.join(folder_path, onnx) if onnx else "",
+        "onnx_int8": os.path.join(folder_path, onnx_int8) if onnx_int8 else "",
+        "tags": os.path.join(folder_path, tags),
+        "mapping": os.path.join(folder_path, mapping),
+    }
+
+
+class ModelIndex:
+    """
+    Cached view of the models directory.
+
+    The root folder is only listed again when its mtime changes (folder added/removed)
+    and a model folder only when its own mtime changes (file added/removed/renamed),
+    so repeated lookups cost one stat() per folder instead of a full walk.
+    """
+
+    def __init__(self, models_dir: str):
+        self.models_dir = models_dir
+        self._lock = threading.Lock()
+        self._root_mtime: Optional[int] = None
+        self._missing_logged = False
+        self._folder_names: List[str] = []
+        # folder -> (mtime_ns, model info or None)
+        self._folders: Dict[str, Tuple[int, Optional[Dict[str, str]]]] = {}
+
+    def get_models(self) -> List[Dict[str, str]]:
+        with self._lock:
+            try:
+                root_mtime = os.stat(self.models_dir).st_mtime_ns
+            except OSError:
+                if not self._missing_logged:
+                    logging.warning(f"Models directory not found: {self.models_dir}")
+                    self._missing_logged = True
+                self._root_mtime = None
+                self._folder_names = []
+                self._folders.clear()
+                return []
+
+            self._missing_logged = False
+            if root_mtime != self._root_mtime:
+                self._root_mtime = root_mtime
+                self._folder_names = sorted(os.listdir(self.models_dir))
+
+            models = []
+            seen = set()
+            for folder in self._folder_names:
+                folder_path = os.path.join(self.models_dir, folder)
+                try:
+                    folder_stat = os.stat(folder_path)
+                except OSError:
+                    continue
+                if not os.path.isdir(folder_path):
+                    continue
+                seen.add(folder)
+                cached = self._folders.get(folder)
+                if cached is None or cached[0] != folder_stat.st_mtime_ns:
+                    cached = (folder_stat.st_mtime_ns, _scan_model_folder(folder, folder_path))
+                    self._folders[folder] = cached
+                if cached[1] is not None:
+                    models.append(cached[1])
+
+            for folder in set(self._folders) - seen:
+                del self._folders[folder]
+            return models
+
+    def get_model(self, label: str) -> Optional[Dict[str, str]]:
+        return next((m for m in self.get_models() if m["label"] == label), None)
+
+
+class ModelManager:
+    """
+    Loads tagger handlers on demand and keeps them in an LRU cache bounded by a RAM budget.
+    """
+
+    def __init__(self, index: ModelIndex, budget_mb: int = CACHE_BUDGET_MB):
+        self.index = index
+        self.budget_bytes = max(0, budget_mb) * 1024 * 1024
+        self._lock = threading.RLock()
+        # (weights path, handler options) -> (handler, size in bytes)
+        self._handlers: "OrderedDict[Tuple, Tuple[EndpointHandler, int]]" = OrderedDict()
+        # cache key -> future of a load in progress
+        self._loading: Dict[Tuple, concurrent.futures.Future] = {}
+
+    @staticmethod
+    def resolve_backend(model_info: Dict[str, str], backend: str) -> str:
+        """'auto' picks onnx when an exported model exists next to the weights."""
+        if backend == "auto":
+            return "onnx" if model_info.get("onnx") or model_info.get("onnx_int8") else "pytorch"
+        return backend
+
+    def get_handler(self, model_info: Dict[str, str], backend: str = "pytorch", **options) -> EndpointHandler:
+        """
+        Return the cached handler for a model from the index, loading it (and evicting others) if needed.
+        options are passed to EndpointHandler (precision, compile_model, ...), missing ones take their defaults.
+        Each combination is cached separately, except for the PyTorch thread count: it's process wide and
+        passed with each predict call instead (see run_tagger), the cached handler isn't changed.
+        """
+        backend = self.resolve_backend(model_info, backend)
+        requested_options = options = {**HANDLER_DEFAULTS, **options}
+        if backend == "onnx":
+            # onnxruntime's thread count belongs to the session, it stays part of the key
+            model_file, options = self._onnx_file_and_options(model_info, options)
+        else:
+            model_file = model_info["weights"]
+            if not model_file:
+                raise FileNotFoundError(f"{model_info['label']} has no PyTorch weights, only an ONNX export")
+            # torch's thread count is process wide, set per predict call instead of loading another copy
+            options = {k: v for k, v in options.items() if k != "num_threads"}
+
+        cache_key = (model_file, tuple(sorted(options.items())))
+        return self._get_or_load(cache_key, model_info, backend, model_file, options, requested_options)
+
+    def _get_or_load(
+        self,
+        cache_key: Tuple,
+        model_info: Dict[str, str],
+        backend: str,
+        model_file: str,
+        options: Dict,
+        requested_options: Dict,
+    ) -> EndpointHandler:
+        with self._lock:
+            cached = self._handlers.get(cache_key)
+            if cached is not None:
+                self._handlers.move_to_end(cache_key)
+                return cached[0]
+            # loading takes a while, it runs outside the lock so cached models stay available meanwhile.
+            # A second request for the same model waits for the first load instead of loading it again
+            loading = self._loading.get(cache_key)
+            owner = loading is None
+            if owner:
+                loading = self._loading[cache_key] = concurrent.futures.Future()
+        if not owner:
+            return loading.result()
+
+        try:
+            if worker_pool.enabled:
+                # the model itself is loaded by the worker processes on their first request
+                handler = RemoteHandler(worker_pool, model_info, backend, model_file, requested_options)
+            else:
+                handler_cls = OnnxEndpointHandler if backend == "onnx" else EndpointHandler
+                handler = handler_cls(
+                    model_file, tags_file=model_info["tags"], mapping_file=model_info["mapping"], **options
+                )
+        except BaseException as e:
+            with self._lock:
+                del self._loading[cache_key]
+            loading.set_exception(e)
+            raise
+
+        nbytes = handler.model_nbytes()
+        with self._lock:
+            self._handlers[cache_key] = (handler, nbytes)
+            del self._loading[cache_key]
+            logging.info(f"Loaded model handler for {model_info['label']} ({nbytes / 1024**2:.0f} MB)")
+            self._evict()
+        loading.set_result(handler)
+        return handler
+
+    def _evict(self):
+        total = sum(nbytes for _, nbytes in self._handlers.values())
+        while total > self.budget_bytes and len(self._handlers) > 1:
+            cache_key, (_, nbytes) = self._handlers.popitem(last=False)
+            total -= nbytes
+            logging.info(f"Evicted tagger model {cache_key} from cache ({nbytes / 1024**2:.0f} MB)")
+
+    @staticmethod
+    def _onnx_file_and_options(model_info: Dict[str, str], options: Dict) -> Tuple[str, Dict]:
+        """Pick the fp32 or int8 export for the requested precision, onnxruntime only takes a thread count."""
+        precision = options.get("precision", "fp32")
+        if precision == "int8" and model_info.get("onnx_int8"):
+            onnx_file = model_info["onnx_int8"]
+        else:
+            if precision != "fp32":
+                logging.warning(f"No {precision} ONNX export for {model_info['label']}, using the fp32 one")
+            onnx_file = model_info.get("onnx") or model_info.get("onnx_int8")
+        if not onnx_file:
+            raise FileNotFoundError(f"No ONNX export found for {model_info['label']}")
+        return onnx_file, {"num_threads": options.get("num_threads", 0)}
+
+    def loaded_models(self) -> List[Tuple]:
+        with self._lock:
+            return list(self._handlers)
+
+    def preload(self, labels: List[str]):
+        """Load the given model labels ("*" = all) so the first tagging run doesn't pay the load time."""
+        models = self.index.get_models()
+        if "*" not in labels:
+            models = [m for m in models if m["label"] in labels]
+        for model_info in models:
+            try:
+                self.get_handler(model_info, backend="auto")
+            except Exception as e:
+                logging.error(f"Failed to preload tagger model {model_info['label']}: {e}")
+
+    def start_background_preload(self, labels_setting: str = PRELOAD_MODELS) -> Optional[threading.Thread]:
+        labels = [label.strip() for label in labels_setting.split(",") if label.strip()]
+        if not labels:
+            return None
+        thread = threading.Thread(target=self.preload, args=(labels,), name="btk-tagger-preload", daemon=True)
+        thread.start()
+        return thread
+
+
+model_index = ModelIndex(MODELS_DIR)
+model_manager = ModelManager(model_index)
+model_manager.start_background_preload()
@@ -1,55 +1,27 @@
+import json
 import logging
-import os
 
-import numpy as np
 import torch
-from PIL import Image
 
-from .inference.pixai_tagger_pth_sft import EndpointHandler
+from ..misc.utils import adjust_tags
+from .embedding_index import get_index
+from .model_manager import MODELS_DIR, model_index, model_manager
+from .result_cache import image_hash
+from .tagger_service import run_tagger
 
 # todo: make this like post nodes where theres one central one that can execute evry one of them (might not work? consider RRTagger steps thingy?? idkw hat it does)
 class PixAITaggerNode:
-    MODELS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "models"))
-
-    @classmethod
-    def scan_models(cls):
-        models = []
-        if not os.path.isdir(cls.MODELS_DIR):
-            logging.warning(f"Models directory not found: {cls.MODELS_DIR}")
-            return models
-        for folder in os.listdir(cls.MODELS_DIR):
-            folder_path = os.path.join(cls.MODELS_DIR, folder)
-            if not os.path.isdir(folder_path):
-                continue
-            # Look for .pth file, tags json, and mapping json
-            weights = None
-            tags = None
-            mapping = None
-            for f in os.listdir(folder_path):
-                if f.lower().endswith((".pt", ".pth", ".safetensors", ".sft")):
-                    weights = f
-                elif f.lower().startswith("tags_") and f.lower().endswith(".json"):
-                    tags = f
-                elif f.lower().startswith("char_ip_map") and f.lower().endswith(".json"):
-                    mapping = f
-            if weights and tags and mapping:
-                # Show as folder/model.pth
-                models.append(
-                    {
-                        "label": f"{folder}/{weights}",
-                        "weights": os.path.join(folder_path, weights),
-                        "tags": os.path.join(folder_path, tags),
-                        "mapping": os.path.join(folder_path, mapping),
-                    }
-                )
-        return models
-
     """
     A ComfyUI node that uses the PixAI Tagger model to generate general,
     character, and IP/copyright/franchise tags for a given image.
     """
 
-    _handler_cache = {}
+    MODELS_DIR = MODELS_DIR
+
+    @classmethod
+    def scan_models(cls):
+        # cached, only re-listed when the models folder changes
+        return model_index.get_models()
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -61,68 +33,249 @@ class PixAITaggerNode:
                 "image": ("IMAGE",),
                 "general_threshold": ("FLOAT", {"default": 0.35, "min": 0.0, "max": 1.0, "step": 0.01}),
                 "character_threshold": ("FLOAT", {"default": 0.85, "min": 0.0, "max": 1.0, "step": 0.01}),
-            }
+                "batch_size": (
+                    "INT",
+                    {
+                        "default": 8,
+                        "min": 1,
+                        "max": 128,
+                        "tooltip": "How many images of the input batch go through the model at once. Lower it if you run out of memory",
+                    },
+                ),
+                "top_k": (
+                    "INT",
+                    {
+                        "default": 0,
+                        "min": 0,
+                        "max": 1000,
+                        "tooltip": "Keep only the k most confident general and character tags per image. 0 = no limit",
+                    },
+                ),
+                "sort_by": (
+                    ["alphabetical", "confidence"],
+                    {"default": "alphabetical", "tooltip": "Order of the tags in the outputs"},
+                ),
+                "precision": (
+                    ["fp32", "bf16", "int8"],
+                    {
+                        "default": "fp32",
+                        "tooltip": (
+                            "fp32: reference accuracy. bf16: autocast, faster on CPUs/GPUs with bf16 support.\n"
+                            "int8: dynamic quantization of the linear layers, CPU only, fastest on CPU with a small accuracy loss"
+                        ),
+                    },
+                ),
+                "backend": (
+                    ["auto", "pytorch", "onnx"],
+                    {
+                        "default": "auto",
+                        "tooltip": (
+                            "onnx runs an exported model.onnx through onnxruntime (CPU), usually faster than pytorch on CPU.\n"
+                            "auto uses onnx when an export exists next to the weights. Export with:\n"
+                            "python -m nodes.tagging.inference.pixai_tagger_onnx <weights file>"
+                        ),
+                    },
+                ),
+            },
+            "optional": {
+                "tag_allow_list": (
+                    "STRING",
+                    {
+                        "default": "",
+                        "multiline": True,
+                        "tooltip": (
+                            "Comma separated tags. When set, the model only computes and outputs these tags, "
+                            "which is faster and uses less memory. Leave empty for all tags"
+                        ),
+                    },
+                ),
+                "use_cache": (
+                    "BOOLEAN",
+                    {
+                        "default": True,
+                        "tooltip": (
+                            "Cache the raw model output per image, so changing thresholds or tagging the same image again "
+                            "skips the model entirely"
+                        ),
+                    },
+                ),
+                "torch_compile": (
+                    "BOOLEAN",
+                    {"default": False, "tooltip": "torch.compile the model. First run is slow, later runs are faster"},
+                ),
+                "num_threads": (
+                    "INT",
+                    {
+                        "default": 0,
+                        "min": 0,
+                        "max": 256,
+                        "tooltip": "Intra-op CPU threads for torch (process wide). 0 keeps the default",
+                    },
+                ),
+                "channels_last": (
+                    "BOOLEAN",
+                    {"default": False, "tooltip": "Use channels_last memory format, can be faster on CPU"},
+                ),
+                "max_tiles": (
+                    "INT",
+                    {
+                        "default": 0,
+                        "min": 0,
+                        "max": 16,
+                        "tooltip": (
+                            "For tall/wide images (comic pages, panoramas): also tag up to this many overlapping crops "
+                            "that keep the aspect ratio, all in one batch. 0 = only the whole image squashed to 448x448"
+                        ),
+                    },
+                ),
+                "tile_merge": (
+                    ["max", "mean"],
+                    {
+                        "default": "max",
+                        "tooltip": "How tag confidences of the whole image and the crops are combined",
+                    },
+                ),
+                "embedding_index": (
+                    "STRING",
+                    {
+                        "default": "",
+                        "tooltip": (
+                            "Name of a local embedding index to add the images to, for the Tagger Embedding Search node. "
+                            "Empty = don't store"
+                        ),
+                    },
+                ),
+                "index_keys": (
+                    "STRING",
+                    {
+                        "default": "",
+                        "multiline": True,
+                        "tooltip": (
+                            "One key per line for the images of the batch in the index, e.g. post URLs or IDs. "
+                            "Empty = the image content hash"
+                        ),
+                    },
+                ),
+            },
         }
 
-    RETURN_TYPES = ("STRING", "STRING", "STRING")
-    RETURN_NAMES = ("general_tags", "character_tags", "ip_tags")
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "TAGGER_EMBEDDING")
+    RETURN_NAMES = ("general_tags", "character_tags", "ip_tags", "confidences", "embedding")
+    OUTPUT_TOOLTIPS = (
+        "",
+        "",
+        "",
+        "JSON with the confidence of every output tag, per category",
+        "1024-d image embedding from the tagger encoder, for the Tagger Embedding Search node",
+    )
+    # one entry per image of the input batch
+    OUTPUT_IS_LIST = (True, True, True, True, True)
     FUNCTION = "tag_image"
     CATEGORY = "Tagging"
 
-    def tag_image(self, model: str, image: torch.Tensor, general_threshold: float, character_threshold: float):
+    def tag_image(
+        self,
+        model: str,
+        image: torch.Tensor,
+        general_threshold: float,
+        character_threshold: float,
+        batch_size: int = 8,
+        top_k: int = 0,
+        sort_by: str = "alphabetical",
+        precision: str = "fp32",
+        backend: str = "auto",
+        torch_compile: bool = False,
+        num_threads: int = 0,
+        channels_last: bool = False,
+        use_cache: bool = True,
+        tag_allow_list: str = "",
+        max_tiles: int = 0,
+        tile_merge: str = "max",
+        embedding_index: str = "",
+        index_keys: str = "",
+    ):
+        empty_result = ([""] * image.shape[0],) * 4 + ([None] * image.shape[0],)
+
         # Find model info from scanned models
-        models = self.scan_models()
-        model_info = next((m for m in models if m["label"] == model), None)
+        model_info = model_index.get_model(model)
         if not model_info:
             logging.error(f"Selected model '{model}' not found in available models.")
-            return ("", "", "")
-
-        cache_key = model_info["weights"]
-        handler = self._handler_cache.get(cache_key)
-        if handler is None:
-            try:
-                handler = EndpointHandler(
-                    weights_file=model_info["weights"], tags_file=model_info["tags"], mapping_file=model_info["mapping"]
-                )
-                self._handler_cache[cache_key] = handler
-                logging.info(f"Loaded model handler for {model}")
-            except Exception as e:
-                logging.error(f"Failed to load model handler for {model}: {e}")
-                return ("", "", "")
-
-        # 1. Convert the input tensor (shape: BHWC) to a PIL Image (first one in batch)
-        img_tensor = image[0]
-        i = 255.0 * img_tensor.cpu().numpy()
-        pil_image = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-
-        # 2. Prepare the data payload for the handler
-        data = {
-            "inputs": pil_image,
-            "parameters": {
-                "general_threshold": float(general_threshold),
-                "character_threshold": float(character_threshold),
-            },
-        }
+            return empty_result
 
-        # 3. Run inference using the handler
-        predicted_tags = handler(data)
+        try:
+            handler = model_manager.get_handler(
+                model_info,
+                backend=backend,
+                precision=precision,
+                compile_model=torch_compile,
+                num_threads=num_threads,
+                channels_last=channels_last,
+            )
+        except Exception as e:
+            logging.error(f"Failed to load model handler for {model}: {e}")
+            return empty_result
 
-        # 4. Format the output tags into comma-separated strings
-        general_tags_list = sorted(predicted_tags.get("feature", []))
-        character_tags_list = sorted(predicted_tags.get("character", []))
-        ip_tags_list = sorted(predicted_tags.get("ip", []))
+        if tag_allow_list.strip():
+            handler = handler.pruned(tag_allow_list.split(","))
 
-        # Replace underscores with spaces
-        # todo: make optional
+        # 1. Run batched inference on the input tensor (shape: BHWC) directly, no PIL conversion,
+        # images already seen with this model come from the cache
+        hashes = [image_hash(img) for img in image] if use_cache or embedding_index.strip() else None
+        # runs through the shared service, so concurrent requests for the same model are batched together
+        probs, embeddings = run_tagger(
+            handler,
+            image,
+            batch_size,
+            use_cache=use_cache,
+            hashes=hashes,
+            max_tiles=max_tiles,
+            tile_merge=tile_merge,
+            num_threads=num_threads,
+        )
+        predicted_tags = handler.postprocess(
+            probs, float(general_threshold), float(character_threshold), top_k=top_k, sort_by=sort_by
+        )
+
+        if embedding_index.strip():
+            self._store_embeddings(embedding_index, index_keys, hashes, embeddings, model_info["label"])
+
+        # 2. Format the output tags into comma-separated strings, one per image (already sorted)
+        general_tags, character_tags, ip_tags, confidences = [], [], [], []
+        for tags in predicted_tags:
+            general_tags.append(self._format_tags(tags["feature"]))
+            character_tags.append(self._format_tags(tags["character"]))
+            ip_tags.append(self._format_tags(tags["ip"]))
+            confidences.append(self._format_confidences(tags["confidence"]))
+        embedding_list = list(embeddings) if embeddings is not None else [None] * image.shape[0]
 
-        # todo: use logic from utils
-        general_tags = ", ".join(tag.replace("_", " ") for tag in general_tags_list)
-        character_tags = ", ".join(tag.replace("_", " ") for tag in character_tags_list)
-        ip_tags = ", ".join(tag.replace("_", " ") for tag in ip_tags_list)
+        return (general_tags, character_tags, ip_tags, confidences, embedding_list)
 
-        # Replace parenthesises with escaped versions
-        general_tags = general_tags.replace("(", "\\(").replace(")", "\\)")
-        character_tags = character_tags.replace("(", "\\(").replace(")", "\\)")
-        ip_tags = ip_tags.replace("(", "\\(").replace(")", "\\)")
+    @staticmethod
+    def _store_embeddings(index_name: str, index_keys: str, hashes, embeddings, model_label: str):
+        if embeddings is None:
+            logging.error("This ONNX export has no embedding output, export it again to use an embedding index")
+            return
+        keys = [key.strip() for key in index_keys.splitlines() if key.strip()]
+        if keys and len(keys) != len(hashes):
+            logging.warning(f"Got {len(keys)} index keys for {len(hashes)} images, using image hashes instead")
+            keys = []
+        try:
+            get_index(index_name).add(keys or hashes, embeddings.numpy(), model=model_label)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to add embeddings to index '{index_name}': {e}")
 
-        return (general_tags, character_tags, ip_tags)
+    @staticmethod
+    def _format_tags(tags) -> str:
+        # Replace underscores with spaces and parenthesises with escaped versions
+        # todo: make optional
+        return adjust_tags(", ".join(tags))
+
+    @staticmethod
+    def _format_confidences(confidence) -> str:
+        return json.dumps(
+            {
+                "general": {tag: round(p, 4) for tag, p in confidence["feature"].items()},
+                "character": {tag: round(p, 4) for tag, p in confidence["character"].items()},
+                "ip": {tag: round(p, 4) for tag, p in confidence["ip"].items()},
+            }
+        )
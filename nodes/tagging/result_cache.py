@@ -0,0 +1,259 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from .inference.pixai_tagger_pth_sft import EndpointHandler
+
+CACHE_DIR = os.environ.get(
+    "BTK_TAGGER_CACHE_DIR",
+    os.path.normpath(
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "cache", "tagger_probs")
+    ),
+)
+# raw probability vectors kept in memory (~27 KB each as float16), older ones are spilled to disk
+MEMORY_ENTRIES = int(os.environ.get("BTK_TAGGER_RESULT_CACHE_ENTRIES", "4096"))
+# disk spill limit, oldest files are removed when exceeded. 0 disables the disk cache
+DISK_LIMIT_MB = int(os.environ.get("BTK_TAGGER_RESULT_CACHE_DISK_MB", "1024"))
+
+_HASH_CHUNK = 16 * 1024 * 1024
+# length of the cached encoder embeddings
+_EMBEDDING_SIZE = 1024
+
+
+def _blake2b_file(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_hash(image: torch.Tensor) -> str:
+    """Content hash of one HWC image tensor (values and shape)."""
+    array = image.detach().cpu().contiguous().numpy()
+    digest = hashlib.blake2b(array.data, digest_size=16)
+    digest.update(str(array.shape).encode())
+    return digest.hexdigest()
+
+
+class ProbabilityCache:
+    """
+    Raw tagger output cache keyed by (model weights hash, model variant, image content hash).
+
+    Stores the full probability vector (and the encoder embedding) as float16 so threshold changes
+    and repeated images are answered by re-thresholding instead of running the model again. Entries live in an
+    in-memory LRU and are written to disk when they fall out of it.
+    """
+
+    def __init__(
+        self, cache_dir: str = CACHE_DIR, memory_entries: int = MEMORY_ENTRIES, disk_limit_mb: int = DISK_LIMIT_MB
+    ):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.disk_limit_bytes = disk_limit_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # weights path -> (size, mtime_ns, hash), persisted so a restart doesn't rehash gigabytes
+        self._file_hashes: Dict[str, Tuple[int, int, str]] = {}
+        self._file_hashes_loaded = False
+        self._disk_writes = 0
+
+    # keys
+
+    def _file_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        with self._lock:
+            if not self._file_hashes_loaded:
+                self._load_file_hashes()
+            cached = self._file_hashes.get(path)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                return cached[2]
+
+        logging.info(f"Hashing tagger weights {path} for the result cache")
+        file_hash = _blake2b_file(path)
+        with self._lock:
+            self._file_hashes[path] = (stat.st_size, stat.st_mtime_ns, file_hash)
+            self._save_file_hashes()
+        return file_hash
+
+    def _file_hashes_path(self) -> str:
+        return os.path.join(self.cache_dir, "weights_hashes.json")
+
+    def _load_file_hashes(self):
+        self._file_hashes_loaded = True
+        try:
+            with open(self._file_hashes_path(), "r", encoding="utf-8") as f:
+                self._file_hashes = {k: tuple(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError):
+            self._file_hashes = {}
+
+    def _save_file_hashes(self):
+        if self.disk_limit_bytes <= 0:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._file_hashes_path(), "w", encoding="utf-8") as f:
+                json.dump(self._file_hashes, f)
+        except OSError as e:
+            logging.warning(f"Failed to save tagger weights hashes: {e}")
+
+    def model_key(self, handler: EndpointHandler, variant: str = "") -> str:
+        """Identifies everything that changes the raw output: weights content, backend, precision and pruning."""
+        weights_hash = self._file_hash(handler.weights_file)
+        return f"{weights_hash}-{type(handler).__name__}-{handler.precision}{handler.cache_variant}{variant}"
+
+    # storage
+
+    def _disk_path(self, key: str) -> str:
+        name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], name + ".f16")
+
+    def get(self, key: str, size: int = 0) -> Optional[np.ndarray]:
+        """size > 0 rejects (and deletes) spilled entries of another length, e.g. truncated by a crash."""
+        with self._lock:
+            probs = self._memory.get(key)
+            if probs is not None:
+                self._memory.move_to_end(key)
+                return probs
+        if self.disk_limit_bytes <= 0:
+            return None
+        path = self._disk_path(key)
+        try:
+            probs = np.fromfile(path, dtype=np.float16)
+        except OSError:
+            return None
+        if size > 0 and len(probs) != size:
+            logging.warning(f"Discarding broken tagger result cache entry {path} ({len(probs)}/{size} values)")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        self._put_memory(key, probs)
+        return probs
+
+    def put(self, key: str, probs: np.ndarray):
+        self._put_memory(key, probs.astype(np.float16, copy=False))
+
+    def _put_memory(self, key: str, probs: np.ndarray):
+        spilled = []
+        with self._lock:
+            self._memory[key] = probs
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                spilled.append(self._memory.popitem(last=False))
+        for spilled_key, spilled_probs in spilled:
+            self._spill(spilled_key, spilled_probs)
+
+    def _spill(self, key: str, probs: np.ndarray):
+        if self.disk_limit_bytes <= 0:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written next to it first, a crash or a full disk never leaves a truncated entry behind
+            probs.tofile(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logging.warning(f"Failed to write tagger result cache entry: {e}")
+            return
+        self._disk_writes += 1
+        if self._disk_writes % 256 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete the oldest spilled entries until the cache folder is under its size limit."""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith((".f16", ".f16.tmp")):
+                    path = os.path.join(root, f)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_limit_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # inference
+
+    def predict_probs(
+        self, handler: EndpointHandler, images: torch.Tensor, batch_size: int = 8, variant: str = ""
+    ) -> torch.Tensor:
+        """
+        handler.predict_probs_from_images with caching, only images not seen before with this model run through it.
+        Returns float32 probs rounded through float16 so cached and fresh results threshold identically.
+        """
+        return self.predict(handler, images, batch_size, variant)[0]
+
+    def predict(
+        self,
+        handler: EndpointHandler,
+        images: torch.Tensor,
+        batch_size: int = 8,
+        variant: str = "",
+        with_embeddings: bool = False,
+        hashes: Optional[List[str]] = None,
+        runner: Optional[Callable] = None,
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        predict_probs that can also return the encoder embeddings, cached next to the probs.
+        hashes: precomputed image_hash() of the images. Embeddings are None when the handler can't provide them.
+        runner(handler, images, batch_size) runs the uncached images, defaults to handler.predict_from_images.
+        """
+        model_key = self.model_key(handler, variant)
+        hashes = hashes or [image_hash(image) for image in images]
+        keys = [f"{model_key}-{h}" for h in hashes]
+        embedding_keys = [f"{model_key}-emb-{h}" for h in hashes]
+        with_embeddings = with_embeddings and handler.supports_embeddings
+
+        cached: List[Optional[np.ndarray]] = [self.get(key, len(handler.vocabulary)) for key in keys]
+        cached_embeddings: List[Optional[np.ndarray]] = [
+            self.get(key, _EMBEDDING_SIZE) if with_embeddings else None for key in embedding_keys
+        ]
+        missing = [
+            i
+            for i in range(len(keys))
+            if cached[i] is None or (with_embeddings and cached_embeddings[i] is None)
+        ]
+        if missing:
+            if runner is None:
+                fresh, fresh_embeddings = handler.predict_from_images(images[missing], batch_size)
+            else:
+                fresh, fresh_embeddings = runner(handler, images[missing], batch_size)
+            fresh = fresh.numpy().astype(np.float16)
+            if fresh_embeddings is None:
+                with_embeddings = False
+            for j, i in enumerate(missing):
+                self.put(keys[i], fresh[j].copy())
+                cached[i] = fresh[j]
+                if fresh_embeddings is not None:
+                    embedding = fresh_embeddings[j].numpy().astype(np.float16)
+                    self.put(embedding_keys[i], embedding)
+                    cached_embeddings[i] = embedding
+        logging.info(f"Tagger result cache: {len(keys) - len(missing)}/{len(keys)} images cached")
+
+        probs = torch.from_numpy(np.stack(cached).astype(np.float32))
+        if not with_embeddings:
+            return probs, None
+        return probs, torch.from_numpy(np.stack(cached_embeddings).astype(np.float32))
+
+
+result_cache = ProbabilityCache()
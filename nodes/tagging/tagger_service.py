@@ -0,0 +1,196 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from .inference.pixai_tagger_pth_sft import EndpointHandler, merge_views, tile_views
+from .result_cache import result_cache
+
+# requests from different node executions / HTTP calls arriving within this window are run as one batch.
+# 0 disables micro-batching, every request then runs on its own in the calling thread
+MAX_WAIT_MS = float(os.environ.get("BTK_TAGGER_BATCH_WAIT_MS", "10"))
+# upper bound of images per merged batch
+MAX_BATCH = int(os.environ.get("BTK_TAGGER_MAX_BATCH", "32"))
+# batcher threads of handlers that got no requests for this long exit, so evicted models can be freed
+_IDLE_TIMEOUT_S = 60.0
+
+Prediction = Tuple[torch.Tensor, Optional[torch.Tensor]]
+
+
+class _Request:
+    def __init__(self, inputs: torch.Tensor, batch_size: int, num_threads: int = 0):
+        self.inputs = inputs
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.future: "Future[Prediction]" = Future()
+
+
+class _Batcher:
+    """Collects requests for one handler and runs them through the model together on its own thread."""
+
+    def __init__(self, service: "TaggerService", handler: EndpointHandler):
+        self.service = service
+        self.handler = handler
+        self.queue: "queue.Queue[_Request]" = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="btk-tagger-batcher", daemon=True)
+        self.thread.start()
+
+    def _collect(self) -> List[_Request]:
+        """First request blocks (up to the idle timeout), then more are taken until the batch is full or the window ends."""
+        requests = [self.queue.get(timeout=_IDLE_TIMEOUT_S)]
+        count = requests[0].inputs.shape[0]
+        deadline = time.monotonic() + self.service.max_wait_ms / 1000
+        while count < self.service.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            count += request.inputs.shape[0]
+        return requests
+
+    def _run(self):
+        while True:
+            try:
+                requests = self._collect()
+            except queue.Empty:
+                if self.service._retire(self):
+                    return
+                continue
+
+            # smallest requested mini-batch wins, it's what the caller's memory allows
+            batch_size = min(r.batch_size for r in requests)
+            # largest requested thread count wins, 0 (the handler's default) only if nobody asked
+            num_threads = max(r.num_threads for r in requests)
+            try:
+                probs, embeddings = self.handler.predict(
+                    torch.cat([r.inputs for r in requests]), batch_size, num_threads
+                )
+            except Exception as e:
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+
+            if len(requests) > 1:
+                logging.debug(f"Tagger micro-batch: {len(requests)} requests, {probs.shape[0]} images")
+            start = 0
+            for request in requests:
+                end = start + request.inputs.shape[0]
+                request.future.set_result((probs[start:end], None if embeddings is None else embeddings[start:end]))
+                start = end
+
+
+class TaggerService:
+    """
+    Shared in-process tagger: requests for the same loaded model from node executions and the
+    /booru/tag_image route are merged into micro-batches bounded by max_wait_ms and max_batch.
+    Images are preprocessed in the calling thread (on the model device), only the model forward pass is shared.
+    """
+
+    def __init__(self, max_wait_ms: float = MAX_WAIT_MS, max_batch: int = MAX_BATCH):
+        self.max_wait_ms = max_wait_ms
+        self.max_batch = max(1, max_batch)
+        self._lock = threading.Lock()
+        self._batchers: Dict[EndpointHandler, _Batcher] = {}
+
+    def _retire(self, batcher: _Batcher) -> bool:
+        """Remove an idle batcher unless a request slipped in meanwhile."""
+        with self._lock:
+            if not batcher.queue.empty():
+                return False
+            if self._batchers.get(batcher.handler) is batcher:
+                del self._batchers[batcher.handler]
+            return True
+
+    def submit(
+        self, handler: EndpointHandler, images: torch.Tensor, batch_size: int = 8, num_threads: int = 0
+    ) -> "Future[Prediction]":
+        """Queue a ComfyUI IMAGE batch (B, H, W, C), the future resolves to (probs, embeddings) like handler.predict."""
+        with torch.inference_mode():
+            # per mini-batch on the model device, only the small model input of the whole batch is kept
+            inputs = torch.cat(list(handler.preprocess_chunks(images, batch_size)))
+        return self.submit_inputs(handler, inputs, batch_size, num_threads)
+
+    def submit_inputs(
+        self, handler: EndpointHandler, inputs: torch.Tensor, batch_size: int = 8, num_threads: int = 0
+    ) -> "Future[Prediction]":
+        """Queue already preprocessed model input (B, 3, 448, 448)."""
+        request = _Request(inputs, max(1, int(batch_size)), max(0, int(num_threads)))
+        with self._lock:
+            batcher = self._batchers.get(handler)
+            if batcher is None:
+                batcher = self._batchers[handler] = _Batcher(self, handler)
+            batcher.queue.put(request)
+        return request.future
+
+    def predict(
+        self, handler: EndpointHandler, images: torch.Tensor, batch_size: int = 8, num_threads: int = 0
+    ) -> Prediction:
+        """Blocking submit, same signature and result as handler.predict_from_images."""
+        if self.max_wait_ms <= 0 or not handler.batchable:
+            return handler.predict_from_images(images, batch_size, num_threads)
+        return self.submit(handler, images, batch_size, num_threads).result()
+
+    def predict_tiled(
+        self,
+        handler: EndpointHandler,
+        images: torch.Tensor,
+        batch_size: int = 8,
+        max_tiles: int = 4,
+        merge: str = "max",
+        num_threads: int = 0,
+    ) -> Prediction:
+        """handler.predict_tiled_from_images, with the views batched together with other requests."""
+        if self.max_wait_ms <= 0 or not handler.batchable:
+            return handler.predict_tiled_from_images(images, batch_size, max_tiles, merge, num_threads)
+        views = tile_views(images.shape[1], images.shape[2], max_tiles)
+        with torch.inference_mode():
+            # like submit, only the small model input of the whole batch is kept
+            inputs = torch.cat(list(handler.tiled_chunks(images, batch_size, max_tiles)))
+        probs, embeddings = self.submit_inputs(handler, inputs, batch_size, num_threads).result()
+        return merge_views(probs, embeddings, views, merge)
+
+
+tagger_service = TaggerService()
+
+
+def run_tagger(
+    handler: EndpointHandler,
+    images: torch.Tensor,
+    batch_size: int = 8,
+    use_cache: bool = True,
+    hashes: Optional[List[str]] = None,
+    max_tiles: int = 0,
+    tile_merge: str = "max",
+    num_threads: int = 0,
+) -> Prediction:
+    """
+    (probs, embeddings) for an IMAGE batch through the result cache (optional) and the shared service.
+    max_tiles > 0 adds up to that many aspect preserving crops per image (see predict_tiled_from_images).
+    num_threads: torch intra-op threads for this call, 0 = torch's default.
+    """
+    if max_tiles > 0:
+        variant = f"-tiled{max_tiles}{tile_merge}"
+
+        def runner(handler, images, batch_size):
+            return tagger_service.predict_tiled(handler, images, batch_size, max_tiles, tile_merge, num_threads)
+
+    else:
+        variant = ""
+
+        def runner(handler, images, batch_size):
+            return tagger_service.predict(handler, images, batch_size, num_threads)
+
+    if use_cache:
+        return result_cache.predict(
+            handler, images, batch_size, variant=variant, with_embeddings=True, hashes=hashes, runner=runner
+        )
+    return runner(handler, images, batch_size)
@@ -0,0 +1,338 @@
+"""
+Out-of-process tagger workers.
+
+With BTK_TAGGER_WORKERS > 0 the tagger models are loaded in that many worker processes instead of
+ComfyUI's process. Images are handed over through shared memory as uint8, results come back over a
+local authenticated connection. Workers are started on first use, pinged while idle and restarted
+when they die or hang, so a crashing model doesn't take the server down.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+from .inference import pixai_tagger_pth_sft
+from .inference.pixai_tagger_onnx import INT8_SUFFIX
+from .inference.pixai_tagger_pth_sft import EndpointHandler, merge_views, tile_views
+
+# number of worker processes, 0 runs the tagger in ComfyUI's process. Every worker loads its own copy of the models
+WORKERS = int(os.environ.get("BTK_TAGGER_WORKERS", "0"))
+# intra-op threads per worker, 0 splits the CPU cores between the workers
+WORKER_THREADS = int(os.environ.get("BTK_TAGGER_WORKER_THREADS", "0"))
+# a request (including loading the model on first use) taking longer than this restarts the worker
+WORKER_TIMEOUT_S = float(os.environ.get("BTK_TAGGER_WORKER_TIMEOUT", "600"))
+HEALTH_CHECK_INTERVAL_S = 30.0
+_START_TIMEOUT_S = 60.0
+_PING_TIMEOUT_S = 10.0
+
+_NODES_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+# the worker imports this package under its own name, "nodes" would clash with ComfyUI's nodes.py
+_BOOTSTRAP = (
+    "import importlib, sys, types\n"
+    "package = types.ModuleType('btk_nodes')\n"
+    f"package.__path__ = [{_NODES_DIR!r}]\n"
+    "sys.modules['btk_nodes'] = package\n"
+    "importlib.import_module('btk_nodes.tagging.worker_pool').worker_main()\n"
+)
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach without handing the segment to this process' resource tracker, the parent owns and unlinks it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class _Worker:
+    """One worker process and its connection, used by one request at a time."""
+
+    def __init__(self, index: int, threads: int):
+        self.index = index
+        self.threads = threads
+        self.process: Optional[subprocess.Popen] = None
+        self.conn = None
+
+    def start(self):
+        authkey = secrets.token_bytes(32)
+        with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+            env = dict(os.environ, BTK_TAGGER_WORKERS="0", BTK_TAGGER_PRELOAD="")
+            self.process = subprocess.Popen([sys.executable, "-c", _BOOTSTRAP], stdin=subprocess.PIPE, env=env)
+            # the secret goes through stdin instead of the (visible) command line
+            self.process.stdin.write(
+                json.dumps({"address": listener.address, "authkey": authkey.hex(), "threads": self.threads}).encode()
+            )
+            self.process.stdin.close()
+
+            accepted = []
+            accept_thread = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+            accept_thread.start()
+            accept_thread.join(_START_TIMEOUT_S)
+        if not accepted:
+            self.stop()
+            raise RuntimeError(f"Tagger worker {self.index} didn't start")
+        self.conn = accepted[0]
+        logging.info(f"Started tagger worker {self.index} (pid {self.process.pid}, {self.threads} threads)")
+
+    def stop(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def alive(self) -> bool:
+        return self.conn is not None and self.process is not None and self.process.poll() is None
+
+    def call(self, message: Dict, timeout: float) -> Dict:
+        """Send one request and wait for its reply. Connection problems and timeouts raise ConnectionError."""
+        if not self.alive():
+            raise ConnectionError(f"Tagger worker {self.index} is not running")
+        try:
+            self.conn.send(message)
+            if not self.conn.poll(timeout):
+                raise ConnectionError(f"Tagger worker {self.index} timed out after {timeout:.0f}s")
+            reply = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise ConnectionError(f"Tagger worker {self.index} died: {e}") from e
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply
+
+
+class WorkerPool:
+    def __init__(self, num_workers: int = WORKERS, threads_per_worker: int = WORKER_THREADS):
+        self.num_workers = max(0, num_workers)
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // max(1, self.num_workers))
+        self._lock = threading.Lock()
+        self._workers = []
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._health_thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.num_workers > 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = _Worker(i, self.threads_per_worker)
+                self._start_worker(worker)
+                self._workers.append(worker)
+                self._idle.put(worker)
+            self._health_thread = threading.Thread(target=self._health_loop, name="btk-tagger-health", daemon=True)
+            self._health_thread.start()
+            atexit.register(self.shutdown)
+
+    @staticmethod
+    def _start_worker(worker: _Worker):
+        try:
+            worker.restart()
+        except Exception as e:
+            # stays in the pool, the next request or health check tries again
+            logging.error(f"Failed to start tagger worker {worker.index}: {e}")
+
+    def _health_loop(self):
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL_S)
+            # only idle workers are checked, busy ones are covered by the request timeout
+            for _ in range(self._idle.qsize()):
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    worker.call({"op": "ping"}, _PING_TIMEOUT_S)
+                except (ConnectionError, RuntimeError) as e:
+                    logging.warning(f"Tagger worker {worker.index} failed its health check, restarting: {e}")
+                    self._start_worker(worker)
+                finally:
+                    self._idle.put(worker)
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+            self._workers = []
+
+    def predict(
+        self, handler: "RemoteHandler", images: torch.Tensor, batch_size: int, preprocessed: bool
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        Run a request on the next free worker. Raw IMAGE batches travel as uint8, preprocessed model input as float32.
+        A worker that dies or hangs is restarted and the request retried once on the next free worker.
+        """
+        self._ensure_started()
+        if preprocessed:
+            array = images.float().contiguous().numpy()
+        else:
+            array = images.clamp(0.0, 1.0).mul(255).round_().to(torch.uint8).contiguous().numpy()
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        try:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+            message = {
+                "op": "predict",
+                "model_info": handler.model_info,
+                "backend": handler.backend,
+                "options": handler.options,
+                "prune_tags": handler.prune_tags,
+                "shm": shm.name,
+                "shape": array.shape,
+                "dtype": array.dtype.str,
+                "batch_size": batch_size,
+            }
+            for attempt in range(2):
+                worker = self._idle.get()
+                try:
+                    reply = worker.call(message, WORKER_TIMEOUT_S)
+                    break
+                except ConnectionError as e:
+                    logging.warning(f"{e}, restarting it")
+                    self._start_worker(worker)
+                    if attempt == 1:
+                        raise RuntimeError(f"Tagger workers failed to run the request: {e}") from e
+                finally:
+                    self._idle.put(worker)
+        finally:
+            shm.close()
+            shm.unlink()
+
+        embeddings = reply["embeddings"]
+        return torch.from_numpy(reply["probs"]), None if embeddings is None else torch.from_numpy(embeddings)
+
+
+worker_pool = WorkerPool()
+
+
+class RemoteHandler(EndpointHandler):
+    """
+    Handler whose model runs in the worker pool. Only the tag tables are loaded in this process,
+    thresholding and post-processing stay local.
+    """
+
+    # the workers already run requests in parallel, micro-batching them here would serialize them again
+    batchable = False
+    supports_embeddings = True
+
+    def __init__(self, pool: WorkerPool, model_info: Dict[str, str], backend: str, model_file: str, options: Dict):
+        self._check_files(model_file, model_info["tags"], model_info["mapping"])
+        self.pool = pool
+        self.model_info = model_info
+        self.backend = backend
+        self.options = options
+        self.weights_file = model_file
+        if backend == "onnx":
+            self.precision = "int8" if model_file.endswith(INT8_SUFFIX) else "fp32"
+        else:
+            self.precision = options.get("precision", "fp32")
+        self.device = "cpu"
+        self.channels_last = False
+        self.model = None
+        # tag names the worker prunes its handler to, None = all
+        self.prune_tags = None
+        self._init_common(model_info["tags"], model_info["mapping"])
+
+    def model_nbytes(self) -> int:
+        return 0
+
+    def _prune_model(self, indices: np.ndarray):
+        # called on the pruned view, its vocabulary is already the subset
+        self.prune_tags = self.vocabulary.tag_names.tolist()
+
+    # num_threads is ignored, the workers keep the thread count they were started with
+
+    def predict(
+        self, image_tensor: torch.Tensor, batch_size: int = 8, num_threads: int = 0
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        return self.pool.predict(self, image_tensor, batch_size, preprocessed=True)
+
+    def predict_from_images(
+        self, images: torch.Tensor, batch_size: int = 8, num_threads: int = 0
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        return self.pool.predict(self, images, batch_size, preprocessed=False)
+
+    def predict_tiled_from_images(
+        self, images: torch.Tensor, batch_size: int = 8, max_tiles: int = 4, merge: str = "max", num_threads: int = 0
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        # the views are made here and sent to a worker as one preprocessed batch
+        views = tile_views(images.shape[1], images.shape[2], max_tiles)
+        with torch.inference_mode():
+            inputs = torch.cat(list(self.tiled_chunks(images, batch_size, max_tiles)))
+        probs, embeddings = self.predict(inputs, batch_size)
+        return merge_views(probs, embeddings, views, merge)
+
+
+def _handle_predict(message: Dict, model_manager) -> Dict:
+    handler = model_manager.get_handler(message["model_info"], backend=message["backend"], **message["options"])
+    if message["prune_tags"]:
+        handler = handler.pruned(message["prune_tags"])
+
+    shm = _attach_shared_memory(message["shm"])
+    try:
+        array = np.ndarray(message["shape"], dtype=np.dtype(message["dtype"]), buffer=shm.buf)
+        if array.dtype == np.uint8:
+            images = torch.from_numpy(array).float().div_(255)
+        else:
+            images = torch.from_numpy(array.copy())
+        del array
+    finally:
+        shm.close()
+
+    if message["dtype"] == np.dtype(np.uint8).str:
+        probs, embeddings = handler.predict_from_images(images, message["batch_size"])
+    else:
+        probs, embeddings = handler.predict(images, message["batch_size"])
+    return {"probs": probs.numpy(), "embeddings": None if embeddings is None else embeddings.numpy()}
+
+
+def worker_main():
+    """Entry point of a worker process, serves requests until the parent closes the connection."""
+    logging.basicConfig(level=logging.INFO, format="[tagger worker %(process)d] %(message)s")
+    config = json.loads(sys.stdin.read())
+    torch.set_num_threads(config["threads"])
+    # handlers without their own thread count go back to the worker's share instead of torch's default
+    pixai_tagger_pth_sft.DEFAULT_NUM_THREADS = config["threads"]
+    conn = Client(tuple(config["address"]), authkey=bytes.fromhex(config["authkey"]))
+
+    from .model_manager import model_manager
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            if message["op"] == "ping":
+                reply = {"ok": True}
+            else:
+                reply = _handle_predict(message, model_manager)
+        except Exception as e:
+            logging.exception("Tagger worker request failed")
+            reply = {"error": f"{type(e).__name__}: {e}"}
+        conn.send(reply)
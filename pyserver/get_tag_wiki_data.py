@@ -1,9 +1,12 @@
 import re
+from urllib.parse import urlencode
 
-import requests
 from aiohttp import web
+from curl_cffi.requests.exceptions import HTTPError
 from server import PromptServer
 
+from ..nodes.booru_posts.http_client import http_client
+
 headers = {"User-Agent": "ComfyUI_e621_booru_toolkit/1.0 (by draconicdragon on github)"}
 
 
@@ -29,7 +32,8 @@ async def fetch_wiki_data(tags, booru, extended_info):
         return {"status": "success", "data": "Invalid booru selection"}
 
     try:
-        response = requests.get(url, headers=headers, params=params)
+        # awaited on the caller's loop, so the route doesn't block the server while waiting
+        response = await http_client.get(f"{url}?{urlencode(params)}", headers=headers)
         response.raise_for_status()  # raises HTTPError for 4xx or 5xx
 
         result = ""
@@ -61,7 +65,7 @@ async def fetch_wiki_data(tags, booru, extended_info):
             else:
                 return {"status": "success", "data": result}
 
-    except requests.exceptions.HTTPError as e:
+    except HTTPError as e:
         raise RuntimeError(f"Error occurred: {e} - Code: {response.status_code} - Response: {response.text}")
 
 
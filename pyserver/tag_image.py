@@ -0,0 +1,139 @@
+import asyncio
+import base64
+import io
+import ipaddress
+import json
+import os
+import socket
+from urllib.parse import urlparse
+
+import requests
+from aiohttp import web
+from PIL import Image
+from server import PromptServer
+
+from ..nodes.booru_posts.booru_post_handlers.handler_registry import registry
+from ..nodes.misc.utils import to_tensor
+from ..nodes.tagging.model_manager import model_index, model_manager
+from ..nodes.tagging.tagger_service import run_tagger
+
+headers = {"User-Agent": "ComfyUI_e621_booru_toolkit/1.0 (by draconicdragon on github)"}
+# largest image the route accepts, as base64 data or downloaded from a URL
+MAX_IMAGE_BYTES = int(os.environ.get("BTK_TAG_IMAGE_MAX_MB", "50")) * 1024 * 1024
+
+
+def _check_image_url(url: str):
+    """
+    Only http(s) URLs of known booru hosts that resolve to public addresses are downloaded,
+    so the route can't be used to make the server request internal or loopback addresses.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("Only http(s) image URLs are accepted")
+    if registry.get_handler_for_url(url) is None:
+        raise ValueError(f"{parsed.hostname} isn't a known booru host, send the image data instead")
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or 443, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise ValueError(f"Can't resolve {parsed.hostname}: {e}")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"{parsed.hostname} resolves to a non-public address")
+
+
+def _download_image(url: str) -> bytes:
+    _check_image_url(url)
+    # redirects aren't followed, they could lead anywhere
+    with requests.get(url, headers=headers, timeout=10, stream=True, allow_redirects=False) as response:
+        if response.is_redirect:
+            raise ValueError(f"Image URL redirects elsewhere: {url}")
+        response.raise_for_status()
+        if int(response.headers.get("Content-Length") or 0) > MAX_IMAGE_BYTES:
+            raise ValueError(f"Image is larger than {MAX_IMAGE_BYTES // 1024**2} MB")
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data += chunk
+            if len(data) > MAX_IMAGE_BYTES:
+                raise ValueError(f"Image is larger than {MAX_IMAGE_BYTES // 1024**2} MB")
+    return bytes(data)
+
+
+def _load_image(data) -> Image.Image:
+    if image_base64 := data.get("image"):
+        # allow data urls from the frontend
+        image_base64 = image_base64.split(",")[-1]
+        if len(image_base64) // 4 * 3 > MAX_IMAGE_BYTES:
+            raise ValueError(f"Image is larger than {MAX_IMAGE_BYTES // 1024**2} MB")
+        return Image.open(io.BytesIO(base64.b64decode(image_base64)))
+    if url := data.get("url"):
+        return Image.open(io.BytesIO(_download_image(url)))
+    raise ValueError("No image or url provided")
+
+
+def _tag(data) -> dict:
+    """Blocking part of the route: image decoding, model loading and the (micro-batched) inference."""
+    model_info = model_index.get_model(data.get("model", ""))
+    if not model_info:
+        models = model_index.get_models()
+        if not models or data.get("model"):
+            raise ValueError(f"Model '{data.get('model')}' not found")
+        model_info = models[0]
+
+    num_threads = int(data.get("num_threads", 0))
+    # same options as the tagger node, so both use (and micro-batch on) the same loaded handler
+    handler = model_manager.get_handler(
+        model_info,
+        backend=data.get("backend", "auto"),
+        precision=data.get("precision", "fp32"),
+        compile_model=bool(data.get("compile_model", False)),
+        num_threads=num_threads,
+        channels_last=bool(data.get("channels_last", False)),
+    )
+    if allow_list := data.get("tag_allow_list", ""):
+        handler = handler.pruned(allow_list.split(","))
+
+    image = to_tensor(_load_image(data))
+    probs, _ = run_tagger(
+        handler,
+        image,
+        use_cache=data.get("use_cache", True),
+        max_tiles=int(data.get("max_tiles", 0)),
+        tile_merge=data.get("tile_merge", "max"),
+        num_threads=num_threads,
+    )
+    (tags,) = handler.postprocess(
+        probs,
+        float(data.get("general_threshold", 0.35)),
+        float(data.get("character_threshold", 0.85)),
+        top_k=int(data.get("top_k", 0)),
+        sort_by=data.get("sort_by", "alphabetical"),
+    )
+    return {
+        "status": "success",
+        "model": model_info["label"],
+        "general": tags["feature"],
+        "character": tags["character"],
+        "ip": tags["ip"],
+        "confidence": {
+            "general": tags["confidence"]["feature"],
+            "character": tags["confidence"]["character"],
+            "ip": tags["confidence"]["ip"],
+        },
+    }
+
+
+# tag a single image from the frontend or an external client, requests arriving at the same time
+# (and from running tagger nodes) share model batches through the tagger service
+@PromptServer.instance.routes.post("/booru/tag_image")
+async def handle_tag_image(request):
+    try:
+        data = await request.json()
+        # off the event loop, the server keeps answering while the model runs
+        result = await asyncio.get_running_loop().run_in_executor(None, _tag, data)
+        return web.json_response(result)
+
+    except (ValueError, json.JSONDecodeError) as e:
+        return web.json_response({"error": str(e), "status": "error"}, status=400)
+    except Exception as e:
+        return web.json_response({"error": str(e), "status": "error"}, status=500)